@@ -8,21 +8,28 @@
 .. moduleauthor:: Mike Grima <mikegrima> @THISisPLACEHLDR
 """
 import os
+import sys
 import math
-import psutil
+import inspect
 import logging
+import threading
 import functools
-from threading import Timer
 
-from raven.base import Client
-from raven.conf import setup_logging
-from raven.utils.conf import convert_options
-from raven.transport.http import HTTPTransport
-from raven.handlers.logging import SentryHandler
+from raven_python_lambda import metrics, registry, sources, telemetry
+from raven_python_lambda.compat import monotonic
+from raven_python_lambda.breadcrumbs import get_log_buffer, log_breadcrumbs
+from raven_python_lambda.invocation import Invocation, activate, current_invocation, deactivate
+from raven_python_lambda.lazy import LazyClient, LazySentryHandler, setup_logging
+from raven_python_lambda.snapshot import ContextSnapshot, snapshot_from_config
+from raven_python_lambda.dedup import get_rate_limiter
+from raven_python_lambda.spool import get_spool
+from raven_python_lambda.memory import MB, WARNED_INTERVAL, MemorySampler, get_memory_tracker, next_interval
+from raven_python_lambda.watchdog import TimerGroup
+from raven_python_lambda.workers import capture_in_worker, install_fork_hook, send_worker_event, worker_events
+
+# raven, boto3 and psutil are imported where they are first needed, keeping them
+# off the cold start of functions that never report anything.
 
-from raven_python_lambda.sqs_transport import SQSTransport
-
-logging.basicConfig()
 logger = logging.getLogger(__file__)
 
 
@@ -43,8 +50,37 @@ def extract_log_level_from_environment(k, default):
     return log_levels.get(os.environ.get(k)) or int(os.environ.get(k, default))
 
 
-def configure_raven_client(config):
-    defaults = {
+def listval(v):
+    if isinstance(v, (list, tuple, set, frozenset)):
+        return list(v)
+    return [i.strip() for i in (v or '').split(',') if i.strip()]
+
+
+def select_transport(dsn, keepalive=False):
+    """Picks the transport class for a DSN, only importing boto3 for SQS DSNs."""
+    if "sqs_name" in (dsn or ""):
+        from raven_python_lambda.sqs_transport import SQSTransport
+        return SQSTransport
+
+    if keepalive:
+        from raven_python_lambda.http_transport import KeepAliveHTTPTransport
+        return KeepAliveHTTPTransport
+
+    from raven.transport.http import HTTPTransport
+    return HTTPTransport
+
+
+# Wrapper options that change how the client or its transport is built. Together with
+# the SENTRY_* / RAVEN_* overrides they decide whether two wrappers can share a client.
+CLIENT_CONFIG_KEYS = ('is_local', 'keepalive', 'background_send', 'background_queue_size',
+                      'spool', 'spool_dir', 'spool_max_bytes', 'log_breadcrumbs', 'extension', 'extension_socket',
+                      'locals_budget', 'locals_max_bytes', 'locals_max_var_bytes', 'locals_skip_types',
+                      'circuit_breaker', 'circuit_failures', 'circuit_slow_send', 'circuit_cool_off')
+
+
+def client_defaults(config):
+    dsn = config.get('SENTRY_DSN', os.environ.get('SENTRY_DSN'))
+    return {
         'include_paths': (
             set(config.get('SENTRY_INCLUDE_PATHS', []))
         ),
@@ -62,16 +98,88 @@ def configure_raven_client(config):
             'alias': os.environ.get('SERVERLESS_ALIAS'),
             'region': os.environ.get('SERVERLESS_REGION') or os.environ.get('AWS_REGION')
         },
-        'transport': SQSTransport if "sqs_name" in os.environ.get('SENTRY_DSN', "") else HTTPTransport,
-        'dsn': os.environ.get('SENTRY_DSN')
+        'dsn': dsn
     }
 
-    return Client(
+
+def client_key(config):
+    """The effective configuration of the client a wrapper with this config would build."""
+    overrides = dict((k, v) for k, v in config.items()
+                     if k.startswith(('SENTRY_', 'RAVEN_')) or k in CLIENT_CONFIG_KEYS)
+    return registry.freeze((client_defaults(config), overrides))
+
+
+def share_transport(client):
+    """
+    Points the client at the process-wide transport instance for its DSN, so clients
+    that only differ in options still share connections (and SQS queue urls, ...).
+    """
+    remote = client.remote
+    if not remote.store_endpoint:
+        return
+
+    key = registry.freeze((remote.base_url, remote.project, remote.public_key,
+                           remote._transport_cls, remote.options))
+    remote._transport = registry.transports.get(key, lambda: remote._transport_cls(**remote.options))
+
+
+def configure_raven_client(config):
+    from raven.base import Client
+    from raven.utils.conf import convert_options
+
+    defaults = client_defaults(config)
+    defaults['transport'] = select_transport(defaults['dsn'], config.get('keepalive', False))
+
+    client = Client(
         **convert_options(
             config,
             defaults=defaults
         )
     )
+    if config.get('log_breadcrumbs'):
+        # log records are kept per invocation instead, see `raven_python_lambda.breadcrumbs`
+        from raven_python_lambda.breadcrumbs import replace_raven_log_breadcrumbs
+        replace_raven_log_breadcrumbs()
+    if config.get('locals_budget'):
+        # locals are serialized within a byte budget for the whole event, see `raven_python_lambda.frames`
+        from raven_python_lambda.frames import DEFAULT_SKIP_TYPES, install_locals_budget
+        install_locals_budget(
+            client,
+            max_bytes=config.get('locals_max_bytes', 16384),
+            max_var_bytes=config.get('locals_max_var_bytes', 2048),
+            skip_types=DEFAULT_SKIP_TYPES + tuple(config.get('locals_skip_types') or ()),
+        )
+    share_transport(client)
+
+    from raven_python_lambda.transports import LatencyTransport, install_transport_wrapper
+    install_transport_wrapper(client, LatencyTransport)
+
+    if config.get('circuit_breaker'):
+        # sends fail fast (or are spooled) while Sentry or SQS is down, see `raven_python_lambda.circuit`
+        from raven_python_lambda.circuit import CircuitBreakerTransport
+        install_transport_wrapper(client, CircuitBreakerTransport,
+                                  failure_threshold=config.get('circuit_failures', 5),
+                                  slow_send=config.get('circuit_slow_send', 500) / 1000.0,
+                                  cool_off=config.get('circuit_cool_off', 30000) / 1000.0)
+
+    if config.get('spool'):
+        from raven_python_lambda.transports import SpoolTransport
+        spool = get_spool(config.get('spool_dir', '/tmp/raven-spool'), config.get('spool_max_bytes', 10485760))
+        install_transport_wrapper(client, SpoolTransport, spool)
+
+    if config.get('extension'):
+        # events are written to the extension's socket and delivered from there,
+        # see `raven_python_lambda.extension`
+        from raven_python_lambda.extension import ExtensionTransport
+        install_transport_wrapper(client, ExtensionTransport,
+                                  config.get('extension_socket', '/tmp/raven-extension.sock'))
+        return client
+
+    if config.get('background_send'):
+        from raven_python_lambda.background import BackgroundTransport
+        install_transport_wrapper(client, BackgroundTransport, queue_size=config.get('background_queue_size', 100))
+
+    return client
 
 
 class RavenLambdaWrapper(object):
@@ -100,11 +208,22 @@ class RavenLambdaWrapper(object):
 
     """
     def __init__(self, config=None):
+        # deferred from import time; a no-op on Lambda, whose runtime configures the root logger
+        logging.basicConfig()
         self.config = {
             'capture_timeout_warnings': boolval(os.environ.get('SENTRY_CAPTURE_TIMEOUTS', True)),
             'timeout_warning_threshold': float(os.environ.get('SENTRY_TIMEOUT_THRESHOLD', 0.50)),
             'capture_memory_warnings': boolval(os.environ.get('SENTRY_CAPTURE_MEMORY', True)),
             'memory_warning_threshold': float(os.environ.get('SENTRY_MEMORY_THRESHOLD', 0.75)),
+            'capture_memory_leaks': boolval(os.environ.get('SENTRY_CAPTURE_MEMORY_LEAKS', True)),
+            'telemetry': boolval(os.environ.get('SENTRY_TELEMETRY', False)),
+            'capture_slow_invocations': boolval(os.environ.get('SENTRY_CAPTURE_SLOW_INVOCATIONS', False)),
+            'slow_invocation_percentile': float(os.environ.get('SENTRY_SLOW_INVOCATION_PERCENTILE', 99)),
+            'slow_invocation_window': int(os.environ.get('SENTRY_SLOW_INVOCATION_WINDOW', 100)),
+            'metrics': boolval(os.environ.get('SENTRY_METRICS', False)),
+            'metrics_namespace': os.environ.get('SENTRY_METRICS_NAMESPACE', 'RavenPythonLambda'),
+            'memory_leak_window': int(os.environ.get('SENTRY_MEMORY_LEAK_WINDOW', 20)),
+            'memory_leak_horizon': int(os.environ.get('SENTRY_MEMORY_LEAK_HORIZON', 100)),
             'capture_unhandled_exceptions': boolval(os.environ.get('SENTRY_CAPTURE_UNHANDLED', True)),
             'auto_bread_crumbs': boolval(os.environ.get('SENTRY_AUTO_BREADCRUMBS', True)),
             'capture_errors': boolval(os.environ.get('SENTRY_CAPTURE_ERRORS', True)),
@@ -113,6 +232,41 @@ class RavenLambdaWrapper(object):
             'logging': boolval(os.environ.get('SENTRY_CAPTURE_LOGS', True)),
             'log_level': extract_log_level_from_environment('SENTRY_LOG_LEVEL', logging.WARNING),
             'enabled': boolval(os.environ.get('SENTRY_ENABLED', True)),
+            'log_breadcrumbs': boolval(os.environ.get('SENTRY_LOG_BREADCRUMBS', False)),
+            'log_breadcrumbs_level': extract_log_level_from_environment('SENTRY_LOG_BREADCRUMBS_LEVEL', logging.INFO),
+            'log_breadcrumbs_size': int(os.environ.get('SENTRY_LOG_BREADCRUMBS_SIZE', 100)),
+            'keepalive': boolval(os.environ.get('SENTRY_KEEPALIVE', False)),
+            'eager_init': boolval(os.environ.get('SENTRY_EAGER_INIT', False)),
+            'background_send': boolval(os.environ.get('SENTRY_BACKGROUND_SEND', False)),
+            'background_queue_size': int(os.environ.get('SENTRY_BACKGROUND_QUEUE_SIZE', 100)),
+            'flush_safety_margin': int(os.environ.get('SENTRY_FLUSH_SAFETY_MARGIN', 300)),
+            'timeout_margin': int(os.environ.get('SENTRY_TIMEOUT_MARGIN', 500)),
+            'spool': boolval(os.environ.get('SENTRY_SPOOL', False)),
+            'spool_dir': os.environ.get('SENTRY_SPOOL_DIR', '/tmp/raven-spool'),
+            'spool_max_bytes': int(os.environ.get('SENTRY_SPOOL_MAX_BYTES', 10485760)),
+            'spool_drain_budget': int(os.environ.get('SENTRY_SPOOL_DRAIN_BUDGET', 250)),
+            'extension': boolval(os.environ.get('SENTRY_EXTENSION', False)),
+            'extension_socket': os.environ.get('SENTRY_EXTENSION_SOCKET', '/tmp/raven-extension.sock'),
+            'circuit_breaker': boolval(os.environ.get('SENTRY_CIRCUIT_BREAKER', False)),
+            'circuit_failures': int(os.environ.get('SENTRY_CIRCUIT_FAILURES', 5)),
+            'circuit_slow_send': int(os.environ.get('SENTRY_CIRCUIT_SLOW_SEND', 500)),
+            'circuit_cool_off': int(os.environ.get('SENTRY_CIRCUIT_COOL_OFF', 30000)),
+            'locals_budget': boolval(os.environ.get('SENTRY_LOCALS_BUDGET', False)),
+            'locals_max_bytes': int(os.environ.get('SENTRY_LOCALS_MAX_BYTES', 16384)),
+            'locals_max_var_bytes': int(os.environ.get('SENTRY_LOCALS_MAX_VAR_BYTES', 2048)),
+            'locals_skip_types': listval(os.environ.get('SENTRY_LOCALS_SKIP_TYPES')),
+            'snapshot_max_bytes': int(os.environ.get('SENTRY_SNAPSHOT_MAX_BYTES', 16384)),
+            'snapshot_max_depth': int(os.environ.get('SENTRY_SNAPSHOT_MAX_DEPTH', 6)),
+            'snapshot_max_list_length': int(os.environ.get('SENTRY_SNAPSHOT_MAX_LIST_LENGTH', 50)),
+            'snapshot_redact_keys': listval(os.environ.get(
+                'SENTRY_SNAPSHOT_REDACT_KEYS', 'authorization,cookie,password,secret,token')),
+            'batch_concurrency': int(os.environ.get('SENTRY_BATCH_CONCURRENCY', 1)),
+            'capture_workers': boolval(os.environ.get('SENTRY_CAPTURE_WORKERS', True)),
+            'dedup': boolval(os.environ.get('SENTRY_DEDUP', False)),
+            'dedup_window': float(os.environ.get('SENTRY_DEDUP_WINDOW', 60)),
+            'dedup_burst': int(os.environ.get('SENTRY_DEDUP_BURST', 1)),
+            'dedup_cache_size': int(os.environ.get('SENTRY_DEDUP_CACHE_SIZE', 256)),
+            'dedup_frames': int(os.environ.get('SENTRY_DEDUP_FRAMES', 5)),
         }
         self.config.update(config or {})
 
@@ -123,152 +277,559 @@ class RavenLambdaWrapper(object):
             return
 
         if self.config.get('raven_client'):
+            from raven.base import Client
             assert self.config.get('raven_client') and not isinstance(self.config.get('raven_client'), Client)
         else:
-            self.config['raven_client'] = configure_raven_client(self.config)
+            # shared by every wrapper with the same effective configuration and built
+            # on first use, see `raven_python_lambda.registry` and `raven_python_lambda.lazy`
+            self.config['raven_client'] = registry.clients.get(
+                client_key(self.config),
+                lambda: LazyClient(functools.partial(configure_raven_client, dict(self.config)))
+            )
+
+        self.rate_limiter = None
+        if self.config['dedup']:
+            self.rate_limiter = get_rate_limiter(
+                self.config['dedup_window'],
+                self.config['dedup_burst'],
+                self.config['dedup_cache_size'],
+                self.config['dedup_frames'],
+            )
+
+        if self.config['eager_init'] and self.config['raven_client']:
+            # build the client and its transport now, during the init phase, which runs
+            # with a CPU boost and isn't billed per invocation
+            from raven_python_lambda.transports import warm_transport
+            client = self.config['raven_client']
+            warm_transport(client.get_client() if isinstance(client, LazyClient) else client)
+
+        if self.config['capture_workers']:
+            # forked pool workers start over with clients of their own, see `raven_python_lambda.workers`
+            install_fork_hook()
+
+        if self.config['telemetry']:
+            telemetry.install_gc_callback()
+
+        if self.config['metrics']:
+            # written to stdout as CloudWatch metrics, see `raven_python_lambda.metrics`
+            metrics.enable(self.config['metrics_namespace'])
+
+        self.log_buffer = None
+        if self.config['log_breadcrumbs']:
+            self.log_buffer = get_log_buffer(self.config['log_breadcrumbs_size'], self.config['log_breadcrumbs_level'])
 
         if self.config['logging'] and self.config['raven_client']:
-            handler = SentryHandler(self.config['raven_client'])
+            handler = LazySentryHandler(self.config['raven_client'])
             handler.setLevel(self.config['log_level'])
             setup_logging(handler)
 
     def __call__(self, fn):
-        """Wraps our function with the necessary raven context."""
+        """
+        Wraps our function with the necessary raven context. Coroutine functions are
+        wrapped as coroutine functions, see `raven_python_lambda.aio`.
+        """
+        if is_coroutine_function(fn):
+            from raven_python_lambda.aio import wrap_coroutine_function
+            return wrap_coroutine_function(self, fn)
+
         @functools.wraps(fn)
         def decorated(event, context):
             if not self.config["enabled"]:
                 return fn(event, context)
 
-            self.context = context
-
-            raven_context = {
-                'extra': {
-                    'event': event,
-                    'context': context,
-                },
-                'tags': {}
-            }
-
-            # Gather identity information from context if possible
-            if event.get('requestContext'):
-                identity = event['requestContext']['identity']
-                if identity:
-                    raven_context['user'] = {
-                         'id': identity.get('cognitoIdentityId', None),
-                         'username': identity.get('user', None),
-                         'ip_address': identity.get('sourceIp', None),
-                         'cognito_identity_pool_id': identity.get('cognitoIdentityPoolId', None),
-                         'cognito_authentication_type': identity.get('cognitoAuthenticationType', None),
-                         'user_agent': identity.get('userAgent')
-                     }
-
-                # Add additional tags for AWS_PROXY endpoints
-                raven_context['tags'] = {
-                    'api_id': event['requestContext']['apiId'],
-                    'api_stage': event['requestContext']['stage'],
-                    'http_method': event['requestContext']['httpMethod']
-                }
-
-            # Add cloudwatch event context
-            if event.get('detail'):
-                raven_context = {'tags': {}}
-                if event.get('userIdentity'):
-                    raven_context['tags']['cloudwatch_principal_id'] = event['userIdentity']['principalId']
-                if event.get('awsRegion'):
-                    raven_context['tags']['cloudwatch_region'] = event['awsRegion']
+            invocation = self.start_invocation(event, context)
+            token = activate(invocation)
 
             # rethrow exception to halt lambda execution
-            timers = []
+            timers = None
             try:
-                if self.config.get('auto_bread_crumbs'):
-                    # first breadcrumb is the invocation of the lambda itself
-                    breadcrumb = {
-                        'message': os.environ.get('AWS_LAMBDA_FUNCTION_NAME', 'local'),
-                        'category': 'lambda',
-                        'level': 'info',
-                        'data': {}
-                    }
-
-                    if event.get('requestContext'):
-                        breadcrumb['data'] = {
-                            'http_method': event['requestContext']['httpMethod'],
-                            'host': (event['headers'] or {}).get('Host'),
-                            'path': event['path']
-                        }
-
-                    self.config['raven_client'].captureBreadcrumb(**breadcrumb)
-
                 # install our timers
-                timers = install_timers(self.config, context)
+                timers = install_timers(self.config, context, invocation.raven_context, invocation.memory,
+                                        threading.current_thread().ident)
 
                 # invoke the original function
                 return fn(event, context)
             except Exception as e:
-                self.config['raven_client'].captureException()
+                self.capture_exception(invocation)
                 raise e
             finally:
-                for t in timers:
-                    t.cancel()
+                deactivate(token)
+                self.finish_invocation(invocation, timers)
+                flush_transport(self.config, context)
+                emit_metrics(self.config)
 
         return decorated
 
+    def start_invocation(self, event, context):
+        """
+        Sets up the raven context for an invocation and records its breadcrumb.
+        Returns the `Invocation`, see `raven_python_lambda.invocation`.
+        """
+        if self.log_buffer is not None:
+            self.log_buffer.clear()
+
+        # The event and context are only serialized if something is captured,
+        # see `raven_python_lambda.snapshot`.
+        raven_context = {
+            'extra': {
+                'event': snapshot_from_config(event, self.config),
+                'context': ContextSnapshot(context),
+            },
+            'tags': {}
+        }
+
+        # Tags, user and request details for the event's trigger, see `raven_python_lambda.sources`
+        source, extracted = sources.extract(event)
+        raven_context['tags'].update((k, v) for k, v in (extracted.get('tags') or {}).items() if v is not None)
+        if extracted.get('user'):
+            raven_context['user'] = extracted['user']
+
+        invocation = Invocation(context, raven_context)
+        if self.config.get('capture_memory_warnings') and hasattr(context, 'memory_limit_in_mb'):
+            invocation.memory = MemorySampler(context.memory_limit_in_mb)
+
+        if self.config['telemetry'] or self.config['capture_slow_invocations']:
+            # performance of this invocation, reported with anything it captures
+            invocation.telemetry = telemetry.begin_invocation(invocation.memory)
+        if self.config['telemetry']:
+            raven_context['tags']['cold_start'] = 'true' if invocation.telemetry.cold_start else 'false'
+            raven_context['extra']['telemetry'] = invocation.telemetry
+
+        if self.config['spool']:
+            prepare_spool(self.config, context)
+
+        if self.config.get('auto_bread_crumbs'):
+            # first breadcrumb is the invocation of the lambda itself
+            breadcrumb = {
+                'message': os.environ.get('AWS_LAMBDA_FUNCTION_NAME', 'local'),
+                'category': 'lambda',
+                'level': 'info',
+                'data': {}
+            }
 
-def timeout_error(config):
-    """Captures a timeout error."""
-    config['raven_client'].captureMessage('Function Timed Out', level='error')
+            if extracted.get('breadcrumb'):
+                breadcrumb['data'] = dict(extracted['breadcrumb'], event_source=source)
+
+            self.config['raven_client'].captureBreadcrumb(**breadcrumb)
+
+        return invocation
+
+    def finish_invocation(self, invocation, timers=None):
+        """Cancels the invocation's timers and reports what it leaves behind. Doesn't flush."""
+        if timers:
+            timers.cancel()
+        if self.log_buffer is not None:
+            self.log_buffer.clear()
+        if invocation.telemetry is not None:
+            telemetry.end_invocation(invocation.telemetry)
+            self.track_duration(invocation.telemetry, invocation.raven_context)
+        if invocation.memory is not None:
+            self.track_memory(invocation.memory, invocation.raven_context)
+        if self.rate_limiter is not None:
+            self.capture_suppression_summaries(invocation.raven_context)
+        self.send_worker_events(invocation)
+
+    def records(self, fn):
+        """
+        Wraps a handler for the individual records of an SQS, Kinesis or DynamoDB stream
+        batch, `fn(record, context)`. A failing record is captured with tags identifying
+        it and reported in the ``batchItemFailures`` response rather than failing the
+        whole batch; see `raven_python_lambda.batch`.
+
+        >>> @RavenLambdaWrapper().records
+        >>> def handler(record, context):
+        >>>     process(json.loads(record['body']))
+        """
+        from raven_python_lambda.batch import process_batch
 
+        @functools.wraps(fn)
+        def handle_batch(event, context):
+            # failed records are reported to Lambda either way, only capturing depends on Sentry.
+            # Records may be handled on pool threads, which don't see the current invocation.
+            on_failure = lambda record: None  # noqa: E731
+            if self.config['enabled']:
+                on_failure = functools.partial(self.capture_record_exception, invocation=current_invocation())
+            return process_batch(event, context, fn, on_failure, self.config['batch_concurrency'])
+
+        return self(handle_batch)
+
+    def worker(self, fn):
+        """
+        Wraps a function run by `multiprocessing` or `concurrent.futures` pool workers.
+        Its exceptions carry the Sentry event built in the worker, with the worker's
+        traceback, back to the handler; see `raven_python_lambda.workers`.
+
+        >>> @wrapper.worker
+        >>> def crunch(chunk):
+        >>>     return sum(x * x for x in chunk)
+        >>>
+        >>> @wrapper
+        >>> def handler(event, context):
+        >>>     return sum(pool.map(crunch, event['chunks']))
+        """
+        @functools.wraps(fn)
+        def run_in_worker(*args, **kwargs):
+            try:
+                return fn(*args, **kwargs)
+            except Exception:
+                if self.config['enabled'] and self.config['capture_workers']:
+                    capture_in_worker(self.config['raven_client'], sys.exc_info())
+                raise
+
+        return run_in_worker
+
+    def send_worker_events(self, invocation):
+        """Sends the events of the worker exceptions the invocation captured."""
+        events, invocation.worker_events = invocation.worker_events, []
+        for encoded, raven_context in events:
+            try:
+                send_worker_event(self.config['raven_client'], encoded, raven_context)
+            except Exception:
+                logger.exception('Unable to send the event of a worker exception')
+
+    def capture_record_exception(self, record, invocation=None):
+        """Captures the exception a batch record failed with, tagged with the record's identifiers."""
+        from raven_python_lambda.batch import record_tags
+
+        invocation = invocation or current_invocation()
+        raven_context = (invocation.raven_context if invocation else None) or {}
+        self.capture_exception(invocation, dict(
+            raven_context,
+            tags=dict(raven_context.get('tags') or {}, **record_tags(record)),
+            extra=dict(raven_context.get('extra') or {}, record=snapshot_from_config(record, self.config)),
+        ))
+
+    def capture_exception(self, invocation, raven_context=None):
+        """
+        Captures the exception being handled, unless it is a suppressed repeat, with
+        `raven_context` or else the invocation's.
+        """
+        if raven_context is None and invocation is not None:
+            raven_context = invocation.raven_context
+        extra = None
+        if self.rate_limiter is not None:
+            send, suppressed = self.rate_limiter.check(sys.exc_info())
+            if not send:
+                metrics.increment('ExceptionsSuppressed')
+                return
+            if suppressed:
+                extra = {'suppressed_count': suppressed}
+
+        crumbs = None
+        if self.log_buffer is not None:
+            crumbs = log_breadcrumbs(self.config['raven_client'], self.log_buffer)
+        metrics.increment('ExceptionsCaptured')
+
+        events = worker_events(sys.exc_info()[1])
+        if events:
+            # the worker's own event has the traceback that matters, it is sent when the invocation ends
+            context = dict(raven_context or {})
+            if extra:
+                context['extra'] = dict(context.get('extra') or {}, **extra)
+            if crumbs:
+                context['breadcrumbs'] = crumbs
+            if invocation is not None:
+                invocation.worker_events.extend((encoded, context) for encoded in events)
+            else:
+                for encoded in events:
+                    send_worker_event(self.config['raven_client'], encoded, context)
+            return
+        kwargs = capture_kwargs(raven_context, extra=extra)
+        if crumbs:
+            kwargs.setdefault('data', {})['breadcrumbs'] = crumbs
+        self.config['raven_client'].captureException(**kwargs)
+
+    def track_duration(self, invocation, raven_context):
+        """
+        Records how long a warm invocation took, and reports it if it was slower than
+        `slow_invocation_percentile` percent of the recent ones.
+        """
+        if invocation.cold_start:
+            # cold starts pay for lazy imports and connections, don't skew the percentiles with them
+            return
+        tracker = telemetry.get_duration_tracker(self.config['slow_invocation_window'])
+        threshold = tracker.percentile(self.config['slow_invocation_percentile'])
+        tracker.record(invocation.wall_time)
 
-def timeout_warning(config, context):
+        if not self.config['capture_slow_invocations'] or threshold is None or invocation.wall_time <= threshold:
+            return
+        metrics.increment('SlowInvocations')
+        self.config['raven_client'].captureMessage(
+            'Slow Invocation Warning',
+            level='warning',
+            **capture_kwargs(raven_context, extra={
+                'Percentile': self.config['slow_invocation_percentile'],
+                'PercentileWallTimeInMsec': round(threshold * 1000, 3),
+                'telemetry': invocation,
+            })
+        )
+
+    def track_memory(self, memory, raven_context):
+        """Records the RSS this invocation leaves behind and reports a suspected leak once."""
+        rss = memory.sample()
+        tracker = get_memory_tracker(self.config['memory_leak_window'])
+        tracker.record(rss)
+
+        if not self.config['capture_memory_leaks'] or tracker.leak_reported:
+            return
+        if not tracker.leak_suspected(memory.limit, self.config['memory_leak_horizon']):
+            return
+
+        tracker.leak_reported = True
+        metrics.increment('MemoryLeakWarnings')
+        self.config['raven_client'].captureMessage(
+            'Memory Leak Warning',
+            level='warning',
+            **capture_kwargs(raven_context, extra={
+                'MemoryLimitInMB': memory.limit / MB,
+                'MemoryUsedInMB': math.floor(rss / MB),
+                'MemoryPeakInMB': math.floor(memory.peak_in_mb),
+                'MemoryGrowthPerInvocationInMB': round(tracker.growth_per_invocation() / MB, 3),
+                'InvocationsUntilLimit': int(tracker.invocations_until_limit(memory.limit)),
+            })
+        )
+
+    def capture_suppression_summaries(self, raven_context):
+        """Reports repeats that were suppressed and haven't recurred since the window closed."""
+        for (exc_type, template, frames), suppressed in self.rate_limiter.expired_summaries():
+            self.config['raven_client'].captureMessage(
+                'Suppressed %d repeats of %s: %s' % (suppressed, exc_type, template),
+                level='error',
+                **capture_kwargs(raven_context, extra={
+                    'suppressed_count': suppressed,
+                    'exception_type': exc_type,
+                    'message_template': template,
+                    'frames': ['%s:%s in %s' % (f, line, name) for f, name, line in frames],
+                })
+            )
+
+
+def flush_transport(config, context=None):
+    """
+    Sends anything the client's transport has buffered or queued, e.g. batched SQS
+    messages or events waiting on the background sender. The flush is bounded by the
+    time the invocation has left, minus `flush_safety_margin` milliseconds.
+    """
+    if config.get('extension'):
+        # the extension delivers the invocation's events once it knows they were all written
+        from raven_python_lambda.extension import invocation_done
+        invocation_done(config['extension_socket'], context)
+
+    client = config['raven_client']
+    if isinstance(client, LazyClient) and not client.configured:
+        return
+
+    transport = client.remote.get_transport()
+    if not hasattr(transport, 'flush'):
+        return
+
+    timeout = None
+    if hasattr(context, 'get_remaining_time_in_millis'):
+        timeout = max(context.get_remaining_time_in_millis() - config.get('flush_safety_margin', 0), 0) / 1000.0
+
+    try:
+        flushed = transport.flush(timeout=timeout)
+    except Exception:
+        logger.exception('Unable to flush buffered Sentry events')
+        return
+
+    if flushed is False and config.get('spool'):
+        # events still queued for the background sender won't make it, keep them for later
+        from raven_python_lambda.transports import SpoolTransport, find_transport
+        spool_transport = find_transport(transport, SpoolTransport)
+        if spool_transport is not None:
+            for url, data, headers in transport.take_pending():
+                spool_transport.spool.append(url, data, headers)
+
+
+def emit_metrics(config):
+    """Writes the invocation's metrics to stdout, when `metrics` is enabled."""
+    if not config.get('metrics'):
+        return
+
+    properties = {}
+    client = config['raven_client']
+    if not isinstance(client, LazyClient) or client.configured:
+        from raven_python_lambda.transports import get_transport, innermost_transport
+        transport = innermost_transport(get_transport(client))
+        if transport is not None:
+            properties['Transport'] = type(transport).__name__
+        from raven_python_lambda.circuit import circuit_state
+        circuit = circuit_state(client)
+        if circuit is not None:
+            properties['CircuitState'] = circuit['state']
+
+    try:
+        metrics.emit(properties)
+    except Exception:
+        logger.exception('Unable to write metrics')
+
+
+def prepare_spool(config, context):
+    """
+    Sets the spool's deadline for this invocation, after which events are spooled
+    rather than sent, and starts draining it in the background if it holds events.
+    """
+    spool = get_spool(config['spool_dir'], config['spool_max_bytes'])
+    spool.deadline = None
+    if hasattr(context, 'get_remaining_time_in_millis'):
+        remaining = context.get_remaining_time_in_millis() - config.get('flush_safety_margin', 0)
+        spool.deadline = monotonic() + remaining / 1000.0
+
+    if spool.is_empty():
+        return
+
+    from raven_python_lambda.transports import SpoolTransport, find_transport
+    client = config['raven_client']
+    client = client.get_client() if isinstance(client, LazyClient) else client
+    spool_transport = find_transport(client.remote.get_transport(), SpoolTransport)
+    if spool_transport is not None:
+        spool_transport.start_drain(config['spool_drain_budget'] / 1000.0)
+
+
+def is_coroutine_function(fn):
+    """`inspect.iscoroutinefunction`, False on Python 2."""
+    iscoroutinefunction = getattr(inspect, 'iscoroutinefunction', None)
+    return iscoroutinefunction is not None and iscoroutinefunction(fn)
+
+
+def capture_kwargs(raven_context, extra=None):
+    """Turns the invocation's raven context into keyword arguments for `Client.capture*`."""
+    if not raven_context:
+        return {'extra': extra} if extra else {}
+
+    kwargs = {
+        'tags': raven_context.get('tags'),
+        'extra': dict(raven_context.get('extra') or {}, **(extra or {})),
+    }
+    if raven_context.get('user'):
+        kwargs['data'] = {'user': raven_context['user']}
+    return kwargs
+
+
+def thread_stack(thread_id):
+    """
+    Returns the current stack of another thread as ``(frame, lineno)`` pairs,
+    outermost first, as raven's `captureMessage(stack=...)` takes them.
+    """
+    frame = sys._current_frames().get(thread_id)
+    frames = []
+    while frame is not None:
+        frames.append((frame, frame.f_lineno))
+        frame = frame.f_back
+    frames.reverse()
+    return frames
+
+
+def timeout_error(config, context, raven_context=None, stack=None):
+    """
+    Captures a timeout error, with the handler's stack at that moment when `stack`,
+    a callable returning it as ``(frame, lineno)`` pairs, is given.
+    """
+    kwargs = capture_kwargs(raven_context)
+    if stack is not None:
+        kwargs['stack'] = stack() or None
+    if config.get('log_breadcrumbs'):
+        kwargs.setdefault('data', {})['breadcrumbs'] = log_breadcrumbs(config['raven_client'], get_log_buffer())
+    metrics.increment('Timeouts')
+    config['raven_client'].captureMessage('Function Timed Out', level='error', **kwargs)
+    flush_transport(config, context)
+    # the invocation is about to be killed, the handler's own emit may never come
+    emit_metrics(config)
+
+
+def timeout_lead(config, time_remaining):
+    """
+    Seconds before the timeout at which to capture it, so the event is delivered
+    in time: the transport's expected delivery latency plus the flush safety
+    margin, but at least `timeout_margin` and at most half the time remaining.
+    """
+    lead = config.get('timeout_margin', 500) / 1000.0
+
+    client = config['raven_client']
+    if not isinstance(client, LazyClient) or client.configured:
+        # nothing was sent through a client that isn't built yet, so there is nothing to learn from
+        from raven_python_lambda.transports import LatencyTransport, find_transport
+        measured = find_transport(client.remote.get_transport(), LatencyTransport)
+        if measured is not None:
+            lead = max(lead, measured.expected_delivery() + config.get('flush_safety_margin', 0) / 1000.0)
+
+    return min(lead, time_remaining / 2.0)
+
+
+def timeout_warning(config, context, raven_context=None):
     """Captures a timeout warning."""
+    metrics.increment('TimeoutWarnings')
     config['raven_client'].captureMessage(
         'Function Execution Time Warning',
         level='warning',
-        extra={
+        **capture_kwargs(raven_context, extra={
             'TimeRemainingInMsec': context.get_remaining_time_in_millis()
 
-        }
+        })
     )
 
 
-def memory_warning(config, context):
-    """Determines when memory usage is nearing it's max."""
-    used = psutil.Process(os.getpid()).memory_info().rss / 1048576
+def memory_warning(config, context, timers, raven_context=None, memory=None):
+    """
+    Determines when memory usage is nearing it's max. Keeps sampling until the
+    invocation ends to record its peak, more often the closer usage is to the
+    threshold.
+    """
+    if memory is None:
+        memory = MemorySampler(context.memory_limit_in_mb)
+
+    used = memory.sample() / MB
     limit = float(context.memory_limit_in_mb)
     p = used / limit
 
     memory_threshold = config.get('memory_warning_threshold')
 
-    if p >= memory_threshold:
+    if p >= memory_threshold and not memory.warned:
+        memory.warned = True
+        metrics.increment('MemoryWarnings')
+        tracker = get_memory_tracker(config.get('memory_leak_window', 20))
         config['raven_client'].captureMessage(
             'Memory Usage Warning',
             level='warning',
-            extra={
+            **capture_kwargs(raven_context, extra={
                 'MemoryLimitInMB': context.memory_limit_in_mb,
-                'MemoryUsedInMB': math.floor(used)
-            }
+                'MemoryUsedInMB': math.floor(used),
+                'MemoryPeakInMB': math.floor(memory.peak_in_mb),
+                'MemoryGrowthPerInvocationInMB': round(tracker.growth_per_invocation() / MB, 3),
+            })
         )
-    else:
-        # nothing to do check back later
-        Timer(.5, memory_warning, (config, context)).start()
 
+    # check back later
+    interval = WARNED_INTERVAL if memory.warned else next_interval(p, memory_threshold)
+    timers.schedule(interval, memory_warning, (config, context, timers, raven_context, memory))
 
-def install_timers(config, context):
-    """Create the timers as specified by the plugin configuration."""
-    timers = []
+
+def install_timers(config, context, raven_context=None, memory=None, thread_id=None, timers=None, stack=None):
+    """
+    Schedule the timers as specified by the plugin configuration.
+
+    By default all deadlines run on the process-wide watchdog thread; `timers` can
+    be another group with the same `schedule` and `cancel` methods. The returned
+    group must be cancelled when the invocation ends. `thread_id` is the handler's
+    thread, whose stack is reported with a timeout, unless `stack` returns it.
+    """
+    if timers is None:
+        timers = TimerGroup()
+    if stack is None and thread_id is not None:
+        stack = functools.partial(thread_stack, thread_id)
     if config.get('capture_timeout_warnings'):
         timeout_threshold = config.get('timeout_warning_threshold')
         # Schedule the warning at the user specified threshold given in percent.
         # ie: 0.50 of 30000 ms = 15000ms
-        # Schedule the error a few milliseconds before the actual timeout happens.
-        time_remaining = context.get_remaining_time_in_millis() / 1000
-        timers.append(Timer(time_remaining * timeout_threshold, timeout_warning, (config, context)))
-        timers.append(Timer(max(time_remaining - .5, 0), timeout_error, [config]))
+        # Schedule the error early enough before the actual timeout for it to be delivered.
+        time_remaining = context.get_remaining_time_in_millis() / 1000.0
+        timers.schedule(time_remaining * timeout_threshold, timeout_warning, (config, context, raven_context))
+        timers.schedule(time_remaining - timeout_lead(config, time_remaining), timeout_error,
+                        (config, context, raven_context, stack))
 
     if config.get('capture_memory_warnings'):
-        # Schedule the memory watch dog interval. Warning will re-schedule itself if necessary.
-        timers.append(Timer(.5, memory_warning, (config, context)))
-
-    for t in timers:
-        t.start()
+        # Schedule the memory watch dog interval. It re-schedules itself until the timers are cancelled.
+        timers.schedule(.5, memory_warning, (config, context, timers, raven_context, memory))
 
     return timers
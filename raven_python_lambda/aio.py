@@ -0,0 +1,280 @@
+"""
+.. module: raven_python_lambda.aio
+    :platform: Unix
+    :copyright: (c) 2017 by Netflix Inc., see AUTHORS for more
+    :license: Apache, see LICENSE for more details.
+
+Support for ``async def`` handlers, imported on demand.
+
+A wrapped coroutine function stays a coroutine function. On Python 3.7+, while
+it runs, events are sent through the client's transport chain (keep-alive
+connections, spool, circuit breaker, ...) on the loop's default executor, so
+they don't block the loop. The timeout and memory watchdogs run as loop
+callbacks, and pending sends are awaited before the handler returns, bounded
+by the time the invocation has left. Python 3.5 and 3.6 lack the context
+variables this relies on, and there events are sent synchronously as from any
+other handler.
+
+Lambda calls handlers synchronously, so run the wrapped handler on a loop:
+
+>>> @RavenLambdaWrapper()
+>>> async def main(event, context):
+>>>     return await asyncio.gather(*[fetch(url) for url in event['urls']])
+>>>
+>>> def handler(event, context):
+>>>     return asyncio.run(main(event, context))
+"""
+import asyncio
+import functools
+import logging
+import threading
+
+from raven.transport.base import AsyncTransport
+
+from raven_python_lambda import LazyClient, emit_metrics, flush_transport, install_timers
+from raven_python_lambda.invocation import activate, deactivate
+from raven_python_lambda.transports import TransportWrapper, find_transport, get_transport, install_transport_wrapper
+
+try:
+    import contextvars
+except ImportError:  # Python 3.5 and 3.6
+    contextvars = None
+
+logger = logging.getLogger(__name__)
+
+# set while a wrapped coroutine function runs, and inherited by the tasks it starts
+_active = None
+if contextvars is not None:
+    _active = contextvars.ContextVar('raven_python_lambda.aio.active', default=False)
+
+
+def running_loop():
+    """The event loop of a wrapped handler running in this thread, or None."""
+    if _active is None or not _active.get():
+        return None
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+
+
+class AsyncioTransport(TransportWrapper, AsyncTransport):
+    """
+    Sends events through the wrapped transport on the default executor of a wrapped
+    coroutine function's event loop, and synchronously everywhere else.
+    """
+    is_async = True
+
+    def __init__(self, transport):
+        super(AsyncioTransport, self).__init__(transport)
+        self._tasks = set()
+
+    def async_send(self, url, data, headers, success_cb, error_cb):
+        loop = running_loop()
+        if loop is None:
+            self.transport.send(url, data, headers)
+            success_cb()
+            return
+
+        def done(future):
+            if future.cancelled():
+                return
+            exc = future.exception()
+            if exc is not None:
+                error_cb(exc)
+            else:
+                success_cb()
+
+        self._track(loop.run_in_executor(None, self.transport.send, url, data, headers)).add_done_callback(done)
+
+    def send(self, url, data, headers):
+        self.async_send(url, data, headers, lambda: None, lambda e: None)
+
+    def flush(self, timeout=None):
+        """Flushes the wrapped transport, from the loop's executor when called on the handler's loop."""
+        loop = running_loop()
+        if loop is None:
+            return super(AsyncioTransport, self).flush(timeout=timeout)
+        flush = functools.partial(super(AsyncioTransport, self).flush, timeout=timeout)
+        self._track(loop.run_in_executor(None, flush))
+
+    @property
+    def pending(self):
+        return sum(1 for task in self._tasks if not task.done())
+
+    async def wait(self, timeout=None):
+        """
+        Waits for the sends and flushes started on the running loop, for at most
+        `timeout` seconds. Returns False if some are still pending.
+        """
+        loop = asyncio.get_running_loop()
+        tasks = [task for task in self._tasks if not task.done() and _loop_of(task) is loop]
+        if not tasks:
+            return True
+        _, pending = await asyncio.wait(tasks, timeout=timeout)
+        if pending:
+            logger.warning('%d Sentry events were still being sent when the handler returned', len(pending))
+        return not pending
+
+    def _track(self, task):
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+
+def install_asyncio_transport(config):
+    """
+    Installs `AsyncioTransport` on the wrapper's client, once it is built. Not when
+    sends are already off the handler's thread, with `background_send` or `extension`.
+    """
+    if contextvars is None or config.get('background_send') or config.get('extension'):
+        return
+
+    def install(client):
+        if find_transport(get_transport(client), AsyncioTransport) is None:
+            install_transport_wrapper(client, AsyncioTransport)
+
+    client = config['raven_client']
+    if isinstance(client, LazyClient):
+        client.when_built(install)
+    else:
+        install(client)
+
+
+def _loop_of(future):
+    get_loop = getattr(future, 'get_loop', None)
+    return get_loop() if get_loop is not None else future._loop
+
+
+class LoopTimerGroup(object):
+    """A `TimerGroup` whose callbacks run on an event loop rather than the watchdog thread."""
+    def __init__(self, loop):
+        self.loop = loop
+        self.handles = set()
+        self.cancelled = False
+
+    def schedule(self, delay, fn, args=()):
+        if self.cancelled:
+            return None
+        handle = self.loop.call_later(max(delay, 0), self._fire, fn, args)
+        self.handles.add(handle)
+        return handle
+
+    def _fire(self, fn, args):
+        if self.cancelled:
+            return
+        self.handles = set(h for h in self.handles if not h.cancelled() and h.when() > self.loop.time())
+        try:
+            fn(*args)
+        except Exception:
+            logger.exception('Watchdog callback %r failed', fn)
+
+    def cancel(self):
+        self.cancelled = True
+        handles, self.handles = self.handles, set()
+        for handle in handles:
+            handle.cancel()
+
+
+def task_stack(task):
+    """
+    Returns the stack of a suspended task as ``(frame, lineno)`` pairs, outermost
+    first, following the chain of coroutines it is awaiting.
+    """
+    frames = []
+    coro = task.get_coro()
+    while coro is not None:
+        frame = getattr(coro, 'cr_frame', None) or getattr(coro, 'gi_frame', None)
+        if frame is None:
+            break
+        frames.append((frame, frame.f_lineno))
+        coro = getattr(coro, 'cr_await', None) or getattr(coro, 'gi_yieldfrom', None)
+    return frames
+
+
+async def flush(config, context):
+    """
+    Waits for the events sent from this loop, then flushes the transport from the
+    loop's executor, all within the time the invocation has left.
+    """
+    client = config['raven_client']
+    if isinstance(client, LazyClient) and not client.configured:
+        return
+
+    transport = find_transport(get_transport(client), AsyncioTransport)
+    if transport is not None:
+        timeout = None
+        if hasattr(context, 'get_remaining_time_in_millis'):
+            timeout = max(context.get_remaining_time_in_millis() - config.get('flush_safety_margin', 0), 0) / 1000.0
+        await transport.wait(timeout)
+
+    # outside the handler's context, so the transport flushes synchronously
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, flush_transport, config, context)
+
+
+def wrap_coroutine_function(wrapper, fn):
+    """`RavenLambdaWrapper.__call__` for coroutine functions."""
+    if contextvars is None:
+        return wrap_blocking(wrapper, fn)
+    if wrapper.config['enabled']:
+        install_asyncio_transport(wrapper.config)
+
+    @functools.wraps(fn)
+    async def decorated(event, context):
+        if not wrapper.config['enabled']:
+            return await fn(event, context)
+
+        token = _active.set(True)
+        invocation = wrapper.start_invocation(event, context)
+        invocation_token = activate(invocation)
+
+        timers = None
+        try:
+            timers = install_timers(wrapper.config, context, invocation.raven_context, invocation.memory,
+                                    timers=LoopTimerGroup(asyncio.get_running_loop()),
+                                    stack=functools.partial(task_stack, asyncio.current_task()))
+            return await fn(event, context)
+        except Exception:
+            wrapper.capture_exception(invocation)
+            raise
+        finally:
+            deactivate(invocation_token)
+            wrapper.finish_invocation(invocation, timers)
+            try:
+                await flush(wrapper.config, context)
+            finally:
+                _active.reset(token)
+                emit_metrics(wrapper.config)
+
+    return decorated
+
+
+def wrap_blocking(wrapper, fn):
+    """
+    Wraps a coroutine function like any other handler: events are sent, and the
+    transport flushed, from the loop's thread, and the watchdogs run on their thread.
+    """
+    @functools.wraps(fn)
+    async def decorated(event, context):
+        if not wrapper.config['enabled']:
+            return await fn(event, context)
+
+        invocation = wrapper.start_invocation(event, context)
+        token = activate(invocation)
+
+        timers = None
+        try:
+            timers = install_timers(wrapper.config, context, invocation.raven_context, invocation.memory,
+                                    threading.current_thread().ident)
+            return await fn(event, context)
+        except Exception:
+            wrapper.capture_exception(invocation)
+            raise
+        finally:
+            deactivate(token)
+            wrapper.finish_invocation(invocation, timers)
+            flush_transport(wrapper.config, context)
+            emit_metrics(wrapper.config)
+
+    return decorated
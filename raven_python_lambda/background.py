@@ -0,0 +1,139 @@
+"""
+.. module: raven_python_lambda.background
+    :platform: Unix
+    :copyright: (c) 2017 by Netflix Inc., see AUTHORS for more
+    :license: Apache, see LICENSE for more details.
+
+Moves event delivery off the handler's thread. Events are handed to a bounded
+queue served by a single worker thread and are flushed, within a deadline, by
+`RavenLambdaWrapper` before the handler returns.
+"""
+import os
+import logging
+import threading
+from collections import deque
+
+from raven.transport.base import AsyncTransport
+
+from raven_python_lambda.compat import monotonic
+from raven_python_lambda.transports import TransportWrapper
+
+logger = logging.getLogger(__name__)
+
+
+class BackgroundTransport(TransportWrapper, AsyncTransport):
+    """
+    Sends events through the wrapped transport on a background worker.
+
+    `stats` keeps running counters:
+
+    - `queued`: events accepted for delivery
+    - `sent`: events the wrapped transport accepted
+    - `failed`: events the wrapped transport raised on
+    - `dropped`: events rejected because the queue was full
+    - `late`: events still pending when a flush ran out of time
+    """
+    is_async = True
+
+    def __init__(self, transport, queue_size=100):
+        super(BackgroundTransport, self).__init__(transport)
+        self.queue_size = int(queue_size)
+        self.stats = dict(queued=0, sent=0, failed=0, dropped=0, late=0)
+        self._pending = deque()
+        self._busy = False
+        self._flush_requested = False
+        self._cond = threading.Condition(threading.Lock())
+        self._thread = None
+        self._pid = None
+
+    def async_send(self, url, data, headers, success_cb, error_cb):
+        with self._cond:
+            if len(self._pending) >= self.queue_size:
+                self.stats['dropped'] += 1
+                logger.warning('Sentry background queue is full, dropping event')
+                return
+            self._ensure_thread()
+            self._pending.append((url, data, headers, success_cb, error_cb))
+            self.stats['queued'] += 1
+            self._cond.notify_all()
+
+    def send(self, url, data, headers):
+        self.async_send(url, data, headers, lambda: None, lambda e: None)
+
+    @property
+    def pending(self):
+        """Number of events that have not been handed to the wrapped transport yet."""
+        with self._cond:
+            return len(self._pending) + (1 if self._busy else 0)
+
+    def flush(self, timeout=None):
+        """
+        Waits until every queued event has been sent and the wrapped transport has
+        been flushed, for at most `timeout` seconds. Returns False on timeout, in which
+        case the outstanding events are counted as late and stay queued.
+        """
+        deadline = None if timeout is None else monotonic() + max(timeout, 0)
+        with self._cond:
+            if self._thread is None and not self._pending:
+                self._flush_requested = False
+                return True
+            self._ensure_thread()
+            self._flush_requested = True
+            self._cond.notify_all()
+            while self._pending or self._busy or self._flush_requested:
+                remaining = None if deadline is None else deadline - monotonic()
+                if remaining is not None and remaining <= 0:
+                    late = len(self._pending) + (1 if self._busy else 0)
+                    self.stats['late'] += late
+                    logger.warning('Timed out flushing Sentry events, %d still pending', late)
+                    return False
+                self._cond.wait(remaining)
+            return True
+
+    def take_pending(self):
+        """Removes and returns ``(url, data, headers)`` for every event still waiting to be sent."""
+        with self._cond:
+            items, self._pending = self._pending, deque()
+        return [(url, data, headers) for url, data, headers, _, _ in items]
+
+    def _ensure_thread(self):
+        if self._pid == os.getpid() and self._thread and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, name='raven_python_lambda.BackgroundTransport')
+        self._thread.daemon = True
+        self._thread.start()
+        self._pid = os.getpid()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._flush_requested:
+                    self._cond.wait()
+                item = self._pending.popleft() if self._pending else None
+                self._busy = True
+
+            if item:
+                self._deliver(*item)
+            else:
+                try:
+                    super(BackgroundTransport, self).flush()
+                except Exception:
+                    logger.exception('Unable to flush Sentry transport')
+
+            with self._cond:
+                self._busy = False
+                if item is None:
+                    self._flush_requested = False
+                self._cond.notify_all()
+
+    def _deliver(self, url, data, headers, success_cb, error_cb):
+        try:
+            self.transport.send(url, data, headers)
+        except Exception as e:
+            with self._cond:
+                self.stats['failed'] += 1
+            error_cb(e)
+        else:
+            with self._cond:
+                self.stats['sent'] += 1
+            success_cb()
@@ -0,0 +1,139 @@
+"""
+.. module: raven_python_lambda.batch
+    :platform: Unix
+    :copyright: (c) 2017 by Netflix Inc., see AUTHORS for more
+    :license: Apache, see LICENSE for more details.
+
+Record-by-record processing of SQS, Kinesis and DynamoDB stream batches.
+
+Each record is handled, and its failure captured, on its own; the failed
+records are returned in the ``batchItemFailures`` shape so that Lambda only
+retries those (this requires ``ReportBatchItemFailures`` on the event source
+mapping). Kinesis, DynamoDB and SQS FIFO batches are ordered: they are
+processed one record at a time and processing stops at the first failure,
+reporting it and everything after it. Standard SQS batches can be processed
+concurrently on a bounded, process-wide thread pool.
+"""
+import logging
+import threading
+
+from raven_python_lambda.sources import arn_name, stream_table_name
+
+logger = logging.getLogger(__name__)
+
+# Lambda retries the whole batch when an identifier is empty, or matches no record
+WHOLE_BATCH_FAILED = {'batchItemFailures': [{'itemIdentifier': ''}]}
+
+# eventSource -> how to identify a record, and tag its failures
+SOURCES = {
+    'aws:sqs': {
+        'identifier': lambda r: r.get('messageId'),
+        'tags': lambda r: {
+            'sqs_message_id': r.get('messageId'),
+            'sqs_queue': arn_name(r.get('eventSourceARN')),
+        },
+    },
+    'aws:kinesis': {
+        'identifier': lambda r: (r.get('kinesis') or {}).get('sequenceNumber'),
+        'tags': lambda r: {
+            'kinesis_shard': (r.get('eventID') or '').split(':', 1)[0],
+            'kinesis_sequence_number': r['kinesis'].get('sequenceNumber'),
+            'kinesis_partition_key': r['kinesis'].get('partitionKey'),
+        },
+    },
+    'aws:dynamodb': {
+        'identifier': lambda r: (r.get('dynamodb') or {}).get('SequenceNumber'),
+        'tags': lambda r: {
+            'dynamodb_table': stream_table_name(r.get('eventSourceARN')),
+            'dynamodb_event_name': r.get('eventName'),
+            'dynamodb_sequence_number': r['dynamodb'].get('SequenceNumber'),
+        },
+    },
+}
+
+
+class UnsupportedBatch(ValueError):
+    pass
+
+
+def event_source(record):
+    return record.get('eventSource') or record.get('EventSource')
+
+
+def is_ordered(record):
+    source = event_source(record)
+    if source == 'aws:sqs':
+        return (record.get('eventSourceARN') or '').endswith('.fifo')
+    return True
+
+
+def record_tags(record):
+    """Tags identifying the record in a captured event."""
+    source = SOURCES.get(event_source(record))
+    if source is None:
+        return {}
+    try:
+        return dict((k, v) for k, v in source['tags'](record).items() if v)
+    except (KeyError, TypeError, AttributeError):
+        return {}
+
+
+def record_identifier(record):
+    """The ``itemIdentifier`` of the record, or None if it has none."""
+    source = SOURCES.get(event_source(record))
+    return source['identifier'](record) if source is not None else None
+
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+def get_executor(workers):
+    """Returns a process-wide thread pool, so its threads are reused across invocations."""
+    from concurrent.futures import ThreadPoolExecutor
+    with _executors_lock:
+        if workers not in _executors:
+            _executors[workers] = ThreadPoolExecutor(max_workers=workers)
+        return _executors[workers]
+
+
+def process_batch(event, context, handler, on_failure, concurrency=1):
+    """
+    Calls `handler(record, context)` for every record of the batch. A record whose
+    handler raises is passed to `on_failure(record)` from within the ``except``
+    block, so it can capture the exception. Returns the ``batchItemFailures``
+    response.
+    """
+    records = event.get('Records') or []
+    if records and event_source(records[0]) not in SOURCES:
+        raise UnsupportedBatch('Partial batch failures are not supported for %s events' % event_source(records[0]))
+
+    def process(record):
+        try:
+            handler(record, context)
+        except Exception:
+            on_failure(record)
+            return False
+        return True
+
+    ordered = bool(records) and is_ordered(records[0])
+    failed = []
+    if ordered or concurrency <= 1:
+        for i, record in enumerate(records):
+            if process(record):
+                continue
+            if ordered:
+                # ordered sources are retried from the first failure on, don't process past it
+                failed = list(range(i, len(records)))
+                break
+            failed.append(i)
+    else:
+        results = get_executor(concurrency).map(process, records)
+        failed = [i for i, ok in enumerate(results) if not ok]
+
+    identifiers = [record_identifier(records[i]) for i in failed]
+    if None in identifiers:
+        # there is no way to report just that record, so the whole batch is retried
+        logger.warning('A failed %s record has no identifier, failing the whole batch', event_source(records[0]))
+        return WHOLE_BATCH_FAILED
+    return {'batchItemFailures': [{'itemIdentifier': identifier} for identifier in identifiers]}
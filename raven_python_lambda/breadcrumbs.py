@@ -0,0 +1,135 @@
+"""
+.. module: raven_python_lambda.breadcrumbs
+    :platform: Unix
+    :copyright: (c) 2017 by Netflix Inc., see AUTHORS for more
+    :license: Apache, see LICENSE for more details.
+
+Log records kept as breadcrumbs, for the events of failed invocations only.
+
+A `LogRingBuffer` keeps references to the last `size` log records of the
+invocation in preallocated slots; nothing is formatted when they are logged.
+When an exception or a timeout is captured the records are turned into
+breadcrumbs of that one event, otherwise they are dropped when the invocation
+ends. They never reach the client's context, which outlives the invocation.
+"""
+import logging
+import threading
+
+MESSAGE_MAX_LENGTH = 1024
+
+
+class LogRingBuffer(object):
+    """The last `size` records, oldest first once the buffer has wrapped."""
+    def __init__(self, size=100):
+        self.size = max(int(size), 1)
+        self._slots = [None] * self.size
+        self._next = 0
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def append(self, record):
+        # callers may race from several threads; a lost or duplicated slot is harmless
+        i = self._next
+        self._slots[i] = record
+        self._next = (i + 1) % self.size
+        if self._count < self.size:
+            self._count += 1
+
+    def clear(self):
+        slots = self._slots
+        for i in range(self._count):
+            slots[(self._next - 1 - i) % self.size] = None
+        self._next = 0
+        self._count = 0
+
+    def records(self):
+        start = (self._next - self._count) % self.size
+        return [self._slots[(start + i) % self.size] for i in range(self._count)]
+
+    def breadcrumbs(self):
+        """The records as keyword arguments for `Client.captureBreadcrumb`."""
+        return [record_to_breadcrumb(record) for record in self.records() if record is not None]
+
+
+def record_to_breadcrumb(record):
+    try:
+        message = record.getMessage()
+    except Exception:
+        message = '%s (unformattable arguments)' % (record.msg,)
+    breadcrumb = {
+        'type': 'default',
+        'timestamp': record.created,
+        'level': record.levelname.lower(),
+        'category': record.name,
+        'message': message[:MESSAGE_MAX_LENGTH],
+        'data': {'location': '%s:%s' % (record.pathname, record.lineno)},
+    }
+    if record.exc_info and record.exc_info[0] is not None:
+        breadcrumb['data']['exception'] = record.exc_info[0].__name__
+    return breadcrumb
+
+
+class RingBufferHandler(logging.Handler):
+    """Puts records in a `LogRingBuffer`, skipping the handler lock and formatting."""
+    def __init__(self, buffer, level=logging.NOTSET):
+        logging.Handler.__init__(self, level)
+        self.buffer = buffer
+
+    def handle(self, record):
+        if self.filters and not self.filter(record):
+            return False
+        self.buffer.append(record)
+        return True
+
+    def emit(self, record):
+        self.buffer.append(record)
+
+
+_handler = None
+_handler_lock = threading.Lock()
+
+
+def get_log_buffer(size=100, level=logging.INFO):
+    """
+    Returns the process-wide ring buffer, installing its handler on the root logger
+    the first time. Like the Sentry handler, the first wrapper's settings win.
+    """
+    global _handler
+    with _handler_lock:
+        if _handler is None:
+            _handler = RingBufferHandler(LogRingBuffer(size), level)
+            logging.getLogger().addHandler(_handler)
+        return _handler.buffer
+
+
+def _skip_raven_log_breadcrumb(logger, level, msg, args, kwargs):
+    return _handler is not None
+
+
+_replaced = False
+
+
+def replace_raven_log_breadcrumbs():
+    """
+    raven records every log call as a breadcrumb on its client's context, which
+    outlives the invocation. While the ring buffer is installed it records them
+    instead, so stop raven from doing it too.
+    """
+    global _replaced
+    with _handler_lock:
+        if not _replaced:
+            from raven.breadcrumbs import register_logging_handler
+            register_logging_handler(_skip_raven_log_breadcrumb)
+            _replaced = True
+
+
+def log_breadcrumbs(client, buffer):
+    """
+    The ``breadcrumbs`` of one event: the client's own breadcrumbs followed by the
+    buffered records. Empties the buffer.
+    """
+    crumbs = client.context.breadcrumbs.get_buffer() + buffer.breadcrumbs()
+    buffer.clear()
+    return {'values': crumbs}
@@ -0,0 +1,195 @@
+"""
+.. module: raven_python_lambda.circuit
+    :platform: Unix
+    :copyright: (c) 2017 by Netflix Inc., see AUTHORS for more
+    :license: Apache, see LICENSE for more details.
+
+A circuit breaker in front of the SQS and HTTP transports.
+
+While Sentry or SQS is down or slow, every invocation that captures something
+would otherwise wait out the transport's timeout. After `failure_threshold`
+consecutive failed or slow sends the circuit opens, and sends fail fast with
+`CircuitOpen` for `cool_off` seconds (or are spooled, with `SENTRY_SPOOL`).
+Then a single probe is let through: the circuit closes if it goes through and
+opens again if it doesn't.
+
+The breaker is kept per transport instance, so like the transport it is shared
+by every client in the process and carries over across warm invocations.
+
+A batching SQS transport (`sqs_batch`) only buffers most events, and never
+raises from a batch that fails. Its breaker is told how each batch went by the
+transport instead: a batch that left messages unsent, or was slow, counts as
+one failed send.
+"""
+import logging
+import threading
+
+from raven.exceptions import APIError, RateLimited
+
+from raven_python_lambda import metrics, registry
+from raven_python_lambda.compat import monotonic
+from raven_python_lambda.transports import TransportWrapper, find_transport, get_transport, innermost_transport
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpen(RateLimited):
+    """Raised instead of sending while the circuit is open; `retry_after` is what's left of the cool-off."""
+    def __init__(self, retry_after):
+        super(CircuitOpen, self).__init__('Circuit to Sentry is open, not sending', retry_after)
+
+
+def is_failure(exc):
+    """Whether `exc` says the service is unwell, rather than that it refused this one event."""
+    if isinstance(exc, APIError) and not isinstance(exc, RateLimited):
+        return not 400 <= exc.code < 500
+    return True
+
+
+class CircuitBreaker(object):
+    """
+    Counts consecutive failed sends, and sends slower than `slow_send` seconds, and
+    opens after `failure_threshold` of them.
+
+    `stats` keeps running counters:
+
+    - `opened`: times the circuit opened
+    - `rejected`: sends failed fast while the circuit was open
+    - `probes`: sends let through to test a half open circuit
+    """
+    def __init__(self, failure_threshold=5, slow_send=0.5, cool_off=30.0):
+        self.failure_threshold = failure_threshold
+        self.slow_send = slow_send
+        self.cool_off = cool_off
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.stats = dict(opened=0, rejected=0, probes=0)
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def _cooling_off(self):
+        return self.state == OPEN and monotonic() - self.opened_at < self.cool_off
+
+    def acquire(self):
+        """Whether a send may go ahead. Once the cool-off is over, only one probe at a time is."""
+        with self._lock:
+            if self._cooling_off() or (self.state != CLOSED and self._probing):
+                self.stats['rejected'] += 1
+                return False
+            if self.state == OPEN:
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN:
+                self._probing = True
+                self.stats['probes'] += 1
+            return True
+
+    def allows_flush(self):
+        """Flushes are held back while cooling off, but don't take the probe."""
+        with self._lock:
+            return not self._cooling_off()
+
+    def record(self, elapsed, failed=False):
+        """Records the outcome of a send. Returns True if it opened the circuit."""
+        with self._lock:
+            self._probing = False
+            if not failed and not (self.slow_send and elapsed >= self.slow_send):
+                self.state = CLOSED
+                self.consecutive_failures = 0
+                self.opened_at = None
+                return False
+
+            self.consecutive_failures += 1
+            if self.state != HALF_OPEN and self.consecutive_failures < self.failure_threshold:
+                return False
+            opened = self.state != OPEN
+            self.state = OPEN
+            self.opened_at = monotonic()
+            if opened:
+                self.stats['opened'] += 1
+            return opened
+
+    def retry_after(self):
+        """Seconds left of the cool-off, 0 unless the circuit is open."""
+        with self._lock:
+            if self.state != OPEN:
+                return 0.0
+            return max(self.cool_off - (monotonic() - self.opened_at), 0.0)
+
+    def snapshot(self):
+        """The breaker's state and counters, for instrumentation."""
+        return dict(self.stats, state=self.state, consecutive_failures=self.consecutive_failures,
+                    retry_after=self.retry_after())
+
+
+def _record(breaker, elapsed, failed=False):
+    """`CircuitBreaker.record`, counting and logging the circuit opening."""
+    if breaker.record(elapsed, failed=failed):
+        metrics.increment('CircuitOpened')
+        logger.warning('Opened the circuit to Sentry after %d failed or slow sends, failing fast for %.0fs',
+                       breaker.consecutive_failures, breaker.cool_off)
+
+
+def reports_batches(transport):
+    """Whether `transport` buffers events and reports on the batches it sends, like a batching `SQSTransport`."""
+    return bool(getattr(transport, 'batch', False)) and hasattr(transport, 'batch_listeners')
+
+
+def _create_breaker(transport, failure_threshold, slow_send, cool_off):
+    breaker = CircuitBreaker(failure_threshold, slow_send, cool_off)
+    if reports_batches(transport):
+        transport.batch_listeners.append(lambda elapsed, unsent: _record(breaker, elapsed, failed=unsent > 0))
+    return breaker
+
+
+class CircuitBreakerTransport(TransportWrapper):
+    """Fails sends fast, with `CircuitOpen`, while the wrapped transport's circuit is open."""
+    def __init__(self, transport, failure_threshold=5, slow_send=0.5, cool_off=30.0):
+        super(CircuitBreakerTransport, self).__init__(transport)
+        inner = innermost_transport(transport)
+        self.batched = reports_batches(inner)
+        self.breaker = registry.breakers.get(
+            inner, lambda: _create_breaker(inner, failure_threshold, slow_send, cool_off))
+
+    def check(self):
+        """Raises `CircuitOpen` unless a send may go ahead."""
+        if not self.breaker.acquire():
+            metrics.increment('SendsRejected')
+            raise CircuitOpen(self.breaker.retry_after())
+
+    def observe(self, elapsed, exc=None):
+        """Records a send that took `elapsed` seconds and raised `exc`, if anything."""
+        _record(self.breaker, elapsed, failed=exc is not None and is_failure(exc))
+
+    def send(self, url, data, headers):
+        self.check()
+        started = monotonic()
+        try:
+            self.transport.send(url, data, headers)
+        except Exception as e:
+            self.observe(monotonic() - started, e)
+            raise
+        if not self.batched:
+            # the event may only have been buffered: batches are recorded once sent, see `_create_breaker`
+            self.observe(monotonic() - started)
+
+    def flush(self, timeout=None):
+        if not self.breaker.allows_flush():
+            # buffered events are kept for a later flush
+            return
+        started = monotonic()
+        try:
+            super(CircuitBreakerTransport, self).flush(timeout=timeout)
+        except Exception as e:
+            self.observe(monotonic() - started, e)
+            raise
+
+
+def circuit_state(client):
+    """The `CircuitBreaker.snapshot` of the client's transport, or None without a circuit breaker."""
+    transport = find_transport(get_transport(client), CircuitBreakerTransport)
+    return None if transport is None else transport.breaker.snapshot()
@@ -0,0 +1,20 @@
+"""
+.. module: raven_python_lambda.compat
+    :platform: Unix
+    :copyright: (c) 2017 by Netflix Inc., see AUTHORS for more
+    :license: Apache, see LICENSE for more details.
+
+Small shims to keep the package working on both Python 2.7 and 3.x.
+"""
+try:
+    from time import monotonic
+except ImportError:  # Python 2.7
+    from time import time as monotonic
+
+try:
+    text_type = unicode
+except NameError:  # Python 3
+    text_type = str
+
+
+__all__ = ['monotonic', 'text_type']
@@ -0,0 +1,135 @@
+"""
+.. module: raven_python_lambda.dedup
+    :platform: Unix
+    :copyright: (c) 2017 by Netflix Inc., see AUTHORS for more
+    :license: Apache, see LICENSE for more details.
+
+Cross-invocation deduplication of captured exceptions.
+
+A warm container can fail the same way on thousands of invocations. Each
+exception is fingerprinted on its type, message template and innermost frames;
+every fingerprint gets a token bucket that allows `burst` events per `window`
+seconds. Repeats beyond that are counted instead of sent, and the count is
+reported with the next event for that fingerprint or, if it stops recurring, in
+a summary once its window has passed.
+"""
+import re
+import threading
+from collections import OrderedDict
+
+from raven_python_lambda.compat import monotonic
+
+# Variable parts of exception messages, most specific first
+_TEMPLATE_PATTERNS = (
+    (re.compile(r'[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}'), '<uuid>'),
+    (re.compile(r'0x[0-9a-fA-F]+'), '<hex>'),
+    (re.compile(r'\'[^\']*\'|"[^"]*"'), '<str>'),
+    (re.compile(r'\d+(\.\d+)?'), '<num>'),
+)
+
+
+def message_template(message):
+    """Replaces the variable parts of a message (ids, numbers, quoted values) with placeholders."""
+    for pattern, placeholder in _TEMPLATE_PATTERNS:
+        message = pattern.sub(placeholder, message)
+    return message
+
+
+def fingerprint(exc_info, max_frames=5):
+    """Returns a hashable fingerprint for an exception from `sys.exc_info()`."""
+    exc_type, exc_value, tb = exc_info
+    frames = []
+    while tb is not None:
+        frames.append((tb.tb_frame.f_code.co_filename, tb.tb_frame.f_code.co_name, tb.tb_lineno))
+        tb = tb.tb_next
+    try:
+        message = str(exc_value)
+    except Exception:
+        message = ''
+    return (exc_type.__name__, message_template(message), tuple(frames[-max_frames:]))
+
+
+class _Bucket(object):
+    __slots__ = ('tokens', 'updated', 'suppressed', 'first_suppressed')
+
+    def __init__(self, tokens, now):
+        self.tokens = tokens
+        self.updated = now
+        self.suppressed = 0
+        self.first_suppressed = None
+
+
+class ErrorRateLimiter(object):
+    """
+    An LRU of exception fingerprints, each with its own token bucket.
+
+    `check` decides whether an exception should be sent and returns how many
+    repeats were suppressed since the last one that was.
+    """
+    def __init__(self, window=60.0, burst=1, max_fingerprints=256, max_frames=5):
+        self.window = float(window)
+        self.burst = max(int(burst), 1)
+        self.max_fingerprints = int(max_fingerprints)
+        self.max_frames = int(max_frames)
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def _refill(self, bucket, now):
+        rate = self.burst / self.window
+        bucket.tokens = min(self.burst, bucket.tokens + (now - bucket.updated) * rate)
+        bucket.updated = now
+
+    def check(self, exc_info, now=None):
+        """Returns a ``(send, suppressed)`` tuple for the exception."""
+        now = monotonic() if now is None else now
+        key = fingerprint(exc_info, self.max_frames)
+
+        with self._lock:
+            bucket = self._buckets.pop(key, None)
+            if bucket is None:
+                bucket = _Bucket(self.burst, now)
+            else:
+                self._refill(bucket, now)
+            self._buckets[key] = bucket
+            while len(self._buckets) > self.max_fingerprints:
+                self._buckets.popitem(last=False)
+
+            if bucket.tokens >= 1:
+                bucket.tokens -= 1
+                suppressed, bucket.suppressed, bucket.first_suppressed = bucket.suppressed, 0, None
+                return True, suppressed
+
+            bucket.suppressed += 1
+            if bucket.first_suppressed is None:
+                bucket.first_suppressed = now
+            return False, 0
+
+    def expired_summaries(self, now=None):
+        """
+        Returns ``(fingerprint, suppressed)`` for every fingerprint whose suppressed
+        repeats have been waiting longer than the window, and resets their counts.
+        """
+        now = monotonic() if now is None else now
+        summaries = []
+        with self._lock:
+            for key, bucket in self._buckets.items():
+                if bucket.suppressed and now - bucket.first_suppressed >= self.window:
+                    summaries.append((key, bucket.suppressed))
+                    bucket.suppressed, bucket.first_suppressed = 0, None
+        return summaries
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(window=60.0, burst=1, max_fingerprints=256, max_frames=5):
+    """Returns the process-wide limiter for these settings, so it survives across invocations."""
+    key = (float(window), int(burst), int(max_fingerprints), int(max_frames))
+    with _limiters_lock:
+        if key not in _limiters:
+            _limiters[key] = ErrorRateLimiter(*key)
+        return _limiters[key]
@@ -0,0 +1,163 @@
+"""
+.. module: raven_python_lambda.envelope
+    :platform: Unix
+    :copyright: (c) 2017 by Netflix Inc., see AUTHORS for more
+    :license: Apache, see LICENSE for more details.
+
+Encoding and decoding of the SQS messages written by `SQSTransport`.
+
+Version 1 (the default) is a JSON body holding the url, the headers and the
+base64 encoded payload::
+
+    {"url": ..., "headers": {...}, "data": "<base64 of the deflated event>"}
+
+Version 2 is the compact envelope. The url and headers travel as message
+attributes and the payload is stored with the tightest encoding that fits:
+
+- ``json``: the inflated event as the message body, for tiny events
+- ``deflate``: raven's deflated payload as a binary attribute, no base64
+- ``s3``: the deflated payload is stored in S3 and only a pointer is enqueued
+
+Consumers should use `decode_message`, which understands both versions as
+returned by `ReceiveMessage` (with ``MessageAttributeNames=['All']``) and as
+delivered to Lambda through an SQS event source.
+"""
+import base64
+import json
+import uuid
+import zlib
+
+# SQS rejects messages larger than 256 KB, attributes included.
+MAX_MESSAGE_BYTES = 256 * 1024
+
+ENVELOPE_VERSION = '2'
+
+ENCODING_JSON = 'json'
+ENCODING_DEFLATE = 'deflate'
+ENCODING_S3 = 's3'
+
+# Body placeholder for messages whose payload is not in the body (SQS requires one)
+EMPTY_BODY = '-'
+
+
+class MessageTooLarge(ValueError):
+    pass
+
+
+def _string(value):
+    return {'DataType': 'String', 'StringValue': value}
+
+
+def message_size(message):
+    """Size SQS counts against its limit: the body plus attribute names, types and values."""
+    size = len(message['MessageBody'].encode('utf-8'))
+    for name, attribute in message.get('MessageAttributes', {}).items():
+        value = attribute.get('StringValue')
+        if value is not None:
+            value = value.encode('utf-8')
+        else:
+            value = attribute['BinaryValue']
+        size += len(name) + len(attribute['DataType']) + len(value)
+    return size
+
+
+def encode_v1(url, data, headers):
+    payload = {
+        "url": url,
+        "headers": headers,
+        "data": base64.b64encode(data).decode("utf-8")
+    }
+    return {'MessageBody': json.dumps(payload)}
+
+
+def encode_v2(url, data, headers, s3_client=None, s3_bucket=None, s3_prefix=''):
+    """
+    Builds the `SendMessage` arguments for a compact envelope. `data` is the
+    deflated payload produced by raven's `Client.encode`.
+    """
+    attributes = {
+        'sentry_envelope': _string(ENVELOPE_VERSION),
+        'sentry_url': _string(url),
+        'sentry_headers': _string(json.dumps(headers, separators=(',', ':'))),
+    }
+
+    candidates = []
+    # The inflated event only wins for tiny payloads, don't inflate big ones just to check.
+    if len(data) < 1024:
+        inflated = zlib.decompress(data).decode('utf-8')
+        candidates.append({
+            'MessageBody': inflated,
+            'MessageAttributes': dict(attributes, sentry_encoding=_string(ENCODING_JSON))
+        })
+    candidates.append({
+        'MessageBody': EMPTY_BODY,
+        'MessageAttributes': dict(attributes,
+                                  sentry_encoding=_string(ENCODING_DEFLATE),
+                                  sentry_data={'DataType': 'Binary', 'BinaryValue': data})
+    })
+
+    message = min(candidates, key=message_size)
+    if message_size(message) <= MAX_MESSAGE_BYTES:
+        return message
+
+    if not s3_bucket:
+        raise MessageTooLarge('Event of %d bytes exceeds the SQS message size limit and no '
+                              'sqs_s3_bucket is configured' % len(data))
+
+    key = '%s%s' % (s3_prefix, uuid.uuid4().hex)
+    s3_client.put_object(Bucket=s3_bucket, Key=key, Body=data, ContentEncoding='deflate')
+    return {
+        'MessageBody': EMPTY_BODY,
+        'MessageAttributes': dict(attributes,
+                                  sentry_encoding=_string(ENCODING_S3),
+                                  sentry_s3_bucket=_string(s3_bucket),
+                                  sentry_s3_key=_string(key))
+    }
+
+
+def _attribute(attributes, name):
+    """Reads an attribute from either the `ReceiveMessage` or the Lambda event record shape."""
+    attribute = attributes.get(name)
+    if not attribute:
+        return None
+    if 'StringValue' in attribute or 'BinaryValue' in attribute:
+        return attribute.get('StringValue', attribute.get('BinaryValue'))
+    if 'stringValue' in attribute:
+        return attribute['stringValue']
+    return base64.b64decode(attribute['binaryValue'])
+
+
+def decode_message(message, s3_client=None):
+    """
+    Decodes a message written by `SQSTransport` into a ``(url, headers, data)``
+    tuple that can be POSTed to Sentry as is.
+
+    `message` is either an entry of `ReceiveMessage`'s ``Messages`` or a record of
+    a Lambda SQS event. `s3_client` is required for claim-checked events.
+    """
+    body = message.get('Body', message.get('body'))
+    attributes = message.get('MessageAttributes', message.get('messageAttributes')) or {}
+
+    if _attribute(attributes, 'sentry_envelope') is None:
+        payload = json.loads(body)
+        return payload['url'], payload['headers'], base64.b64decode(payload['data'])
+
+    url = _attribute(attributes, 'sentry_url')
+    headers = json.loads(_attribute(attributes, 'sentry_headers'))
+    encoding = _attribute(attributes, 'sentry_encoding')
+
+    if encoding == ENCODING_JSON:
+        headers.pop('Content-Encoding', None)
+        return url, headers, body.encode('utf-8')
+
+    if encoding == ENCODING_DEFLATE:
+        return url, headers, _attribute(attributes, 'sentry_data')
+
+    if encoding == ENCODING_S3:
+        if s3_client is None:
+            raise ValueError('An S3 client is required to decode claim-checked events')
+        response = s3_client.get_object(Bucket=_attribute(attributes, 'sentry_s3_bucket'),
+                                        Key=_attribute(attributes, 'sentry_s3_key'))
+        return url, headers, response['Body'].read()
+
+    raise ValueError('Unknown envelope encoding: %r' % encoding)
@@ -0,0 +1,339 @@
+"""
+.. module: raven_python_lambda.extension
+    :platform: Unix
+    :copyright: (c) 2017 by Netflix Inc., see AUTHORS for more
+    :license: Apache, see LICENSE for more details.
+
+Event delivery from a Lambda extension, a companion process that keeps running
+after the function has returned its response.
+
+With ``SENTRY_EXTENSION`` set, the wrapper doesn't send events itself: it writes
+them to the extension's Unix domain socket, framed as spool records, and marks
+the end of every invocation the same way. Once an invocation is done the
+extension sends its events through the usual transports (SQS or HTTP, batched
+and spooled as configured), retrying failures within the invocation's
+deadline. If the socket can't be written, the wrapper sends the event itself.
+
+Lambda starts extensions from the ``extensions`` directory of a layer, e.g.
+``extensions/raven-python-lambda``:
+
+    #!/bin/sh
+    export PYTHONPATH=/opt/python:/var/task
+    exec python3 -m raven_python_lambda.extension "$(basename "$0")"
+"""
+import os
+import sys
+import json
+import time
+import socket
+import logging
+import threading
+from collections import deque
+
+from raven.exceptions import RateLimited
+from raven.utils.compat import httplib
+
+from raven_python_lambda import metrics
+from raven_python_lambda.compat import monotonic
+from raven_python_lambda.spool import pack_record, read_record
+from raven_python_lambda.transports import TransportWrapper
+
+try:
+    import socketserver
+except ImportError:  # Python 2.7
+    import SocketServer as socketserver
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SOCKET = '/tmp/raven-extension.sock'
+RUNTIME_API_VERSION = '2020-01-01'
+# stop delivering this long before the invocation's deadline
+DEADLINE_MARGIN = 0.1
+
+
+class ExtensionConnection(object):
+    """A connection to the extension's socket, reopened after errors and in forked children."""
+    def __init__(self, path, timeout=0.5):
+        self.path = path
+        self.timeout = timeout
+        self._sock = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def write(self, frame):
+        """Writes one frame, reconnecting once if the connection was lost. Raises socket.error."""
+        with self._lock:
+            for attempt in (0, 1):
+                try:
+                    self._connect().sendall(frame)
+                    return
+                except (socket.error, OSError):
+                    self._close()
+                    if attempt:
+                        raise
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+    def _connect(self):
+        if self._sock is None or self._pid != os.getpid():
+            # a socket inherited through fork is shared with the parent, don't interleave writes on it
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            try:
+                sock.connect(self.path)
+            except (socket.error, OSError):
+                sock.close()
+                raise
+            self._sock, self._pid = sock, os.getpid()
+        return self._sock
+
+    def _close(self):
+        if self._sock is not None and self._pid == os.getpid():
+            self._sock.close()
+        self._sock = None
+
+
+_connections = {}
+_connections_lock = threading.Lock()
+
+
+def get_connection(path=DEFAULT_SOCKET):
+    """Returns the process-wide connection to the extension listening on `path`."""
+    with _connections_lock:
+        if path not in _connections:
+            _connections[path] = ExtensionConnection(path)
+        return _connections[path]
+
+
+class ExtensionTransport(TransportWrapper):
+    """Hands events to the extension, or sends them through the wrapped transport if it can't."""
+    def __init__(self, transport, path=DEFAULT_SOCKET):
+        super(ExtensionTransport, self).__init__(transport)
+        self.connection = get_connection(path)
+        self.stats = dict(handed=0, direct=0)
+
+    def send(self, url, data, headers):
+        try:
+            self.connection.write(pack_record({'url': url, 'headers': dict(headers or {})}, data))
+            self.stats['handed'] += 1
+            metrics.increment('EventsHanded')
+        except (socket.error, OSError):
+            logger.warning('Unable to reach the Sentry extension, sending the event directly', exc_info=True)
+            self.stats['direct'] += 1
+            self.transport.send(url, data, headers)
+
+
+def invocation_done(path=DEFAULT_SOCKET, context=None):
+    """Tells the extension that every event of the invocation has been written."""
+    try:
+        get_connection(path).write(pack_record({'done': getattr(context, 'aws_request_id', None)}, b''))
+    except (socket.error, OSError):
+        logger.debug('Unable to reach the Sentry extension', exc_info=True)
+
+
+class RuntimeAPI(object):
+    """Client for the Lambda Extensions API."""
+    def __init__(self, address):
+        self.address = address
+        self.extension_id = None
+
+    def _request(self, method, path, body=None, headers=None):
+        conn = httplib.HTTPConnection(self.address)
+        try:
+            conn.request(method, '/%s/extension/%s' % (RUNTIME_API_VERSION, path), body, headers or {})
+            response = conn.getresponse()
+            data = response.read()
+            if response.status >= 300:
+                raise IOError('Extensions API returned %d for %s: %s' % (response.status, path, data))
+            return response, data
+        finally:
+            conn.close()
+
+    def register(self, name, events=('INVOKE', 'SHUTDOWN')):
+        response, _ = self._request('POST', 'register', json.dumps({'events': list(events)}),
+                                    {'Lambda-Extension-Name': name})
+        self.extension_id = response.getheader('Lambda-Extension-Identifier')
+        return self.extension_id
+
+    def next_event(self):
+        """Blocks until the next invocation, or the shutdown, of the execution environment."""
+        _, data = self._request('GET', 'event/next', headers={'Lambda-Extension-Identifier': self.extension_id})
+        return json.loads(data.decode('utf-8'))
+
+
+class FrameHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        while True:
+            try:
+                record = read_record(self.rfile)
+            except ValueError:
+                logger.warning('Closing a Sentry extension connection that sent a corrupt frame')
+                return
+            if record is None:
+                return
+            self.server.extension.receive(*record)
+
+
+class FrameServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class Extension(object):
+    """
+    Receives events on `socket_path` and delivers them through `transport` after
+    each invocation, and at shutdown.
+
+    `stats` keeps running counters:
+
+    - `received`: events written by the function
+    - `sent`: events the transport accepted
+    - `retried`: failed sends that were tried again
+    - `dropped`: events given up on, or rejected because `max_pending` were waiting
+    """
+    def __init__(self, runtime_api, socket_path, transport, retries=3, backoff=0.1, max_pending=1000):
+        self.runtime_api = runtime_api
+        self.socket_path = socket_path
+        self.transport = transport
+        self.retries = retries
+        self.backoff = backoff
+        self.max_pending = max_pending
+        self.stats = dict(received=0, sent=0, retried=0, dropped=0)
+        self._pending = deque()
+        self._done = deque(maxlen=100)
+        self._cond = threading.Condition(threading.Lock())
+        self._server = None
+
+    def receive(self, meta, data):
+        with self._cond:
+            if 'done' in meta:
+                self._done.append(meta['done'])
+                self._cond.notify_all()
+                return
+            if len(self._pending) >= self.max_pending:
+                self.stats['dropped'] += 1
+                logger.warning('Sentry extension has %d events waiting, dropping event', len(self._pending))
+                return
+            self._pending.append((meta['url'], data, meta['headers']))
+            self.stats['received'] += 1
+
+    def serve(self):
+        """Starts accepting connections on the socket."""
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        self._server = FrameServer(self.socket_path, FrameHandler)
+        self._server.extension = self
+        thread = threading.Thread(target=self._server.serve_forever, name='raven_python_lambda.Extension')
+        thread.daemon = True
+        thread.start()
+
+    def close(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+    def wait_for_invocation(self, request_id, deadline):
+        """Waits until the function marked the invocation done. Returns False at `deadline`."""
+        with self._cond:
+            while request_id not in self._done:
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            return True
+
+    def deliver(self, deadline):
+        """Sends the waiting events, then flushes the transport, until `deadline`."""
+        while monotonic() < deadline:
+            with self._cond:
+                if not self._pending:
+                    break
+                url, data, headers = self._pending.popleft()
+            self._send(url, data, headers, deadline)
+
+        flush = getattr(self.transport, 'flush', None)
+        if flush is not None:
+            try:
+                flush(timeout=max(deadline - monotonic(), 0))
+            except Exception:
+                logger.exception('Unable to flush buffered Sentry events')
+
+    def _send(self, url, data, headers, deadline):
+        if self.transport is None:
+            self.stats['dropped'] += 1
+            return False
+
+        delay = self.backoff
+        for attempt in range(self.retries + 1):
+            try:
+                self.transport.send(url, data, headers)
+                self.stats['sent'] += 1
+                return True
+            except RateLimited as e:
+                delay = max(e.retry_after, delay)
+                logger.warning('Sentry rate limited the extension for %ss', e.retry_after)
+            except Exception:
+                logger.warning('Unable to send Sentry event from the extension', exc_info=True)
+            if attempt == self.retries or monotonic() + delay >= deadline:
+                break
+            self.stats['retried'] += 1
+            time.sleep(delay)
+            delay *= 2
+
+        self.stats['dropped'] += 1
+        return False
+
+    def run(self, name):
+        """Registers the extension and delivers events until the execution environment shuts down."""
+        self.serve()
+        self.runtime_api.register(name)
+        try:
+            while True:
+                event = self.runtime_api.next_event()
+                deadline = monotonic() + event.get('deadlineMs', 0) / 1000.0 - time.time() - DEADLINE_MARGIN
+                if event.get('eventType') == 'SHUTDOWN':
+                    self.deliver(deadline)
+                    return
+                if not self.wait_for_invocation(event.get('requestId'), deadline):
+                    logger.warning('Invocation %s never finished writing Sentry events', event.get('requestId'))
+                self.deliver(deadline)
+        finally:
+            self.close()
+
+
+def build_transport():
+    """The transport the function itself would use, from the same SENTRY_* environment."""
+    from raven_python_lambda import boolval, configure_raven_client
+    from raven_python_lambda.transports import get_transport
+
+    if not os.environ.get('SENTRY_DSN'):
+        logger.warning('SENTRY_DSN is not set, the Sentry extension will drop every event')
+        return None
+
+    client = configure_raven_client({
+        'is_local': False,
+        'keepalive': boolval(os.environ.get('SENTRY_KEEPALIVE', False)),
+        'spool': boolval(os.environ.get('SENTRY_SPOOL', False)),
+        'spool_dir': os.environ.get('SENTRY_SPOOL_DIR', '/tmp/raven-spool'),
+        'spool_max_bytes': int(os.environ.get('SENTRY_SPOOL_MAX_BYTES', 10 * 1024 * 1024)),
+    })
+    return get_transport(client)
+
+
+def main(argv=None):
+    argv = sys.argv if argv is None else argv
+    logging.basicConfig(level=logging.INFO, format='[raven-python-lambda-extension] %(levelname)s %(message)s')
+    extension = Extension(
+        RuntimeAPI(os.environ['AWS_LAMBDA_RUNTIME_API']),
+        os.environ.get('SENTRY_EXTENSION_SOCKET', DEFAULT_SOCKET),
+        build_transport(),
+    )
+    extension.run(argv[1] if len(argv) > 1 else 'raven-python-lambda')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,322 @@
+"""
+.. module: raven_python_lambda.forwarder
+    :platform: Unix
+    :copyright: (c) 2017 by Netflix Inc., see AUTHORS for more
+    :license: Apache, see LICENSE for more details.
+
+The consumer side of `SQSTransport`: forwards the events it enqueued to Sentry.
+
+`Forwarder.run` long-polls the queue ten messages at a time and POSTs the
+events concurrently, at most `concurrency` at once, over a pool of keep-alive
+connections (see `raven_python_lambda.http_transport`). Delivered messages,
+and messages Sentry rejected for good, are deleted in batches. A 429 from
+Sentry pauses every worker for its ``Retry-After``; other failures are retried
+with exponential back-off, and messages that still fail are left on the queue
+to become visible again (configure a redrive policy to park poison messages).
+
+It runs as a Lambda function, either triggered by the queue through an SQS
+event source mapping (with ``ReportBatchItemFailures``) or on a schedule,
+draining the queue until the invocation is almost out of time::
+
+    raven_python_lambda.forwarder.handler
+
+or as a long running process::
+
+    python -m raven_python_lambda.forwarder https://sqs.us-east-1.amazonaws.com/111111111111/sentry-queue
+"""
+import os
+import sys
+import time
+import logging
+import argparse
+import threading
+
+from raven.exceptions import APIError, RateLimited
+
+from raven_python_lambda.batch import get_executor, process_batch
+from raven_python_lambda.compat import monotonic
+from raven_python_lambda.envelope import decode_message
+
+logger = logging.getLogger(__name__)
+
+# ReceiveMessage and DeleteMessageBatch limit
+MAX_BATCH_ENTRIES = 10
+
+# seconds kept back from the Lambda deadline to finish the sends in flight and delete their messages
+DEADLINE_MARGIN = 2.0
+
+
+class Forwarder(object):
+    """
+    Forwards the events `SQSTransport` enqueued on `queue_url` to Sentry through
+    `transport`, a `KeepAliveHTTPTransport` with a connection per worker by default.
+
+    `stats` keeps running counters:
+
+    - `received`: messages received from the queue
+    - `forwarded`: events Sentry accepted
+    - `rejected`: messages that can never be delivered (malformed, or refused with a 4xx)
+    - `failed`: messages given up on for now, left on the queue
+    - `retried`: failed sends that were tried again
+    - `rate_limited`: 429 responses
+    - `deleted`: messages deleted from the queue
+    """
+    def __init__(self, sqs_client, queue_url=None, transport=None, concurrency=16, wait_time=20,
+                 retries=3, backoff=0.1, s3_client=None):
+        if transport is None:
+            from raven_python_lambda.http_transport import KeepAliveHTTPTransport
+            transport = KeepAliveHTTPTransport(pool_size=concurrency)
+        self.sqs_client = sqs_client
+        self.queue_url = queue_url
+        self.transport = transport
+        self.concurrency = concurrency
+        self.wait_time = wait_time
+        self.retries = retries
+        self.backoff = backoff
+        self.s3_client = s3_client
+        self.stats = dict(received=0, forwarded=0, rejected=0, failed=0, retried=0, rate_limited=0, deleted=0)
+        self._lock = threading.Lock()
+        self._paused_until = 0.0
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self.stats[name] += n
+
+    def forward(self, message, deadline=None):
+        """
+        Sends the event of one message to Sentry. Returns True once the message can
+        be deleted: it was delivered, or it never will be.
+        """
+        try:
+            url, headers, data = decode_message(message, self.s3_client)
+        except (ValueError, KeyError, TypeError):
+            logger.exception('Unable to decode message %s, dropping it', _message_id(message))
+            self._count('rejected')
+            return True
+        except Exception:
+            # e.g. the claim-checked payload couldn't be read from S3
+            logger.warning('Unable to decode message %s', _message_id(message), exc_info=True)
+            self._count('failed')
+            return False
+
+        delay = self.backoff
+        for attempt in range(self.retries + 1):
+            self._wait_while_rate_limited(deadline)
+            try:
+                self.transport.send(url, data, headers)
+                self._count('forwarded')
+                return True
+            except RateLimited as e:
+                self._count('rate_limited')
+                self._pause(max(e.retry_after, delay))
+            except APIError as e:
+                if 400 <= e.code < 500:
+                    logger.error('Sentry rejected message %s: %s', _message_id(message), e)
+                    self._count('rejected')
+                    return True
+                logger.warning('Unable to forward message %s: %s', _message_id(message), e)
+            except Exception:
+                logger.warning('Unable to forward message %s', _message_id(message), exc_info=True)
+            if attempt == self.retries or (deadline is not None and monotonic() + delay >= deadline):
+                break
+            self._count('retried')
+            time.sleep(delay)
+            delay *= 2
+
+        self._count('failed')
+        return False
+
+    def _pause(self, seconds):
+        # Sentry rate limits the project, not the connection: every worker backs off
+        with self._lock:
+            self._paused_until = max(self._paused_until, monotonic() + seconds)
+
+    def _wait_while_rate_limited(self, deadline):
+        while True:
+            with self._lock:
+                remaining = self._paused_until - monotonic()
+            if deadline is not None:
+                remaining = min(remaining, deadline - monotonic())
+            if remaining <= 0:
+                return
+            time.sleep(remaining)
+
+    def receive(self, wait_time):
+        messages = self.sqs_client.receive_message(
+            QueueUrl=self.queue_url,
+            MaxNumberOfMessages=MAX_BATCH_ENTRIES,
+            WaitTimeSeconds=wait_time,
+            MessageAttributeNames=['All'],
+        ).get('Messages', [])
+        self._count('received', len(messages))
+        return messages
+
+    def delete(self, receipt_handles):
+        """Deletes the messages with `DeleteMessageBatch`, ten at a time."""
+        for i in range(0, len(receipt_handles), MAX_BATCH_ENTRIES):
+            chunk = receipt_handles[i:i + MAX_BATCH_ENTRIES]
+            try:
+                response = self.sqs_client.delete_message_batch(
+                    QueueUrl=self.queue_url,
+                    Entries=[{'Id': str(n), 'ReceiptHandle': handle} for n, handle in enumerate(chunk)],
+                )
+            except Exception:
+                # they will be received, and forwarded, again
+                logger.warning('Unable to delete %d forwarded messages', len(chunk), exc_info=True)
+                continue
+            for failure in response.get('Failed', []):
+                logger.warning('Unable to delete forwarded message: %s', failure.get('Message'))
+            self._count('deleted', len(response.get('Successful', [])))
+
+    def run(self, deadline=None, until_empty=False):
+        """
+        Forwards messages until `deadline` (a `monotonic` time), or once a receive
+        comes back empty if `until_empty`, or forever.
+        """
+        executor = get_executor(self.concurrency)
+        slots = threading.BoundedSemaphore(self.concurrency)
+        done = []
+        in_flight = set()
+
+        def forward(message):
+            try:
+                if self.forward(message, deadline):
+                    with self._lock:
+                        done.append(message['ReceiptHandle'])
+            finally:
+                slots.release()
+
+        def take_done():
+            with self._lock:
+                handles = done[:]
+                del done[:]
+            return handles
+
+        try:
+            while True:
+                wait_time = self.wait_time
+                if deadline is not None:
+                    wait_time = min(wait_time, int(deadline - monotonic() - getattr(self.transport, 'timeout', 0)))
+                    if wait_time < 0:
+                        break
+
+                try:
+                    messages = self.receive(wait_time)
+                except Exception:
+                    logger.warning('Unable to receive messages from %s', self.queue_url, exc_info=True)
+                    time.sleep(self.backoff)
+                    continue
+
+                if not messages and until_empty:
+                    break
+                for message in messages:
+                    # blocks while `concurrency` sends are in flight, or paused by a 429
+                    slots.acquire()
+                    future = executor.submit(forward, message)
+                    in_flight.add(future)
+                    future.add_done_callback(in_flight.discard)
+
+                # as soon as they are forwarded, or they outlive the visibility timeout and are forwarded again
+                handles = take_done()
+                if handles:
+                    self.delete(handles)
+        finally:
+            for future in list(in_flight):
+                future.result()
+            self.delete(take_done())
+
+    def forward_batch(self, event, context):
+        """Forwards the records of an SQS event, returning the ``batchItemFailures`` response."""
+        def forward(record, context):
+            if not self.forward(record):
+                raise IOError('Unable to forward message %s' % _message_id(record))
+
+        def on_failure(record):
+            logger.warning('Leaving message %s on the queue', _message_id(record))
+
+        return process_batch(event, context, forward, on_failure, concurrency=self.concurrency)
+
+
+def _message_id(message):
+    return message.get('MessageId', message.get('messageId'))
+
+
+def _region(queue_url):
+    # https://sqs.<region>.amazonaws.com/<account>/<name>
+    host = (queue_url or '').split('/')[2:3]
+    parts = host[0].split('.') if host else []
+    if len(parts) > 2 and parts[0] == 'sqs':
+        return parts[1]
+    return os.environ.get('AWS_REGION')
+
+
+def build_forwarder(queue_url=None, concurrency=16, wait_time=20, region=None):
+    import boto3
+    from raven_python_lambda.sqs_transport import client_config
+
+    region = region or _region(queue_url)
+    # the long poll must not be cut short by botocore's read timeout
+    config = client_config(wait_time + 5)
+    return Forwarder(
+        boto3.client('sqs', region_name=region, config=config),
+        queue_url,
+        concurrency=concurrency,
+        wait_time=wait_time,
+        s3_client=boto3.client('s3', region_name=region, config=config),
+    )
+
+
+_forwarder = None
+
+
+def get_forwarder():
+    """The process-wide forwarder of the Lambda handler, configured from SENTRY_FORWARDER_* variables."""
+    global _forwarder
+    if _forwarder is None:
+        _forwarder = build_forwarder(
+            os.environ.get('SENTRY_FORWARDER_QUEUE_URL'),
+            concurrency=int(os.environ.get('SENTRY_FORWARDER_CONCURRENCY', 16)),
+            wait_time=int(os.environ.get('SENTRY_FORWARDER_WAIT_TIME', 20)),
+        )
+    return _forwarder
+
+
+def handler(event, context):
+    """
+    Lambda entry point. Forwards the records of an SQS event, or, invoked any other
+    way (e.g. on a schedule), drains ``SENTRY_FORWARDER_QUEUE_URL`` until it is empty
+    or the invocation is almost out of time.
+    """
+    forwarder = get_forwarder()
+    if isinstance(event, dict) and event.get('Records'):
+        return forwarder.forward_batch(event, context)
+
+    if not forwarder.queue_url:
+        raise ValueError('SENTRY_FORWARDER_QUEUE_URL is not set')
+    deadline = None
+    if hasattr(context, 'get_remaining_time_in_millis'):
+        deadline = monotonic() + context.get_remaining_time_in_millis() / 1000.0 - DEADLINE_MARGIN
+    forwarder.run(deadline, until_empty=True)
+    return dict(forwarder.stats)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Forwards the Sentry events SQSTransport enqueued to Sentry.')
+    parser.add_argument('queue_url', help='url of the SQS queue')
+    parser.add_argument('--region', help='region of the queue (defaults to the one in its url)')
+    parser.add_argument('--concurrency', type=int, default=16, help='events forwarded at once')
+    parser.add_argument('--wait-time', type=int, default=20, help='seconds each receive long-polls for')
+    parser.add_argument('--until-empty', action='store_true', help='exit once the queue is empty')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='[raven-python-lambda-forwarder] %(levelname)s %(message)s')
+    forwarder = build_forwarder(args.queue_url, args.concurrency, args.wait_time, args.region)
+    try:
+        forwarder.run(until_empty=args.until_empty)
+    except KeyboardInterrupt:
+        pass
+    logger.info('Forwarder stats: %s', forwarder.stats)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,235 @@
+"""
+.. module: raven_python_lambda.frames
+    :platform: Unix
+    :copyright: (c) 2017 by Netflix Inc., see AUTHORS for more
+    :license: Apache, see LICENSE for more details.
+
+Size-budgeted local variables for captured exceptions.
+
+raven transforms and reprs every local of every frame before it trims
+anything, which for handlers holding dataframes, byte buffers or decoded
+batches means seconds of CPU and events SQS won't take. `BudgetedException`
+replaces raven's exception event on the client: the stack is collected
+without locals, and locals are then added within one byte budget for the
+whole event, innermost frame first, since that's where the exception was
+raised.
+
+Values are rendered by `LocalsBudget.repr`, which builds reprs of strings,
+bytes and containers piece by piece and stops at the budget instead of
+truncating the full repr. Locals of the types in `skip_types` (matched by
+qualified name, so numpy or pandas are never imported) are only described.
+What didn't make it is recorded in the frame, under the ``...`` variable.
+
+Since the values reach raven's processors as strings, the keys of the dicts
+inside them are sanitized while they are rendered, by the client's own
+`SanitizeKeysProcessor` processors (`SanitizePasswordsProcessor` by default).
+"""
+from raven.events import Exception as ExceptionEvent
+from raven.processors import SanitizeKeysProcessor
+from raven.utils.compat import string_types
+from raven.utils.encoding import to_unicode
+from raven.utils.stacks import get_stack_info, iter_traceback_frames
+
+from raven_python_lambda.compat import text_type
+
+# Summarized without being repr'd: their reprs are expensive and say little
+DEFAULT_SKIP_TYPES = (
+    'numpy.ndarray',
+    'pandas.core.frame.DataFrame',
+    'pandas.core.series.Series',
+    'pyarrow.lib.Table',
+    'pyarrow.lib.RecordBatch',
+)
+
+# Variables with these names (raven internals, module dunders) are never worth the budget
+IGNORED_NAMES = ('__traceback_hide__', '__builtins__')
+
+SIZED_TYPES = (list, tuple, dict, set, frozenset, bytes, bytearray, text_type)
+
+
+def _qualified_name(cls):
+    return '%s.%s' % (cls.__module__, getattr(cls, '__qualname__', cls.__name__))
+
+
+class LocalsBudget(object):
+    """
+    Renders the locals of one event's frames within `max_bytes` for all frames
+    together, and at most `max_var_bytes` for any single variable. The items of
+    dicts are passed through `sanitize(key, value)`, if given, before they are rendered.
+    """
+    def __init__(self, max_bytes=16384, max_var_bytes=2048, max_depth=3, max_list_length=20,
+                 skip_types=DEFAULT_SKIP_TYPES, sanitize=None):
+        self.max_bytes = max_bytes
+        self.max_var_bytes = max_var_bytes
+        self.max_depth = max_depth
+        self.max_list_length = max_list_length
+        self.skip_types = frozenset(skip_types)
+        self.sanitize = sanitize
+        self._skipped_types = {}
+        self.remaining = max_bytes
+
+    def add_locals(self, frames):
+        """Sets ``vars`` on each ``(frame, frame_result)`` pair, innermost first, until the budget is spent."""
+        for frame, result in frames:
+            try:
+                f_locals = dict(getattr(frame, 'f_locals', None) or {})
+            except Exception:
+                continue
+
+            names = [name for name in f_locals if name not in IGNORED_NAMES]
+            if not names:
+                continue
+            f_vars = {}
+            dropped = []
+            for name in sorted(names):
+                if self.remaining <= 0:
+                    dropped.append(name)
+                    continue
+                f_vars[name] = self.render(f_locals[name])
+
+            if dropped:
+                f_vars['...'] = u'<%d locals over the budget: %s>' % (len(dropped), u', '.join(dropped))
+            if f_vars:
+                result['vars'] = f_vars
+
+    def render(self, value):
+        """A repr of `value` of at most `max_var_bytes`, charged against the budget."""
+        limit = min(self.max_var_bytes, self.remaining)
+        skipped = self._skipped_type(value)
+        if skipped:
+            text = u'<%s%s, skipped>' % (skipped, self._size(value))
+        else:
+            try:
+                text = self.repr(value, limit)
+            except Exception:
+                text = u'<%s, repr failed>' % _qualified_name(type(value))
+        self.remaining -= len(text)
+        return text
+
+    def _skipped_type(self, value):
+        cls = type(value)
+        if cls not in self._skipped_types:
+            names = [_qualified_name(c) for c in getattr(cls, '__mro__', (cls,))]
+            self._skipped_types[cls] = next((n for n in names if n in self.skip_types), None)
+        return self._skipped_types[cls]
+
+    def _size(self, value):
+        if isinstance(value, SIZED_TYPES):
+            return u' of length %d' % len(value)
+        shape = getattr(value, 'shape', None)
+        if isinstance(shape, tuple):
+            return u' of shape %r' % (shape,)
+        return u''
+
+    def repr(self, value, limit, depth=0):
+        """
+        The repr of `value`, cut at about `limit` characters. Strings and bytes are
+        sliced before they are repr'd, and containers are rendered item by item
+        until the limit is reached.
+        """
+        if limit <= 0:
+            return u'...'
+
+        if isinstance(value, string_types + (bytes, bytearray)):
+            if len(value) <= limit:
+                return text_type(repr(value))
+            return u'%s...<%d more>' % (repr(value[:limit]), len(value) - limit)
+
+        if isinstance(value, dict):
+            return self._repr_items(value.items(), len(value), u'{', u'}', limit, depth, pairs=True)
+        if isinstance(value, list):
+            return self._repr_items(value, len(value), u'[', u']', limit, depth)
+        if isinstance(value, tuple):
+            return self._repr_items(value, len(value), u'(', u')', limit, depth)
+        if isinstance(value, (set, frozenset)):
+            return self._repr_items(value, len(value), u'{', u'}', limit, depth)
+
+        # anything else gets to repr itself, the only place a full repr is built
+        text = repr(value)
+        if not isinstance(text, text_type):
+            text = text.decode('utf-8', 'replace')
+        if len(text) <= limit:
+            return text
+        return u'%s...<%d more>' % (text[:limit], len(text) - limit)
+
+    def _repr_items(self, items, length, opening, closing, limit, depth, pairs=False):
+        if depth >= self.max_depth:
+            return u'%s...%d items%s' % (opening, length, closing)
+
+        parts = []
+        used = len(opening) + len(closing)
+        for i, item in enumerate(items):
+            if i >= self.max_list_length or used >= limit:
+                parts.append(u'...<%d more>' % (length - i))
+                break
+            if pairs:
+                key, item = item
+                if self.sanitize is not None:
+                    item = self.sanitize(key, item)
+                key_text = self.repr(key, limit - used, depth + 1)
+                text = u'%s: %s' % (key_text, self.repr(item, limit - used - len(key_text) - 2, depth + 1))
+            else:
+                text = self.repr(item, limit - used, depth + 1)
+            parts.append(text)
+            used += len(text) + 2
+        return opening + u', '.join(parts) + closing
+
+
+class BudgetedException(ExceptionEvent):
+    """raven's exception event, with locals added by a `LocalsBudget` rather than by raven."""
+    def __init__(self, client, budget):
+        super(BudgetedException, self).__init__(client)
+        self.budget = budget
+        self._frames = []
+
+    def _get_value(self, exc_type, exc_value, exc_traceback):
+        frames = list(iter_traceback_frames(exc_traceback))
+        stack_info = get_stack_info(frames, transformer=self.transform, capture_locals=False)
+        self._frames.append((frames, stack_info['frames']))
+
+        exc_module = getattr(exc_type, '__module__', None)
+        if exc_module:
+            exc_module = str(exc_module)
+        exc_type = getattr(exc_type, '__name__', '<unknown>')
+
+        return {
+            'value': to_unicode(exc_value),
+            'type': str(exc_type),
+            'module': to_unicode(exc_module),
+            'stacktrace': stack_info,
+        }
+
+    def capture(self, exc_info=None, **kwargs):
+        result = super(BudgetedException, self).capture(exc_info, **kwargs)
+        if self.client.capture_locals:
+            # raven yields the raised exception first, then the ones it was raised from
+            for frames, results in self._frames:
+                if len(frames) == len(results):
+                    pairs = [(frame, result) for (frame, _), result in zip(frames, results)]
+                    self.budget.add_locals(reversed(pairs))
+        return result
+
+
+def key_sanitizer(client):
+    """
+    `sanitize(key, value)` of the client's `SanitizeKeysProcessor` processors, or
+    None if it has none.
+    """
+    processors = [p for p in client.get_processors() if isinstance(p, SanitizeKeysProcessor)]
+    if not processors:
+        return None
+
+    def sanitize(key, value):
+        for processor in processors:
+            value = processor.sanitize(key, value)
+        return value
+    return sanitize
+
+
+def install_locals_budget(client, **options):
+    """
+    Makes `client` capture exceptions with `BudgetedException`. raven builds a new
+    event handler for every capture, and so a new `LocalsBudget` with `options`.
+    """
+    options.setdefault('sanitize', key_sanitizer(client))
+    client.module_cache['raven.events.Exception'] = lambda client: BudgetedException(client, LocalsBudget(**options))
@@ -0,0 +1,181 @@
+"""
+.. module: raven_python_lambda.http_transport
+    :platform: Unix
+    :copyright: (c) 2017 by Netflix Inc., see AUTHORS for more
+    :license: Apache, see LICENSE for more details.
+
+An HTTP transport that keeps its connections open between events.
+
+raven's `HTTPTransport` opens a new connection, and does a new TLS handshake,
+for every event. Warm containers reuse the process for many invocations, so
+this transport keeps a small pool of idle keep-alive connections per host
+instead. A connection that sat through a container freeze may have been closed
+by the server or a load balancer in the meantime: idle connections are checked
+before reuse, and a request that fails on a reused connection is retried once
+on a fresh one.
+"""
+import select
+import socket
+import ssl
+import threading
+
+from raven.conf import defaults
+from raven.exceptions import APIError, RateLimited
+from raven.transport.http import HTTPTransport
+from raven.utils.compat import httplib, string_types, urlparse
+
+from raven_python_lambda.compat import monotonic
+
+# Errors meaning the server went away on a connection that looked healthy
+RESET_ERRORS = (httplib.BadStatusLine, httplib.CannotSendRequest, socket.error, ssl.SSLError)
+
+
+class PooledConnection(object):
+    __slots__ = ('conn', 'last_used')
+
+    def __init__(self, conn):
+        self.conn = conn
+        # None until the connection goes back into the pool, see `_reused`
+        self.last_used = None
+
+
+class KeepAliveHTTPTransport(HTTPTransport):
+    """
+    `HTTPTransport` with persistent, pooled connections.
+
+    Takes two options from the DSN query string on top of raven's: `pool_size`,
+    the number of idle connections kept per host, and `max_idle`, the number of
+    seconds after which an idle connection is no longer trusted.
+    """
+    scheme = ['keepalive+http', 'keepalive+https']
+
+    def __init__(self, timeout=defaults.TIMEOUT, verify_ssl=True, ca_certs=defaults.CA_BUNDLE,
+                 pool_size=2, max_idle=50):
+        super(KeepAliveHTTPTransport, self).__init__(timeout, verify_ssl, ca_certs)
+        self.pool_size = int(pool_size)
+        self.max_idle = float(max_idle)
+        self.connections_opened = 0
+        self._pools = {}
+        self._lock = threading.Lock()
+        self._ssl_context = None
+
+    def send(self, url, data, headers):
+        parsed = urlparse.urlsplit(url)
+        key = (parsed.scheme, parsed.hostname, parsed.port)
+        path = parsed.path + ('?' + parsed.query if parsed.query else '')
+
+        pooled = self._checkout(key)
+        try:
+            response = self._request(pooled, path, data, headers)
+        except socket.timeout:
+            # a slow server isn't a dropped connection, don't double the wait
+            pooled.conn.close()
+            raise
+        except RESET_ERRORS:
+            pooled.conn.close()
+            if not self._reused(pooled):
+                raise
+            # the server dropped an idle connection while we weren't looking, retry once
+            pooled = self._connect(key)
+            try:
+                response = self._request(pooled, path, data, headers)
+            except Exception:
+                pooled.conn.close()
+                raise
+        except Exception:
+            pooled.conn.close()
+            raise
+
+        body = response.read()
+        if response.will_close:
+            pooled.conn.close()
+        else:
+            self._checkin(key, pooled)
+
+        if response.status >= 400:
+            raise_for_status(response, body)
+        return response
+
+    def close(self):
+        """Closes every idle connection."""
+        with self._lock:
+            pools, self._pools = self._pools, {}
+        for pool in pools.values():
+            for pooled in pool:
+                pooled.conn.close()
+
+    def _request(self, pooled, path, data, headers):
+        pooled.conn.request('POST', path, data, headers)
+        return pooled.conn.getresponse()
+
+    def _reused(self, pooled):
+        # only connections taken from the pool are retried, a fresh one failing is a real error
+        return pooled.last_used is not None
+
+    def _checkout(self, key):
+        with self._lock:
+            pool = self._pools.get(key, [])
+            while pool:
+                pooled = pool.pop()
+                if not self._is_stale(pooled):
+                    return pooled
+                pooled.conn.close()
+        return self._connect(key)
+
+    def _checkin(self, key, pooled):
+        pooled.last_used = monotonic()
+        with self._lock:
+            pool = self._pools.setdefault(key, [])
+            if len(pool) < self.pool_size:
+                pool.append(pooled)
+                return
+        pooled.conn.close()
+
+    def _is_stale(self, pooled):
+        """
+        An idle connection is stale if it outlived `max_idle`, or if its socket is
+        readable: with no request in flight that can only be EOF or a reset.
+        """
+        if monotonic() - pooled.last_used > self.max_idle:
+            return True
+        sock = pooled.conn.sock
+        if sock is None:
+            return True
+        try:
+            readable, _, _ = select.select([sock], [], [], 0)
+        except (ValueError, select.error, socket.error):
+            return True
+        return bool(readable)
+
+    def _connect(self, key):
+        scheme, host, port = key
+        if scheme == 'https':
+            conn = httplib.HTTPSConnection(host, port, timeout=self.timeout, context=self._get_ssl_context())
+        else:
+            conn = httplib.HTTPConnection(host, port, timeout=self.timeout)
+        conn.connect()
+        conn.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.connections_opened += 1
+        return PooledConnection(conn)
+
+    def _get_ssl_context(self):
+        if self._ssl_context is None:
+            if self.verify_ssl:
+                self._ssl_context = ssl.create_default_context(cafile=self.ca_certs)
+            else:
+                self._ssl_context = ssl._create_unverified_context()
+        return self._ssl_context
+
+
+def raise_for_status(response, body):
+    """Raises raven's `RateLimited` or `APIError` for an error `response`, as `HTTPTransport` does."""
+    msg = response.getheader('x-sentry-error')
+    if response.status == 429:
+        try:
+            retry_after = int(response.getheader('retry-after'))
+        except (ValueError, TypeError):
+            retry_after = 0
+        raise RateLimited(msg, retry_after)
+    if not msg:
+        msg = body.decode('utf-8', 'replace') if not isinstance(body, string_types) else body
+    raise APIError(msg or response.reason, response.status)
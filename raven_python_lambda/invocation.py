@@ -0,0 +1,72 @@
+"""
+.. module: raven_python_lambda.invocation
+    :platform: Unix
+    :copyright: (c) 2017 by Netflix Inc., see AUTHORS for more
+    :license: Apache, see LICENSE for more details.
+
+What belongs to one invocation of a wrapped handler.
+
+A wrapper can be running several invocations at once: coroutine handlers can be
+awaited concurrently, and nested or threaded callers may share a wrapper. So the
+invocation's state is kept on an `Invocation`, not on the wrapper, and the one
+being run is found with `current_invocation`. That is a context variable, which
+follows asyncio tasks, or a thread local before Python 3.7. Neither is inherited
+by pool threads: code handing work to a pool passes the `Invocation` along.
+"""
+import threading
+
+try:
+    import contextvars
+except ImportError:  # Python < 3.7
+    contextvars = None
+
+
+class Invocation(object):
+    """
+    The state of one invocation:
+
+    - `context`: the Lambda context
+    - `raven_context`: tags, extra and user of the events it captures
+    - `memory`: its `MemorySampler`, if memory warnings are captured
+    - `telemetry`: its `InvocationTelemetry`, if it is tracked
+    - `worker_events`: events of worker exceptions, sent when it ends
+    """
+    def __init__(self, context, raven_context, memory=None, telemetry=None):
+        self.context = context
+        self.raven_context = raven_context
+        self.memory = memory
+        self.telemetry = telemetry
+        self.worker_events = []
+
+
+if contextvars is not None:
+    _current = contextvars.ContextVar('raven_python_lambda.invocation.current', default=None)
+
+    def current_invocation():
+        """The invocation being run in this context, or None."""
+        return _current.get()
+
+    def activate(invocation):
+        """Makes `invocation` the current one. Returns a token for `deactivate`."""
+        return _current.set(invocation)
+
+    def deactivate(token):
+        """Restores the invocation that was current before `activate`."""
+        _current.reset(token)
+
+else:
+    _local = threading.local()
+
+    def current_invocation():
+        """The invocation being run in this thread, or None."""
+        return getattr(_local, 'invocation', None)
+
+    def activate(invocation):
+        """Makes `invocation` the current one. Returns a token for `deactivate`."""
+        token = current_invocation()
+        _local.invocation = invocation
+        return token
+
+    def deactivate(token):
+        """Restores the invocation that was current before `activate`."""
+        _local.invocation = token
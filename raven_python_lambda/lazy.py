@@ -0,0 +1,129 @@
+"""
+.. module: raven_python_lambda.lazy
+    :platform: Unix
+    :copyright: (c) 2017 by Netflix Inc., see AUTHORS for more
+    :license: Apache, see LICENSE for more details.
+
+Deferred construction of the raven client and logging handler.
+
+Importing raven (and boto3 for SQS DSNs) costs hundreds of milliseconds, which
+lands on the cold start of every function even if it never reports anything.
+The objects below stand in for the real ones and only build them once they
+are actually needed.
+"""
+import logging
+import threading
+import time
+from collections import deque
+
+# Mirrors raven.conf.EXCLUDE_LOGGER_DEFAULTS, importing it would import raven.
+EXCLUDE_LOGGER_DEFAULTS = (
+    'raven',
+    'gunicorn',
+    'south',
+    'sentry.errors',
+    'django.request',
+    'dill',
+)
+
+
+class LazyClient(object):
+    """
+    Proxy for a raven `Client` that is built by `factory` on first attribute access.
+
+    Breadcrumbs recorded before that are buffered and replayed into the client
+    once it exists, so recording them never forces the client to be built.
+    """
+    def __init__(self, factory, max_breadcrumbs=100):
+        self._factory = factory
+        self._client = None
+        self._lock = threading.Lock()
+        self._breadcrumbs = deque(maxlen=max_breadcrumbs)
+        self._setups = []
+
+    @property
+    def configured(self):
+        """True once the underlying client has been built."""
+        return self._client is not None
+
+    def get_client(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    client = self._factory()
+                    for setup in self._setups:
+                        setup(client)
+                    while self._breadcrumbs:
+                        client.captureBreadcrumb(**self._breadcrumbs.popleft())
+                    self._client = client
+        return self._client
+
+    def when_built(self, setup):
+        """
+        Calls `setup(client)` once the client is built, right away if it already is,
+        and again for every client built after a `reset`.
+        """
+        with self._lock:
+            self._setups.append(setup)
+            client = self._client
+        if client is not None:
+            setup(client)
+
+    def reset(self):
+        """Forgets the client, e.g. in a forked child, so that the next access builds a new one."""
+        self._lock = threading.Lock()
+        self._client = None
+        self._breadcrumbs.clear()
+
+    def captureBreadcrumb(self, **kwargs):
+        if self._client is None:
+            kwargs.setdefault('timestamp', time.time())
+            self._breadcrumbs.append(kwargs)
+            return
+        self._client.captureBreadcrumb(**kwargs)
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.get_client(), name)
+
+    def __bool__(self):
+        return True
+
+    __nonzero__ = __bool__
+
+
+class LazySentryHandler(logging.Handler):
+    """A logging handler that builds raven's `SentryHandler` for the first record it sees."""
+    def __init__(self, client, level=logging.NOTSET):
+        logging.Handler.__init__(self, level)
+        self.client = client
+        self._handler = None
+
+    def emit(self, record):
+        if self._handler is None:
+            from raven.handlers.logging import SentryHandler
+            client = self.client.get_client() if isinstance(self.client, LazyClient) else self.client
+            self._handler = SentryHandler(client, level=self.level)
+        self._handler.emit(record)
+
+    def reset(self):
+        self.createLock()
+        self._handler = None
+
+
+def setup_logging(handler, exclude=EXCLUDE_LOGGER_DEFAULTS):
+    """Same as `raven.conf.setup_logging`, without importing raven."""
+    logger = logging.getLogger()
+    if handler.__class__ in map(type, logger.handlers):
+        return False
+
+    logger.addHandler(handler)
+
+    # Add StreamHandler to sentry's default so you can catch missed exceptions
+    for logger_name in exclude:
+        logger = logging.getLogger(logger_name)
+        logger.propagate = False
+        logger.addHandler(logging.StreamHandler())
+
+    return True
@@ -0,0 +1,138 @@
+"""
+.. module: raven_python_lambda.memory
+    :platform: Unix
+    :copyright: (c) 2017 by Netflix Inc., see AUTHORS for more
+    :license: Apache, see LICENSE for more details.
+
+Low-overhead memory sampling for the memory watchdog.
+
+RSS is read straight from ``/proc/self/statm`` (one small read, no objects
+built), falling back to psutil where procfs isn't available. The sampling
+interval shrinks as usage approaches the warning threshold, each invocation
+records its peak, and the RSS left behind by warm invocations is tracked to
+spot leaks before the container runs out of memory.
+"""
+import os
+import threading
+from collections import deque
+
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+MIN_INTERVAL = 0.05
+MAX_INTERVAL = 2.0
+# once the warning has been sent, sampling continues only to track the peak
+WARNED_INTERVAL = 0.5
+
+MB = 1048576.0
+
+
+def _read_statm():
+    fd = os.open('/proc/self/statm', os.O_RDONLY)
+    try:
+        return int(os.read(fd, 128).split()[1]) * PAGE_SIZE
+    finally:
+        os.close(fd)
+
+
+def _read_psutil():
+    import psutil
+    return psutil.Process(os.getpid()).memory_info().rss
+
+
+_reader = None
+
+
+def read_rss():
+    """Returns the resident set size of this process in bytes."""
+    global _reader
+    if _reader is None:
+        try:
+            _read_statm()
+            _reader = _read_statm
+        except (OSError, IOError, IndexError, ValueError):
+            _reader = _read_psutil
+    return _reader()
+
+
+def next_interval(usage, threshold):
+    """
+    Seconds until the next sample: proportional to the headroom left below the
+    threshold, so sampling is rare when memory is plentiful and frequent close
+    to the limit.
+    """
+    if threshold <= 0:
+        return MIN_INTERVAL
+    headroom = max(threshold - usage, 0) / threshold
+    return min(max(MAX_INTERVAL * headroom, MIN_INTERVAL), MAX_INTERVAL)
+
+
+class MemorySampler(object):
+    """Samples RSS during one invocation, keeping the peak."""
+    def __init__(self, limit_in_mb):
+        self.limit = float(limit_in_mb) * MB
+        self.peak = 0
+        self.samples = 0
+        self.warned = False
+
+    def sample(self):
+        rss = read_rss()
+        self.samples += 1
+        if rss > self.peak:
+            self.peak = rss
+        return rss
+
+    @property
+    def peak_in_mb(self):
+        return self.peak / MB
+
+
+class MemoryTracker(object):
+    """
+    Tracks the RSS each warm invocation leaves behind. A steady upward trend that
+    would reach the memory limit within `horizon` invocations is reported as a
+    suspected leak.
+    """
+    def __init__(self, window=20):
+        self.history = deque(maxlen=window)
+        self.leak_reported = False
+        self._lock = threading.Lock()
+
+    def record(self, rss):
+        with self._lock:
+            self.history.append(rss)
+
+    def growth_per_invocation(self):
+        """Least-squares slope of the recorded RSS, in bytes per invocation."""
+        with self._lock:
+            values = list(self.history)
+        n = len(values)
+        if n < 2:
+            return 0.0
+        mean_x = (n - 1) / 2.0
+        mean_y = sum(values) / float(n)
+        covariance = sum((x - mean_x) * (y - mean_y) for x, y in enumerate(values))
+        variance = sum((x - mean_x) ** 2 for x in range(n))
+        return covariance / variance
+
+    def invocations_until_limit(self, limit):
+        """Projected number of invocations until RSS reaches `limit`, or None if it isn't growing."""
+        growth = self.growth_per_invocation()
+        if growth <= 0 or not self.history:
+            return None
+        return max(limit - self.history[-1], 0) / growth
+
+    def leak_suspected(self, limit, horizon):
+        if len(self.history) < self.history.maxlen:
+            return False
+        remaining = self.invocations_until_limit(limit)
+        return remaining is not None and remaining < horizon
+
+
+_trackers = {}
+
+
+def get_memory_tracker(window=20):
+    """Returns the process-wide tracker, which outlives individual invocations."""
+    if window not in _trackers:
+        _trackers[window] = MemoryTracker(window)
+    return _trackers[window]
@@ -0,0 +1,134 @@
+"""
+.. module: raven_python_lambda.metrics
+    :platform: Unix
+    :copyright: (c) 2017 by Netflix Inc., see AUTHORS for more
+    :license: Apache, see LICENSE for more details.
+
+What the wrapper costs, as CloudWatch metrics without any API calls.
+
+Once `enable` has been called, counters (events sent, send errors, warnings
+fired, ...) and latency samples (send and flush times) are aggregated in
+process. At the end of every invocation `emit` writes them to stdout as a
+single line in the CloudWatch Embedded Metric Format, which CloudWatch Logs
+turns into metrics, and starts over. Until then, recording is a no-op.
+"""
+import os
+import sys
+import json
+import time
+import threading
+
+COUNTERS = (
+    'EventsSent',
+    'EventsHanded',
+    'EventsSpooled',
+    'SendErrors',
+    'SendsRejected',
+    'CircuitOpened',
+    'ExceptionsCaptured',
+    'ExceptionsSuppressed',
+    'TimeoutWarnings',
+    'Timeouts',
+    'MemoryWarnings',
+    'MemoryLeakWarnings',
+    'SlowInvocations',
+)
+
+# EMF takes at most 100 values per metric and line
+MAX_SAMPLES = 100
+
+
+class Metrics(object):
+    """Counters and millisecond samples of the running invocation."""
+    def __init__(self, namespace, dimensions=None):
+        self.namespace = namespace
+        self.dimensions = dict(dimensions or {})
+        self._lock = threading.Lock()
+        self._counters = dict.fromkeys(COUNTERS, 0)
+        self._samples = {}
+
+    def increment(self, name, value=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def record(self, name, milliseconds):
+        with self._lock:
+            samples = self._samples.setdefault(name, [])
+            if len(samples) < MAX_SAMPLES:
+                samples.append(round(milliseconds, 3))
+
+    def reset(self):
+        with self._lock:
+            counters, samples = self._counters, self._samples
+            self._counters = dict.fromkeys(COUNTERS, 0)
+            self._samples = {}
+        return counters, samples
+
+    def to_emf(self, properties=None):
+        """The recorded metrics as an EMF document, resetting them."""
+        counters, samples = self.reset()
+        definitions = [{'Name': name, 'Unit': 'Count'} for name in sorted(counters)]
+        definitions.extend({'Name': name, 'Unit': 'Milliseconds'} for name in sorted(samples))
+
+        document = dict(properties or {})
+        document.update(self.dimensions)
+        document.update(counters)
+        document.update(samples)
+        document['_aws'] = {
+            'Timestamp': int(time.time() * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': self.namespace,
+                'Dimensions': [sorted(self.dimensions)],
+                'Metrics': definitions,
+            }],
+        }
+        return document
+
+
+_metrics = None
+
+
+def enable(namespace='RavenPythonLambda'):
+    """Starts aggregating metrics in this process. The first namespace wins."""
+    global _metrics
+    if _metrics is None:
+        _metrics = Metrics(namespace, {'FunctionName': os.environ.get('AWS_LAMBDA_FUNCTION_NAME', 'local')})
+    return _metrics
+
+
+def disable():
+    global _metrics
+    _metrics = None
+
+
+def reset_after_fork():
+    """A forked child starts counting from scratch, with a lock nobody holds."""
+    global _metrics
+    if _metrics is not None:
+        _metrics = Metrics(_metrics.namespace, _metrics.dimensions)
+
+
+def increment(name, value=1):
+    metrics = _metrics
+    if metrics is not None:
+        metrics.increment(name, value)
+
+
+def record(name, seconds):
+    """Records a duration given in seconds, as milliseconds."""
+    metrics = _metrics
+    if metrics is not None:
+        metrics.record(name, seconds * 1000)
+
+
+def emit(properties=None, stream=None):
+    """Writes the invocation's metrics to stdout as one compact EMF line."""
+    metrics = _metrics
+    if metrics is None:
+        return
+    line = json.dumps(metrics.to_emf(properties), separators=(',', ':'))
+    stream = stream if stream is not None else sys.stdout
+    stream.write(line + '\n')
+    flush = getattr(stream, 'flush', None)
+    if flush is not None:
+        flush()
@@ -0,0 +1,87 @@
+"""
+.. module: raven_python_lambda.registry
+    :platform: Unix
+    :copyright: (c) 2017 by Netflix Inc., see AUTHORS for more
+    :license: Apache, see LICENSE for more details.
+
+Process-wide registries, so that several wrapped handlers in one deployment
+package share a single raven client (and logging handler) per configuration
+and a single transport, with its connections, per DSN.
+"""
+import threading
+
+
+def freeze(value):
+    """Turns nested dicts, lists and sets into something hashable, for registry keys."""
+    if isinstance(value, dict):
+        return tuple(sorted((k, freeze(v)) for k, v in value.items()))
+    if isinstance(value, (set, frozenset)):
+        return tuple(sorted(freeze(v) for v in value))
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(v) for v in value)
+    try:
+        hash(value)
+    except TypeError:
+        return repr(value)
+    return value
+
+
+class Registry(object):
+    def __init__(self):
+        self._items = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def get(self, key, factory):
+        """Returns the item registered under `key`, creating it with `factory()` the first time."""
+        with self._lock:
+            if key not in self._items:
+                self._items[key] = factory()
+            return self._items[key]
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def values(self):
+        with self._lock:
+            return list(self._items.values())
+
+
+# keyed on the effective client configuration
+clients = Registry()
+# keyed on the DSN and transport class
+transports = Registry()
+# send latency estimates, keyed on the (shared) transport instance
+latencies = Registry()
+# circuit breakers, keyed on the (shared) transport instance
+breakers = Registry()
+
+
+def clear():
+    """Forgets every registered client, transport, latency estimate and circuit breaker."""
+    clients.clear()
+    transports.clear()
+    latencies.clear()
+    breakers.clear()
+
+
+def reset_after_fork():
+    """
+    Gives a forked child transports of its own and has its clients rebuilt on first
+    use. Locks are replaced, as another thread of the parent may have held them.
+    """
+    for registry in (clients, transports, latencies, breakers):
+        registry._lock = threading.Lock()
+    transports.clear()
+    latencies.clear()
+    breakers.clear()
+    for client in clients.values():
+        reset = getattr(client, 'reset', None)
+        if reset is not None:
+            reset()
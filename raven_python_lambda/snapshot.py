@@ -0,0 +1,149 @@
+"""
+.. module: raven_python_lambda.snapshot
+    :platform: Unix
+    :copyright: (c) 2017 by Netflix Inc., see AUTHORS for more
+    :license: Apache, see LICENSE for more details.
+
+Size-bounded snapshots of the invocation's event and context.
+
+Batch events (Kinesis, SQS, S3, ...) can be several megabytes. A `Snapshot`
+holds a reference to the event and does nothing until an event is captured;
+raven then calls `__sentry__`, which serializes it once within byte, depth and
+list-length budgets, redacting configured keys on the way.
+"""
+from raven_python_lambda.compat import text_type
+
+REDACTED = '[redacted]'
+
+# Attributes of the LambdaContext object worth reporting
+CONTEXT_ATTRIBUTES = (
+    'function_name',
+    'function_version',
+    'invoked_function_arn',
+    'memory_limit_in_mb',
+    'aws_request_id',
+    'log_group_name',
+    'log_stream_name',
+)
+
+
+class Snapshot(object):
+    """Serializes `value` within the given budgets the first time raven asks for it."""
+    def __init__(self, value, max_bytes=16384, max_depth=6, max_list_length=50, redact_keys=()):
+        self.value = value
+        self.max_bytes = max_bytes
+        self.max_depth = max_depth
+        self.max_list_length = max_list_length
+        self.redact_keys = frozenset(k.lower() for k in redact_keys)
+        self._result = None
+        self._materialized = False
+
+    def __sentry__(self):
+        if not self._materialized:
+            self._budget = self.max_bytes
+            self._result = self._walk(self.value, 0)
+            self._materialized = True
+        return self._result
+
+    def _charge(self, size):
+        self._budget -= size
+
+    def _walk(self, value, depth):
+        if value is None or isinstance(value, bool):
+            self._charge(5)
+            return value
+
+        if isinstance(value, (int, float)):
+            self._charge(8)
+            return value
+
+        if isinstance(value, text_type):
+            return self._walk_string(value)
+
+        if isinstance(value, (bytes, bytearray)):
+            if str is bytes and isinstance(value, str):
+                # Python 2, where str is text unless it doesn't decode
+                try:
+                    return self._walk_string(value.decode('utf-8'))
+                except UnicodeDecodeError:
+                    pass
+            self._charge(16)
+            return '<%d bytes>' % len(value)
+
+        if isinstance(value, dict):
+            if depth >= self.max_depth:
+                self._charge(24)
+                return '<dict of %d keys>' % len(value)
+            return self._walk_dict(value, depth)
+
+        if isinstance(value, (list, tuple)):
+            if depth >= self.max_depth:
+                self._charge(24)
+                return '<list of %d items>' % len(value)
+            return self._walk_list(value, depth)
+
+        # anything else is summarised by its repr, within the remaining budget
+        try:
+            text = repr(value)
+        except Exception:
+            text = '<%s>' % type(value).__name__
+        return self._walk_string(text)
+
+    def _walk_string(self, value):
+        limit = max(self._budget, 0)
+        if len(value) <= limit:
+            self._charge(len(value) + 2)
+            return value
+        self._charge(limit + 2)
+        return u'%s...<truncated %d chars>' % (value[:limit], len(value) - limit)
+
+    def _walk_dict(self, value, depth):
+        result = {}
+        for i, (key, item) in enumerate(value.items()):
+            if i >= self.max_list_length or self._budget <= 0:
+                result['...'] = '<truncated %d keys>' % (len(value) - i)
+                break
+            key = key if isinstance(key, text_type) else text_type(key)
+            self._charge(len(key) + 4)
+            if key.lower() in self.redact_keys:
+                self._charge(len(REDACTED))
+                result[key] = REDACTED
+            else:
+                result[key] = self._walk(item, depth + 1)
+        return result
+
+    def _walk_list(self, value, depth):
+        result = []
+        for i, item in enumerate(value):
+            if i >= self.max_list_length or self._budget <= 0:
+                result.append('<truncated %d items>' % (len(value) - i))
+                break
+            self._charge(2)
+            result.append(self._walk(item, depth + 1))
+        return result
+
+
+class ContextSnapshot(object):
+    """Reports the interesting attributes of a LambdaContext, only when captured."""
+    def __init__(self, context):
+        self.context = context
+
+    def __sentry__(self):
+        context = self.context
+        if isinstance(context, dict):
+            return dict(context)
+
+        result = dict((name, getattr(context, name)) for name in CONTEXT_ATTRIBUTES if hasattr(context, name))
+        if hasattr(context, 'get_remaining_time_in_millis'):
+            result['remaining_time_in_millis'] = context.get_remaining_time_in_millis()
+        return result
+
+
+def snapshot_from_config(value, config):
+    return Snapshot(
+        value,
+        max_bytes=config.get('snapshot_max_bytes', 16384),
+        max_depth=config.get('snapshot_max_depth', 6),
+        max_list_length=config.get('snapshot_max_list_length', 50),
+        redact_keys=config.get('snapshot_redact_keys', ()),
+    )
@@ -0,0 +1,268 @@
+"""
+.. module: raven_python_lambda.sources
+    :platform: Unix
+    :copyright: (c) 2017 by Netflix Inc., see AUTHORS for more
+    :license: Apache, see LICENSE for more details.
+
+Tags, user and breadcrumb data for the events of common Lambda triggers.
+
+`classify` looks at a handful of discriminating keys, once per event: the
+``eventSource`` of the first record, the ``requestContext`` shape, or the
+``detail-type`` of EventBridge (CloudWatch) events. The source's extractor then
+reads a fixed set of keys; nothing is copied or walked.
+
+Extractors return a dict with any of ``tags``, ``user`` and ``breadcrumb``
+(the data of the invocation breadcrumb). Add your own with `register`:
+
+>>> def extract_ses(event):
+>>>     mail = event['Records'][0]['ses']['mail']
+>>>     return {'tags': {'ses_source': mail['source']}}
+>>> register('aws:ses', extract_ses)
+"""
+import logging
+
+logger = logging.getLogger(__name__)
+
+EXTRACTORS = {}
+
+
+def arn_name(arn):
+    """The name at the end of an SQS queue or SNS topic ARN."""
+    # arn:aws:sqs:us-east-1:123456789012:my-queue
+    return (arn or '').rsplit(':', 1)[-1] or None
+
+
+def stream_table_name(arn):
+    """The table of a DynamoDB stream ARN."""
+    # arn:aws:dynamodb:us-east-1:123456789012:table/my-table/stream/2017-01-01T00:00:00.000
+    parts = (arn or '').split('/')
+    return parts[1] if len(parts) > 1 else None
+
+
+def register(source, extractor):
+    """
+    Registers `extractor(event)` for `source`: a record ``eventSource`` (``aws:ses``),
+    an EventBridge ``detail-type``, or one of the built-in names (``apigateway.v1``,
+    ``apigateway.v2``, ``alb``, ``cloudwatch``). Replaces any existing extractor.
+    """
+    EXTRACTORS[source] = extractor
+
+
+def classify(event):
+    """Returns the name of the event's source, or None if it isn't recognised."""
+    if not isinstance(event, dict):
+        return None
+
+    records = event.get('Records')
+    if records and isinstance(records, list) and isinstance(records[0], dict):
+        return records[0].get('eventSource') or records[0].get('EventSource')
+
+    request_context = event.get('requestContext')
+    if isinstance(request_context, dict):
+        if 'elb' in request_context:
+            return 'alb'
+        if event.get('version') == '2.0':
+            return 'apigateway.v2'
+        return 'apigateway.v1'
+
+    detail_type = event.get('detail-type')
+    if detail_type is not None:
+        return detail_type if detail_type in EXTRACTORS else 'cloudwatch'
+
+    # scheduled and CloudTrail events sent through older CloudWatch Events rules
+    if 'detail' in event:
+        return 'cloudwatch'
+    return None
+
+
+def extract(event):
+    """
+    Returns ``(source, data)`` for the event, `data` being what the source's
+    extractor found. An extractor that fails on an unexpected payload is logged
+    and ignored rather than failing the invocation.
+    """
+    source = classify(event)
+    extractor = EXTRACTORS.get(source)
+    if extractor is None:
+        return source, {}
+    try:
+        return source, extractor(event) or {}
+    except Exception:
+        logger.warning('Unable to extract Sentry context from %s event', source, exc_info=True)
+        return source, {}
+
+
+def _stream_name(arn):
+    # arn:aws:kinesis:us-east-1:123456789012:stream/my-stream
+    return (arn or '').rsplit('/', 1)[-1] or None
+
+
+def _target_group_name(arn):
+    # arn:aws:elasticloadbalancing:us-east-1:123456789012:targetgroup/my-targets/73e2d6bc24d8a067
+    parts = (arn or '').split('/')
+    return parts[1] if len(parts) > 1 else None
+
+
+def _header(headers, name):
+    """Header lookup that works for API Gateway v1 (as sent) and v2 / ALB (lower-cased) events."""
+    if not headers:
+        return None
+    return headers.get(name) or headers.get(name.lower())
+
+
+def extract_apigateway_v1(event):
+    request_context = event['requestContext']
+    data = {
+        'tags': {
+            'api_id': request_context.get('apiId'),
+            'api_stage': request_context.get('stage'),
+            'http_method': request_context.get('httpMethod') or event.get('httpMethod'),
+        },
+        'breadcrumb': {
+            'http_method': request_context.get('httpMethod') or event.get('httpMethod'),
+            'host': _header(event.get('headers'), 'Host'),
+            'path': event.get('path'),
+        },
+    }
+
+    identity = request_context.get('identity')
+    if identity:
+        data['user'] = {
+            'id': identity.get('cognitoIdentityId', None),
+            'username': identity.get('user', None),
+            'ip_address': identity.get('sourceIp', None),
+            'cognito_identity_pool_id': identity.get('cognitoIdentityPoolId', None),
+            'cognito_authentication_type': identity.get('cognitoAuthenticationType', None),
+            'user_agent': identity.get('userAgent')
+        }
+    return data
+
+
+def extract_apigateway_v2(event):
+    request_context = event['requestContext']
+    http = request_context.get('http') or {}
+    data = {
+        'tags': {
+            'api_id': request_context.get('apiId'),
+            'api_stage': request_context.get('stage'),
+            'http_method': http.get('method'),
+            'route_key': request_context.get('routeKey'),
+        },
+        'breadcrumb': {
+            'http_method': http.get('method'),
+            'host': request_context.get('domainName') or _header(event.get('headers'), 'Host'),
+            'path': event.get('rawPath') or http.get('path'),
+        },
+        'user': {
+            'ip_address': http.get('sourceIp'),
+            'user_agent': http.get('userAgent'),
+        },
+    }
+
+    authorizer = request_context.get('authorizer') or {}
+    claims = (authorizer.get('jwt') or {}).get('claims') or {}
+    iam = authorizer.get('iam') or {}
+    user_id = claims.get('sub') or iam.get('userId')
+    if user_id:
+        data['user']['id'] = user_id
+    if claims.get('email'):
+        data['user']['email'] = claims['email']
+    return data
+
+
+def extract_alb(event):
+    headers = event.get('headers') or event.get('multiValueHeaders') or {}
+    forwarded_for = _header(headers, 'X-Forwarded-For')
+    if isinstance(forwarded_for, list):
+        forwarded_for = forwarded_for[0]
+    host = _header(headers, 'Host')
+    if isinstance(host, list):
+        host = host[0]
+    data = {
+        'tags': {
+            'alb_target_group': _target_group_name(event['requestContext']['elb'].get('targetGroupArn')),
+            'http_method': event.get('httpMethod'),
+        },
+        'breadcrumb': {
+            'http_method': event.get('httpMethod'),
+            'host': host,
+            'path': event.get('path'),
+        },
+    }
+    if forwarded_for:
+        data['user'] = {'ip_address': forwarded_for.split(',')[0].strip()}
+    return data
+
+
+def extract_sqs(event):
+    record = event['Records'][0]
+    return {
+        'tags': {'sqs_queue': arn_name(record.get('eventSourceARN'))},
+        'breadcrumb': {'records': len(event['Records']), 'first_message_id': record.get('messageId')},
+    }
+
+
+def extract_sns(event):
+    sns = event['Records'][0]['Sns']
+    return {
+        'tags': {'sns_topic': arn_name(sns.get('TopicArn'))},
+        'breadcrumb': {'message_id': sns.get('MessageId'), 'subject': sns.get('Subject')},
+    }
+
+
+def extract_s3(event):
+    record = event['Records'][0]
+    s3 = record['s3']
+    return {
+        'tags': {'s3_bucket': s3['bucket'].get('name'), 's3_event_name': record.get('eventName')},
+        'breadcrumb': {'records': len(event['Records']), 'key': s3['object'].get('key')},
+    }
+
+
+def extract_kinesis(event):
+    record = event['Records'][0]
+    return {
+        'tags': {
+            'kinesis_stream': _stream_name(record.get('eventSourceARN')),
+            'kinesis_shard': (record.get('eventID') or '').split(':', 1)[0] or None,
+        },
+        'breadcrumb': {
+            'records': len(event['Records']),
+            'first_sequence_number': record['kinesis'].get('sequenceNumber'),
+        },
+    }
+
+
+def extract_dynamodb(event):
+    record = event['Records'][0]
+    return {
+        'tags': {'dynamodb_table': stream_table_name(record.get('eventSourceARN'))},
+        'breadcrumb': {
+            'records': len(event['Records']),
+            'first_sequence_number': record['dynamodb'].get('SequenceNumber'),
+        },
+    }
+
+
+def extract_cloudwatch(event):
+    detail = event.get('detail') if isinstance(event.get('detail'), dict) else {}
+    user_identity = event.get('userIdentity') or detail.get('userIdentity') or {}
+    return {
+        'tags': {
+            'cloudwatch_principal_id': user_identity.get('principalId'),
+            'cloudwatch_region': event.get('awsRegion') or event.get('region') or detail.get('awsRegion'),
+            'cloudwatch_source': event.get('source'),
+            'cloudwatch_detail_type': event.get('detail-type'),
+        },
+    }
+
+
+register('apigateway.v1', extract_apigateway_v1)
+register('apigateway.v2', extract_apigateway_v2)
+register('alb', extract_alb)
+register('aws:sqs', extract_sqs)
+register('aws:sns', extract_sns)
+register('aws:s3', extract_s3)
+register('aws:kinesis', extract_kinesis)
+register('aws:dynamodb', extract_dynamodb)
+register('cloudwatch', extract_cloudwatch)
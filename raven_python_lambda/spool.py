@@ -0,0 +1,240 @@
+"""
+.. module: raven_python_lambda.spool
+    :platform: Unix
+    :copyright: (c) 2017 by Netflix Inc., see AUTHORS for more
+    :license: Apache, see LICENSE for more details.
+
+A bounded on-disk spool for events that couldn't be delivered.
+
+Events that fail to send, or that would be sent too late to finish before the
+invocation ends, are appended to segment files under ``/tmp``, which survives
+across invocations of the same container, and even a runtime restart after a
+timeout. Segments are append-only; once the spool grows past its cap the oldest
+segment is deleted. Later invocations drain the spool in the background, oldest
+first, within a time budget.
+
+Each record is ``crc32, header length, data length`` (big-endian) followed by
+the JSON encoded url and headers and the raw event data. A record that was only
+partially written when the process died fails its checksum and ends the segment.
+"""
+import os
+import json
+import struct
+import logging
+import threading
+import zlib
+
+from raven_python_lambda.compat import monotonic
+
+logger = logging.getLogger(__name__)
+
+RECORD_HEADER = struct.Struct('>III')
+SEGMENT_SUFFIX = '.seg'
+CURSOR_FILE = 'cursor'
+
+
+def pack_record(meta, data):
+    """Frames `data` and the JSON encodable `meta` as one record."""
+    meta = json.dumps(meta).encode('utf-8')
+    if not isinstance(data, bytes):
+        data = data.encode('utf-8')
+    return RECORD_HEADER.pack(zlib.crc32(meta + data) & 0xffffffff, len(meta), len(data)) + meta + data
+
+
+def read_record(f):
+    """
+    Reads one record from the file-like `f`. Returns ``(meta, data)``, or None at
+    the end of the stream; raises ValueError for a torn or corrupt record.
+    """
+    header = f.read(RECORD_HEADER.size)
+    if not header:
+        return None
+    if len(header) < RECORD_HEADER.size:
+        raise ValueError('Truncated record header')
+    crc, meta_len, data_len = RECORD_HEADER.unpack(header)
+    body = f.read(meta_len + data_len)
+    if len(body) < meta_len + data_len or zlib.crc32(body) & 0xffffffff != crc:
+        raise ValueError('Truncated or corrupt record')
+    return json.loads(body[:meta_len].decode('utf-8')), body[meta_len:]
+
+
+def _pack(url, data, headers):
+    return pack_record({'url': url, 'headers': dict(headers or {})}, data)
+
+
+def _read_records(path, offset=0):
+    """Yields ``(end_offset, url, data, headers)`` for every complete record after `offset`."""
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        while True:
+            try:
+                record = read_record(f)
+            except ValueError:
+                logger.warning('Skipping the torn end of Sentry spool segment %s', path)
+                return
+            if record is None:
+                return
+            meta, data = record
+            yield f.tell(), meta['url'], data, meta['headers']
+
+
+class Spool(object):
+    """
+    Segment files in `directory`, holding at most `max_bytes`.
+
+    `deadline`, a `monotonic()` timestamp, is set by the wrapper for every
+    invocation: events sent after it are spooled right away instead of started.
+    """
+    def __init__(self, directory='/tmp/raven-spool', max_bytes=10 * 1024 * 1024, segment_bytes=1024 * 1024):
+        self.directory = directory
+        self.max_bytes = int(max_bytes)
+        self.segment_bytes = min(int(segment_bytes), self.max_bytes)
+        self.deadline = None
+        self.stats = dict(spooled=0, drained=0, evicted=0)
+        self._current = None
+        self._lock = threading.Lock()
+        self._drain_lock = threading.Lock()
+
+    def _segments(self):
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return []
+        return sorted(n for n in names if n.endswith(SEGMENT_SUFFIX))
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def is_empty(self):
+        return not self._segments()
+
+    def size(self):
+        """Bytes currently spooled, including records that were already drained from a segment."""
+        total = 0
+        for name in self._segments():
+            try:
+                total += os.path.getsize(self._path(name))
+            except OSError:
+                pass
+        return total
+
+    def append(self, url, data, headers):
+        """Spools one event. Returns False if it couldn't be written."""
+        record = _pack(url, data, headers)
+        if len(record) > self.segment_bytes:
+            logger.warning('Sentry event of %d bytes is too large to spool', len(record))
+            return False
+
+        with self._lock:
+            try:
+                if not os.path.isdir(self.directory):
+                    os.makedirs(self.directory)
+                segments = self._segments()
+                if (self._current is None or self._current not in segments or
+                        os.path.getsize(self._path(self._current)) + len(record) > self.segment_bytes):
+                    last = int(segments[-1][:-len(SEGMENT_SUFFIX)]) if segments else 0
+                    self._current = '%020d%s' % (last + 1, SEGMENT_SUFFIX)
+                    segments.append(self._current)
+                with open(self._path(self._current), 'ab') as f:
+                    f.write(record)
+                self.stats['spooled'] += 1
+                self._evict(segments)
+            except (OSError, IOError):
+                logger.exception('Unable to spool Sentry event')
+                return False
+        return True
+
+    def _evict(self, segments):
+        total = 0
+        sizes = []
+        for name in segments:
+            size = os.path.getsize(self._path(name))
+            sizes.append((name, size))
+            total += size
+        for name, size in sizes:
+            if total <= self.max_bytes or name == self._current:
+                break
+            logger.warning('Sentry spool is full, evicting %s', name)
+            self._remove(name)
+            self.stats['evicted'] += 1
+            total -= size
+
+    def _remove(self, name):
+        paths = [self._path(name)]
+        if self._read_cursor()[0] == name:
+            # segment numbers start over once the spool is empty, don't leave a cursor behind
+            paths.append(self._path(CURSOR_FILE))
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _read_cursor(self):
+        try:
+            with open(self._path(CURSOR_FILE)) as f:
+                name, offset = f.read().split()
+                return name, int(offset)
+        except (OSError, IOError, ValueError):
+            return None, 0
+
+    def _write_cursor(self, name, offset):
+        tmp = self._path(CURSOR_FILE + '.tmp')
+        with open(tmp, 'w') as f:
+            f.write('%s %d' % (name, offset))
+        os.rename(tmp, self._path(CURSOR_FILE))
+
+    def drain(self, send, budget):
+        """
+        Sends spooled events with `send(url, data, headers)`, oldest first, for at most
+        `budget` seconds. Stops at the first failure, leaving that event spooled.
+        Returns the number of events sent.
+        """
+        if not self._drain_lock.acquire(False):
+            return 0
+        try:
+            return self._drain(send, monotonic() + budget)
+        finally:
+            self._drain_lock.release()
+
+    def _drain(self, send, deadline):
+        sent = 0
+        with self._lock:
+            # seal the segment being written, so it can be drained and removed
+            self._current = None
+        cursor_name, cursor_offset = self._read_cursor()
+
+        for name in self._segments():
+            offset = cursor_offset if name == cursor_name else 0
+            try:
+                for end, url, data, headers in _read_records(self._path(name), offset):
+                    if monotonic() >= deadline:
+                        return sent
+                    try:
+                        send(url, data, headers)
+                    except Exception:
+                        logger.warning('Unable to send spooled Sentry event, will retry later', exc_info=True)
+                        return sent
+                    sent += 1
+                    self.stats['drained'] += 1
+                    offset = end
+                    self._write_cursor(name, offset)
+            except (OSError, IOError):
+                # evicted while we were reading it
+                continue
+            with self._lock:
+                if name != self._current:
+                    self._remove(name)
+        return sent
+
+
+_spools = {}
+_spools_lock = threading.Lock()
+
+
+def get_spool(directory='/tmp/raven-spool', max_bytes=10 * 1024 * 1024):
+    """Returns the process-wide spool for `directory`."""
+    with _spools_lock:
+        if directory not in _spools:
+            _spools[directory] = Spool(directory, max_bytes)
+        return _spools[directory]
@@ -6,23 +6,57 @@
 
 .. moduleauthor:: Mike Grima <mikegrima> @THISisPLACEHLDR
 """
-import base64
-import json
+import logging
+import threading
+import time
 
 import boto3
-from botocore.exceptions import ClientError
+from botocore.config import Config
+from botocore.exceptions import BotoCoreError, ClientError
 
 from raven.utils.compat import string_types
 from raven.conf import defaults
 from raven.transport.base import Transport
 
+from raven_python_lambda.compat import monotonic
+from raven_python_lambda.envelope import encode_v1, encode_v2, message_size
+
+logger = logging.getLogger(__name__)
+
+# SendMessageBatch limits
+MAX_BATCH_ENTRIES = 10
+MAX_BATCH_BYTES = 256 * 1024
+
+
+def static_queue_url(region, account, name):
+    """Builds the queue url SQS would return for `get_queue_url`, without asking it."""
+    domain = 'amazonaws.com.cn' if region.startswith('cn-') else 'amazonaws.com'
+    return 'https://sqs.%s.%s/%s/%s' % (region, domain, account, name)
+
+
+def client_config(timeout):
+    """
+    botocore settings for reporting from a function that is already failing: fail
+    fast rather than wait out botocore's 60 second defaults, and keep enough
+    pooled connections for the background worker and the handler's thread.
+    Connecting within a region never legitimately takes more than a second.
+    """
+    return Config(
+        connect_timeout=min(timeout, 1),
+        read_timeout=timeout,
+        retries={'max_attempts': 1},
+        max_pool_connections=4,
+    )
+
 
 class SQSTransport(Transport):
     scheme = ['sqs+https', 'sqs+http']
 
     def __init__(self, sqs_region, sqs_account, sqs_name,
                  timeout=defaults.TIMEOUT, verify_ssl=True,
-                 ca_certs=defaults.CA_BUNDLE):
+                 ca_certs=defaults.CA_BUNDLE, sqs_batch=False,
+                 sqs_batch_retries=2, sqs_batch_backoff=0.05, sqs_envelope='1', sqs_s3_bucket=None,
+                 sqs_s3_prefix='raven/', sqs_static_url=False):
         # Stuff the docs require:
         if isinstance(timeout, string_types):
             timeout = int(timeout)
@@ -37,29 +71,144 @@ class SQSTransport(Transport):
         # Stuff SQS requires:
         self.sqs_name = sqs_name
         self.sqs_account = sqs_account
-        self.sqs_client = boto3.client("sqs", region_name=sqs_region)
+        self.sqs_region = sqs_region
+        self.boto_config = client_config(self.timeout)
+        self.sqs_client = boto3.client("sqs", region_name=sqs_region, config=self.boto_config)
         self.queue_url = None
+        if isinstance(sqs_static_url, string_types):
+            sqs_static_url = sqs_static_url.lower() in ("yes", "true", "t", "1")
+        if sqs_static_url:
+            self.queue_url = static_queue_url(sqs_region, sqs_account, sqs_name)
+
+        # Envelope format, see `raven_python_lambda.envelope`:
+        self.envelope = str(sqs_envelope)
+        if self.envelope not in ('1', '2'):
+            raise ValueError('Unsupported sqs_envelope version: %s' % sqs_envelope)
+        self.s3_bucket = sqs_s3_bucket
+        self.s3_prefix = sqs_s3_prefix
+        self._s3_client = None
+
+        # Batching -- messages are buffered until `flush` is called or a batch is full:
+        if isinstance(sqs_batch, string_types):
+            sqs_batch = sqs_batch.lower() in ("yes", "true", "t", "1")
+        self.batch = sqs_batch
+        self.batch_retries = int(sqs_batch_retries)
+        self.batch_backoff = float(sqs_batch_backoff)
+        self._buffer = []
+        self._buffer_bytes = 0
+        self._lock = threading.Lock()
+        # called with the seconds each batch took and the number of its messages that went unsent
+        self.batch_listeners = []
+
+    def get_queue_url(self):
+        if not self.queue_url:
+            self.queue_url = self.sqs_client.get_queue_url(QueueName=self.sqs_name,
+                                                           QueueOwnerAWSAccountId=self.sqs_account)["QueueUrl"]
+        return self.queue_url
+
+    def warm(self):
+        """
+        Resolves the queue url ahead of the first event, i.e. during the Lambda init
+        phase. A failure is only logged: `send` will try again.
+        """
+        try:
+            self.get_queue_url()
+        except (BotoCoreError, ClientError):
+            logger.warning("Unable to resolve the url of SQS queue %s", self.sqs_name, exc_info=True)
+
+    @property
+    def s3_client(self):
+        if self._s3_client is None:
+            self._s3_client = boto3.client("s3", region_name=self.sqs_region, config=self.boto_config)
+        return self._s3_client
+
+    def build_message(self, url, data, headers):
+        """Returns the `SendMessage` arguments (minus the queue url) for one event."""
+        if self.envelope == '1':
+            return encode_v1(url, data, headers)
+        return encode_v2(url, data, headers, s3_client=self.s3_client if self.s3_bucket else None,
+                         s3_bucket=self.s3_bucket, s3_prefix=self.s3_prefix)
 
     def send(self, url, data, headers):
         """
         Sends a request to an SQS queue -- to be later popped off
         later for submission into Sentry.
+        When batching is enabled the message is buffered instead, and only sent once a
+        full batch has accumulated or `flush` is called.
         Note: This will simply raise any Boto ClientErrors that are encountered.
         """
-        if not self.queue_url:
-            self.queue_url = self.sqs_client.get_queue_url(QueueName=self.sqs_name,
-                                                           QueueOwnerAWSAccountId=self.sqs_account)["QueueUrl"]
+        message = self.build_message(url, data, headers)
 
-        payload = {
-            "url": url,
-            "headers": headers,
-            "data": base64.b64encode(data).decode("utf-8")
-        }
+        if self.batch:
+            self._buffer_message(message)
+            return
 
         try:
-            self.sqs_client.send_message(QueueUrl=self.queue_url,
-                                         MessageBody=json.dumps(payload))
-        except ClientError as e:
-            # TODO break circular dep for logging
-            print(data)  # not sure if this is the best way to get messages.
-            raise e
+            self.sqs_client.send_message(QueueUrl=self.get_queue_url(), **message)
+        except ClientError:
+            logger.debug("Unable to send message to SQS: %s", data)
+            raise
+
+    def _buffer_message(self, message):
+        size = message_size(message)
+        batch = None
+        with self._lock:
+            if self._buffer and self._buffer_bytes + size > MAX_BATCH_BYTES:
+                batch = self._take_buffer()
+            self._buffer.append(message)
+            self._buffer_bytes += size
+            if len(self._buffer) >= MAX_BATCH_ENTRIES:
+                batch = (batch or []) + self._take_buffer()
+
+        while batch:
+            chunk, batch = batch[:MAX_BATCH_ENTRIES], batch[MAX_BATCH_ENTRIES:]
+            self._send_batch(chunk)
+
+    def _take_buffer(self):
+        batch, self._buffer, self._buffer_bytes = self._buffer, [], 0
+        return batch
+
+    def flush(self, timeout=None):
+        """Sends any buffered messages. This is a no-op when batching is disabled."""
+        with self._lock:
+            batch = self._take_buffer()
+        if batch:
+            self._send_batch(batch)
+
+    def _send_batch(self, messages):
+        """
+        Sends up to 10 messages with a single `SendMessageBatch` call. Entries that fail
+        with a server-side error, and calls that fail altogether, are retried with an
+        exponential backoff; everything else is logged and dropped. This never raises:
+        a full batch is sent from `send`, i.e. from the handler's thread. How it went is
+        told to the `batch_listeners` instead, e.g. a circuit breaker: messages SQS
+        rejected as malformed don't count as unsent.
+        """
+        started = monotonic()
+        entries = dict((str(i), message) for i, message in enumerate(messages))
+        for attempt in range(self.batch_retries + 1):
+            if attempt:
+                time.sleep(self.batch_backoff * 2 ** (attempt - 1))
+            try:
+                response = self.sqs_client.send_message_batch(
+                    QueueUrl=self.get_queue_url(),
+                    Entries=[dict(message, Id=i) for i, message in sorted(entries.items())]
+                )
+            except (BotoCoreError, ClientError):
+                logger.warning("Unable to send %d messages to SQS (attempt %d)", len(entries), attempt + 1,
+                               exc_info=True)
+                continue
+            failed = response.get("Failed", [])
+            retryable = [f for f in failed if not f.get("SenderFault")]
+            for f in failed:
+                if f.get("SenderFault"):
+                    logger.error("SQS rejected message %s: %s", f["Id"], f.get("Message"))
+
+            entries = dict((f["Id"], entries[f["Id"]]) for f in retryable)
+            if not entries:
+                break
+        else:
+            logger.error("Unable to send %d messages to SQS after %d attempts", len(entries), self.batch_retries + 1)
+
+        for listener in self.batch_listeners:
+            listener(monotonic() - started, len(entries))
@@ -0,0 +1,217 @@
+"""
+.. module: raven_python_lambda.telemetry
+    :platform: Unix
+    :copyright: (c) 2017 by Netflix Inc., see AUTHORS for more
+    :license: Apache, see LICENSE for more details.
+
+Lightweight performance telemetry for every invocation.
+
+`InvocationTelemetry` records wall and CPU time, whether the invocation was a
+cold start (and how long the init phase took), garbage collections and their
+pauses, peak RSS and the time spent in the transport. It is
+attached to captured events and only turned into a dict when one is sent.
+
+Collections are counted by a single `gc.callbacks` hook, installed once per
+process (Python 3 only), that adds to the running invocation. Durations of
+warm invocations are kept in a rolling window so that an invocation slower
+than a percentile of the recent ones can be reported.
+"""
+import gc
+import os
+import math
+import threading
+from collections import deque
+
+from raven_python_lambda.compat import monotonic
+
+try:
+    from time import process_time as cpu_time
+except ImportError:  # Python 2.7
+    def cpu_time():
+        times = os.times()
+        return times[0] + times[1]
+
+try:
+    import resource
+except ImportError:  # not on Unix
+    resource = None
+
+_imported = monotonic()
+_invocations = 0
+_current = None
+
+
+def process_age():
+    """
+    Seconds since this process started, from procfs. Falls back to the time since
+    this module was imported, which misses the runtime's own startup.
+    """
+    try:
+        with open('/proc/self/stat') as f:
+            # the command name may contain spaces, the fields after it don't
+            fields = f.read().rsplit(')', 1)[1].split()
+        with open('/proc/uptime') as f:
+            uptime = float(f.read().split()[0])
+        return max(uptime - int(fields[19]) / float(os.sysconf('SC_CLK_TCK')), 0.0)
+    except (IOError, OSError, IndexError, ValueError):
+        return monotonic() - _imported
+
+
+def peak_rss():
+    """
+    The peak resident set size of the whole process in bytes, or None where getrusage
+    isn't available. It carries over warm invocations.
+    """
+    if resource is None:
+        return None
+    # kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class InvocationTelemetry(object):
+    """
+    Performance of one invocation, see `begin_invocation`. Its peak RSS is the one
+    `memory`, the invocation's `MemorySampler`, observed, or else only the process'.
+    """
+    def __init__(self, cold_start=False, init_duration=None, memory=None):
+        self.cold_start = cold_start
+        self.memory = memory
+        self.init_duration = init_duration
+        self.started = monotonic()
+        self.cpu_started = cpu_time()
+        self.wall_time = None
+        self.cpu_time = None
+        self.peak_rss = None
+        self.gc_collections = [0, 0, 0]
+        self.gc_pause = 0.0
+        self.transport_time = 0.0
+        self.transport_calls = 0
+        self._gc_started = None
+
+    def stop(self):
+        self.wall_time = monotonic() - self.started
+        self.cpu_time = cpu_time() - self.cpu_started
+        self.peak_rss = self._peak_rss()
+
+    def _peak_rss(self):
+        if self.memory is None:
+            return peak_rss()
+        self.memory.sample()
+        return self.memory.peak
+
+    @property
+    def elapsed(self):
+        """Wall time, so far if the invocation is still running."""
+        return self.wall_time if self.wall_time is not None else monotonic() - self.started
+
+    def as_dict(self):
+        cpu = self.cpu_time if self.cpu_time is not None else cpu_time() - self.cpu_started
+        rss = self.peak_rss if self.peak_rss is not None else self._peak_rss()
+        result = {
+            'ColdStart': self.cold_start,
+            'WallTimeInMsec': round(self.elapsed * 1000, 3),
+            'CPUTimeInMsec': round(cpu * 1000, 3),
+            'GCCollections': dict(('gen%d' % i, n) for i, n in enumerate(self.gc_collections)),
+            'GCPauseInMsec': round(self.gc_pause * 1000, 3),
+            'TransportTimeInMsec': round(self.transport_time * 1000, 3),
+            'TransportCalls': self.transport_calls,
+        }
+        if self.init_duration is not None:
+            result['InitDurationInMsec'] = round(self.init_duration * 1000, 3)
+        if rss is not None:
+            # without a sampler, only the high-water mark of the whole process is known
+            key = 'PeakRSSInMB' if self.memory is not None else 'ProcessPeakRSSInMB'
+            result[key] = round(rss / 1048576.0, 1)
+        return result
+
+    __sentry__ = as_dict
+
+
+def begin_invocation(memory=None):
+    """
+    Starts the telemetry of an invocation, the first one in this process being the
+    cold start. `memory` is the invocation's `MemorySampler`, if it has one.
+    """
+    global _invocations, _current
+    cold_start = _invocations == 0
+    _invocations += 1
+    _current = InvocationTelemetry(cold_start, process_age() if cold_start else None, memory)
+    return _current
+
+
+def end_invocation(telemetry):
+    global _current
+    telemetry.stop()
+    if _current is telemetry:
+        _current = None
+
+
+def reset_after_fork():
+    """A forked child isn't running the parent's invocation."""
+    global _current
+    _current = None
+
+
+def record_transport_time(elapsed):
+    """Adds time spent sending or flushing events to the running invocation."""
+    current = _current
+    if current is not None:
+        current.transport_time += elapsed
+        current.transport_calls += 1
+
+
+def _gc_callback(phase, info):
+    current = _current
+    if current is None:
+        return
+    if phase == 'start':
+        current._gc_started = monotonic()
+    elif current._gc_started is not None:
+        current.gc_pause += monotonic() - current._gc_started
+        current._gc_started = None
+        generation = info.get('generation', 0)
+        if 0 <= generation < len(current.gc_collections):
+            current.gc_collections[generation] += 1
+
+
+def install_gc_callback():
+    """Hooks `gc.callbacks` once per process. Returns False where it doesn't exist."""
+    callbacks = getattr(gc, 'callbacks', None)
+    if callbacks is None:
+        return False
+    if _gc_callback not in callbacks:
+        callbacks.append(_gc_callback)
+    return True
+
+
+class DurationTracker(object):
+    """The wall time of the last `window` warm invocations."""
+    # percentiles of fewer invocations than this say nothing
+    MIN_SAMPLES = 20
+
+    def __init__(self, window=100):
+        self.history = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, duration):
+        with self._lock:
+            self.history.append(duration)
+
+    def percentile(self, p):
+        """Nearest-rank `p`th percentile of the recorded durations, or None with too few of them."""
+        with self._lock:
+            values = sorted(self.history)
+        if len(values) < self.MIN_SAMPLES:
+            return None
+        rank = int(math.ceil(p / 100.0 * len(values)))
+        return values[min(max(rank, 1), len(values)) - 1]
+
+
+_trackers = {}
+
+
+def get_duration_tracker(window=100):
+    """Returns the process-wide tracker, which outlives individual invocations."""
+    if window not in _trackers:
+        _trackers[window] = DurationTracker(window)
+    return _trackers[window]
@@ -0,0 +1,135 @@
+"""
+.. module: raven_python_lambda.tests.test_background
+    :platform: Unix
+    :copyright: (c) 2017 by Netflix Inc., see AUTHORS for more
+    :license: Apache, see LICENSE for more details.
+"""
+import threading
+import time
+
+import pytest
+
+from raven.transport.base import Transport
+
+from raven_python_lambda import RavenLambdaWrapper
+from raven_python_lambda.background import BackgroundTransport
+from raven_python_lambda.tests.conftest import FakeContext
+from raven_python_lambda.transports import get_transport
+
+
+class SlowTransport(Transport):
+    def __init__(self, delay=0.0, fail=False):
+        self.delay = delay
+        self.fail = fail
+        self.sent = []
+        self.flushes = 0
+        self.release = threading.Event()
+        self.release.set()
+
+    def send(self, url, data, headers):
+        self.release.wait()
+        time.sleep(self.delay)
+        if self.fail:
+            raise ValueError('boom')
+        self.sent.append(data)
+
+    def flush(self, timeout=None):
+        self.flushes += 1
+
+
+def _send(transport, data, results=None):
+    results = results if results is not None else []
+    transport.async_send('http://localhost', data, {},
+                         lambda: results.append('ok'), lambda e: results.append(e))
+    return results
+
+
+def test_send_does_not_block_and_flush_delivers():
+    inner = SlowTransport(delay=0.05)
+    transport = BackgroundTransport(inner)
+
+    started = time.time()
+    for i in range(5):
+        _send(transport, i)
+    assert time.time() - started < 0.05
+
+    assert transport.flush(timeout=5)
+    assert inner.sent == [0, 1, 2, 3, 4]
+    assert inner.flushes == 1
+    assert transport.stats['sent'] == 5
+    assert transport.pending == 0
+
+
+def test_flush_is_bounded_and_counts_late_events():
+    inner = SlowTransport()
+    inner.release.clear()
+    transport = BackgroundTransport(inner)
+
+    for i in range(3):
+        _send(transport, i)
+
+    started = time.time()
+    assert not transport.flush(timeout=0.1)
+    assert time.time() - started < 0.5
+    assert transport.stats['late'] == 3
+
+    # late events are still delivered once the transport catches up
+    inner.release.set()
+    assert transport.flush(timeout=5)
+    assert inner.sent == [0, 1, 2]
+
+
+def test_take_pending_removes_queued_events():
+    inner = SlowTransport()
+    inner.release.clear()
+    transport = BackgroundTransport(inner)
+
+    for i in range(3):
+        _send(transport, i)
+    assert not transport.flush(timeout=0.1)
+
+    # the first event is already in the worker's hands
+    assert transport.take_pending() == [('http://localhost', 1, {}), ('http://localhost', 2, {})]
+    inner.release.set()
+    assert transport.flush(timeout=5)
+    assert inner.sent == [0]
+
+
+def test_full_queue_drops_events():
+    inner = SlowTransport()
+    inner.release.clear()
+    transport = BackgroundTransport(inner, queue_size=2)
+
+    for i in range(5):
+        _send(transport, i)
+
+    assert transport.stats['dropped'] >= 2
+    inner.release.set()
+    assert transport.flush(timeout=5)
+    assert len(inner.sent) + transport.stats['dropped'] == 5
+
+
+def test_failures_are_reported_to_the_client():
+    transport = BackgroundTransport(SlowTransport(fail=True))
+    results = _send(transport, 1)
+
+    assert transport.flush(timeout=5)
+    assert isinstance(results[0], ValueError)
+    assert transport.stats['failed'] == 1
+
+
+def test_wrapper_flushes_background_queue(sqs, sqs_queue):
+    wrapper = RavenLambdaWrapper(dict(logging=False, background_send=True))
+    transport = get_transport(wrapper.config['raven_client'])
+    assert isinstance(transport, BackgroundTransport)
+
+    @wrapper
+    def test_func(event, context):
+        raise Exception('There was an error.')
+
+    with pytest.raises(Exception):
+        test_func({}, FakeContext())
+
+    assert transport.pending == 0
+    assert transport.stats['sent'] == 1
+    assert len(sqs.receive_message(QueueUrl=sqs_queue)["Messages"]) == 1
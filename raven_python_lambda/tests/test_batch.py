@@ -0,0 +1,169 @@
+"""
+.. module: raven_python_lambda.tests.test_batch
+    :platform: Unix
+    :copyright: (c) 2017 by Netflix Inc., see AUTHORS for more
+    :license: Apache, see LICENSE for more details.
+"""
+import threading
+import time
+
+import pytest
+
+from raven_python_lambda.batch import (WHOLE_BATCH_FAILED, UnsupportedBatch, process_batch, record_identifier,
+                                       record_tags)
+from raven_python_lambda.tests.conftest import FakeContext
+
+QUEUE_ARN = 'arn:aws:sqs:us-east-1:123456789012:my-queue'
+
+
+def sqs_record(i, arn=QUEUE_ARN):
+    return {'eventSource': 'aws:sqs', 'eventSourceARN': arn, 'messageId': 'message-%d' % i, 'body': str(i)}
+
+
+def kinesis_record(i):
+    return {
+        'eventSource': 'aws:kinesis',
+        'eventID': 'shardId-000000000001:%d' % i,
+        'kinesis': {'sequenceNumber': str(i), 'partitionKey': 'key', 'data': ''},
+    }
+
+
+def dynamodb_record(i):
+    return {
+        'eventSource': 'aws:dynamodb',
+        'eventName': 'INSERT',
+        'eventSourceARN': 'arn:aws:dynamodb:us-east-1:123456789012:table/my-table/stream/2017-01-01T00:00:00.000',
+        'dynamodb': {'SequenceNumber': str(i)},
+    }
+
+
+def _fail_on(*values):
+    processed = []
+
+    def handler(record, context):
+        processed.append(record)
+        if record_identifier(record).rsplit('-', 1)[-1] in values:
+            raise ValueError('bad record')
+    handler.processed = processed
+    return handler
+
+
+def test_record_tags():
+    assert record_tags(sqs_record(1)) == {'sqs_message_id': 'message-1', 'sqs_queue': 'my-queue'}
+    assert record_tags(kinesis_record(7)) == {
+        'kinesis_shard': 'shardId-000000000001', 'kinesis_sequence_number': '7', 'kinesis_partition_key': 'key'}
+    assert record_tags(dynamodb_record(3)) == {
+        'dynamodb_table': 'my-table', 'dynamodb_event_name': 'INSERT', 'dynamodb_sequence_number': '3'}
+    assert record_tags({'eventSource': 'aws:s3'}) == {}
+
+
+def test_sqs_failures_are_isolated(wrapper_factory, sent_events):
+    wrapper = wrapper_factory()
+    handler = _fail_on('1')
+
+    response = wrapper.records(handler)({'Records': [sqs_record(i) for i in range(3)]}, FakeContext())
+
+    assert response == {'batchItemFailures': [{'itemIdentifier': 'message-1'}]}
+    assert len(handler.processed) == 3
+    assert len(sent_events) == 1
+    assert sent_events[0]['tags']['sqs_message_id'] == 'message-1'
+    assert sent_events[0]['tags']['sqs_queue'] == 'my-queue'
+    assert sent_events[0]['extra']['record']["'messageId'"] == "'message-1'"
+
+
+def test_sqs_records_can_be_processed_concurrently(wrapper_factory, sent_events):
+    wrapper = wrapper_factory(batch_concurrency=4)
+    threads = set()
+
+    @wrapper.records
+    def handler(record, context):
+        threads.add(threading.current_thread().ident)
+        time.sleep(0.01)
+        if int(record['body']) % 5 == 0:
+            raise ValueError('bad record')
+
+    started = time.time()
+    response = handler({'Records': [sqs_record(i) for i in range(20)]}, FakeContext())
+
+    assert time.time() - started < 0.15
+    assert len(threads) > 1
+    assert response['batchItemFailures'] == [{'itemIdentifier': 'message-%d' % i} for i in (0, 5, 10, 15)]
+    assert len(sent_events) == 4
+
+
+def test_ordered_sources_stop_at_the_first_failure(wrapper_factory, sent_events):
+    wrapper = wrapper_factory(batch_concurrency=4)
+    handler = _fail_on('2')
+
+    response = wrapper.records(handler)({'Records': [kinesis_record(i) for i in range(5)]}, FakeContext())
+
+    assert response == {'batchItemFailures': [{'itemIdentifier': str(i)} for i in (2, 3, 4)]}
+    assert len(handler.processed) == 3
+    assert len(sent_events) == 1
+    assert sent_events[0]['tags']['kinesis_shard'] == 'shardId-000000000001'
+
+
+def test_fifo_queues_are_ordered():
+    arn = QUEUE_ARN + '.fifo'
+    handler = _fail_on('0')
+    response = process_batch({'Records': [sqs_record(i, arn) for i in range(3)]}, None, handler, lambda r: None, 4)
+    assert len(response['batchItemFailures']) == 3
+    assert len(handler.processed) == 1
+
+
+def test_unsupported_sources():
+    with pytest.raises(UnsupportedBatch):
+        process_batch({'Records': [{'eventSource': 'aws:s3'}]}, None, lambda r, c: None, lambda r: None)
+
+
+def test_failures_are_reported_when_sentry_is_disabled(wrapper_factory, sent_events):
+    wrapper = wrapper_factory(enabled=False)
+    response = wrapper.records(_fail_on('0'))({'Records': [dynamodb_record(0)]}, FakeContext())
+
+    assert response == {'batchItemFailures': [{'itemIdentifier': '0'}]}
+    assert sent_events == []
+
+
+def test_records_without_an_identifier_fail_the_whole_batch():
+    records = [sqs_record(0), {'eventSource': 'aws:sqs', 'body': '1'}, sqs_record(2)]
+
+    def fail_on(*bodies):
+        def handler(record, context):
+            if record['body'] in bodies:
+                raise ValueError('bad record')
+        return handler
+
+    response = process_batch({'Records': records}, None, fail_on('1', '2'), lambda r: None)
+    assert response == WHOLE_BATCH_FAILED
+
+    # as long as they don't fail, they don't matter
+    response = process_batch({'Records': records}, None, fail_on('2'), lambda r: None)
+    assert response == {'batchItemFailures': [{'itemIdentifier': 'message-2'}]}
+
+
+def test_concurrent_invocations_keep_their_own_context(wrapper_factory, sent_events):
+    wrapper = wrapper_factory(batch_concurrency=2)
+    second_started = threading.Event()
+
+    @wrapper.records
+    def handler(record, context):
+        if record['body'] == 'first':
+            # fail once the second invocation has started
+            second_started.wait(1)
+        else:
+            second_started.set()
+        raise ValueError(record['body'])
+
+    def invoke(body):
+        record = dict(sqs_record(0), body=body)
+        handler({'Records': [record, record], 'invocation': body}, FakeContext())
+
+    first = threading.Thread(target=invoke, args=('first',))
+    first.start()
+    invoke('second')
+    first.join()
+
+    assert len(sent_events) == 4
+    for data in sent_events:
+        body = data['exception']['values'][-1]['value']
+        assert data['extra']['event']["'invocation'"] == "'%s'" % body
@@ -0,0 +1,29 @@
+"""
+.. module: raven_python_lambda.tests.test_benchmarks
+    :platform: Unix
+    :copyright: (c) 2017 by Netflix Inc., see AUTHORS for more
+    :license: Apache, see LICENSE for more details.
+"""
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def test_benchmark_suite_runs_and_reports_json(tmpdir):
+    output = str(tmpdir.join('results.json'))
+    subprocess.check_call([sys.executable, os.path.join(ROOT, 'benchmarks', 'run.py'), '--quick', '--output', output])
+
+    with open(output) as f:
+        report = json.load(f)
+
+    names = set(r['name'] for r in report['results'])
+    assert set(['wrapper.overhead.enabled', 'wrapper.overhead.disabled', 'context.api_gateway',
+                'capture_exception.small', 'capture_exception.locals_100mb.budgeted', 'envelope.records_50.v2',
+                'transport.sqs',
+                'forwarder.concurrency_16']) <= names
+    for result in report['results']:
+        assert result['unit'] in ('us', 'events/s', 'bytes')
+        assert result.get('p50', result.get('value')) > 0
@@ -0,0 +1,106 @@
+"""
+.. module: raven_python_lambda.tests.test_breadcrumbs
+    :platform: Unix
+    :copyright: (c) 2017 by Netflix Inc., see AUTHORS for more
+    :license: Apache, see LICENSE for more details.
+"""
+import logging
+
+import pytest
+
+from raven_python_lambda import breadcrumbs
+from raven_python_lambda.breadcrumbs import LogRingBuffer
+from raven_python_lambda.tests.conftest import FakeContext
+
+log = logging.getLogger('raven_python_lambda.tests.app')
+
+
+@pytest.fixture(autouse=True)
+def fresh_log_buffer():
+    yield
+    if breadcrumbs._handler is not None:
+        logging.getLogger().removeHandler(breadcrumbs._handler)
+        breadcrumbs._handler = None
+
+
+class CountingArg(object):
+    formatted = 0
+
+    def __str__(self):
+        CountingArg.formatted += 1
+        return 'arg'
+
+
+def _record(message, *args):
+    return logging.LogRecord('app', logging.INFO, __file__, 1, message, args, None)
+
+
+def test_ring_buffer_keeps_the_last_records_in_order():
+    ring = LogRingBuffer(size=3)
+    for i in range(5):
+        ring.append(_record('message %d', i))
+
+    assert len(ring) == 3
+    assert [b['message'] for b in ring.breadcrumbs()] == ['message 2', 'message 3', 'message 4']
+
+    ring.clear()
+    assert len(ring) == 0
+    assert ring.breadcrumbs() == []
+    assert ring._slots == [None] * 3
+
+
+def test_records_are_formatted_only_when_needed():
+    ring = LogRingBuffer()
+    CountingArg.formatted = 0
+    ring.append(_record('value: %s', CountingArg()))
+    assert CountingArg.formatted == 0
+
+    assert ring.breadcrumbs()[0]['message'] == 'value: arg'
+    assert CountingArg.formatted == 1
+
+
+def test_log_records_are_attached_to_failed_invocations(monkeypatch, wrapper_factory, sent_events):
+    monkeypatch.setattr(log, 'level', logging.DEBUG)
+    wrapper = wrapper_factory(log_breadcrumbs=True, log_breadcrumbs_level=logging.INFO)
+
+    @wrapper
+    def handler(event, context):
+        log.debug('too verbose')
+        log.info('processing %s', event['id'])
+        if event.get('fail'):
+            raise ValueError('boom')
+
+    handler({'id': 'ok'}, FakeContext())
+    assert sent_events == []
+    assert len(wrapper.log_buffer) == 0
+
+    with pytest.raises(ValueError):
+        handler({'id': 'bad', 'fail': True}, FakeContext())
+
+    assert len(sent_events) == 1
+    crumbs = [c for c in sent_events[0]['breadcrumbs']['values'] if c['category'] == log.name]
+    # only this invocation's records at or above the level, each once
+    assert [c['message'] for c in crumbs] == ['processing bad']
+    assert crumbs[0]['level'] == 'info'
+    assert len(wrapper.log_buffer) == 0
+
+
+def test_log_records_do_not_leak_into_later_invocations(wrapper_factory, sent_events):
+    wrapper = wrapper_factory(log_breadcrumbs=True, log_breadcrumbs_level=logging.INFO)
+
+    @wrapper
+    def handler(event, context):
+        if event.get('log'):
+            log.info('first invocation')
+        raise ValueError('boom')
+
+    for event in ({'log': True}, {}):
+        with pytest.raises(ValueError):
+            handler(event, FakeContext())
+
+    assert len(sent_events) == 2
+    assert [c['message'] for c in sent_events[0]['breadcrumbs']['values'] if c['category'] == log.name] == \
+        ['first invocation']
+    assert [c for c in sent_events[1]['breadcrumbs']['values'] if c['category'] == log.name] == []
+    client = wrapper.config['raven_client']
+    assert [c for c in client.context.breadcrumbs.get_buffer() if c['category'] == log.name] == []
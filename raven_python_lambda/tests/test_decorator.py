@@ -5,6 +5,9 @@ import os
 import pytest
 
 from raven_python_lambda import RavenLambdaWrapper
+from raven_python_lambda.tests.conftest import FakeContext
+from raven_python_lambda.transports import get_transport
+from raven_python_lambda.watchdog import get_watchdog
 
 
 def test_raven_lambda_wrapper():
@@ -22,20 +25,33 @@ def test_can_override_configuration():
     assert r.config['logging'] is False, 'expected the config option to be overridden'
 
 
-class FakeContext(object):
-    def get_remaining_time_in_millis(self):
-        return 300000
-
-
 def test_only_has_one_running_thread_after_execution_finishes():
     @RavenLambdaWrapper()
     def f(event, context):
         pass
 
+    get_watchdog().schedule(0, lambda: None)  # make sure the watchdog is already running
+    before = threading.active_count()
     f({}, FakeContext())
 
     sleep(0.1)  # A bit iffy. But if we don't wait a bit the threads will not have stopped
-    assert threading.active_count() == 1, 'expected all scheduled threads to have been removed'
+    assert threading.active_count() == before, 'expected all scheduled threads to have been removed'
+    assert len(get_watchdog()) == 0, 'expected all scheduled deadlines to have been removed'
+
+
+def test_thread_count_stays_flat_across_invocations():
+    @RavenLambdaWrapper(dict(logging=False, auto_bread_crumbs=False))
+    def f(event, context):
+        pass
+
+    f({}, FakeContext())
+    baseline = threading.active_count()
+
+    for _ in range(10000):
+        f({}, FakeContext())
+
+    assert threading.active_count() == baseline
+    assert len(get_watchdog()) == 0
 
 
 def test_that_sqs_transport_is_used(sqs, sqs_queue):
@@ -75,3 +91,26 @@ def test_that_remote_environment_is_not_ignored(monkeypatch):
     wrapper = RavenLambdaWrapper()
     assert wrapper.config['enabled']
     assert wrapper.config['raven_client']
+
+
+def test_batched_sqs_messages_are_flushed_before_returning(sqs, sqs_queue, monkeypatch):
+    monkeypatch.setenv("SENTRY_DSN", os.environ["SENTRY_DSN"] + "&sqs_batch=1")
+
+    @RavenLambdaWrapper(dict(logging=False))
+    def test_func(event, context):
+        raise Exception('There was an error.')
+
+    with pytest.raises(Exception):
+        test_func({}, FakeContext())
+
+    messages = sqs.receive_message(QueueUrl=sqs_queue)["Messages"]
+    assert len(messages) == 1
+
+
+def test_eager_init_resolves_queue_url(sqs_queue, monkeypatch):
+    monkeypatch.setenv('SENTRY_EAGER_INIT', 'true')
+    wrapper = RavenLambdaWrapper()
+
+    client = wrapper.config['raven_client']
+    assert client.configured
+    assert get_transport(client.get_client()).queue_url == sqs_queue
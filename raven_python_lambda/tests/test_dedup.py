@@ -0,0 +1,77 @@
+"""
+.. module: raven_python_lambda.tests.test_dedup
+    :platform: Unix
+    :copyright: (c) 2017 by Netflix Inc., see AUTHORS for more
+    :license: Apache, see LICENSE for more details.
+"""
+import sys
+
+import pytest
+
+from raven_python_lambda.dedup import ErrorRateLimiter, fingerprint, message_template
+from raven_python_lambda.tests.conftest import FakeContext
+
+
+def _exc_info(message, exc_type=ValueError):
+    try:
+        raise exc_type(message)
+    except exc_type:
+        return sys.exc_info()
+
+
+def test_message_template():
+    assert message_template("Item 'abc' not found in table 42 (request 1b4e28ba-2fa1-11d2-883f-0016d3cca427)") == \
+        "Item <str> not found in table <num> (request <uuid>)"
+
+
+def test_fingerprint_ignores_variable_message_parts():
+    assert fingerprint(_exc_info('user 1 failed')) == fingerprint(_exc_info('user 2 failed'))
+    assert fingerprint(_exc_info('user 1 failed')) != fingerprint(_exc_info('user 1 failed', KeyError))
+
+
+def test_repeats_are_suppressed_within_the_window():
+    limiter = ErrorRateLimiter(window=60, burst=2)
+
+    results = [limiter.check(_exc_info('boom %d' % i), now=i) for i in range(5)]
+    assert results == [(True, 0), (True, 0), (False, 0), (False, 0), (False, 0)]
+
+    # one token has refilled after half a window, and carries the suppressed count
+    assert limiter.check(_exc_info('boom 5'), now=35) == (True, 3)
+
+
+def test_suppressed_repeats_are_summarised_after_the_window():
+    limiter = ErrorRateLimiter(window=60, burst=1)
+    limiter.check(_exc_info('boom'), now=0)
+    limiter.check(_exc_info('boom'), now=1)
+    limiter.check(_exc_info('boom'), now=2)
+
+    assert limiter.expired_summaries(now=30) == []
+    (key, suppressed), = limiter.expired_summaries(now=61)
+    assert suppressed == 2
+    assert key[:2] == ('ValueError', 'boom')
+    assert limiter.expired_summaries(now=62) == []
+
+
+def test_cache_evicts_least_recently_used_fingerprints():
+    limiter = ErrorRateLimiter(max_fingerprints=2)
+    limiter.check(_exc_info('a'), now=0)
+    limiter.check(_exc_info('b', KeyError), now=0)
+    limiter.check(_exc_info('c', TypeError), now=0)
+
+    assert len(limiter) == 2
+    # 'a' was evicted, so it is sent again straight away
+    assert limiter.check(_exc_info('a'), now=1) == (True, 0)
+
+
+def test_wrapper_only_sends_first_repeat(wrapper_factory, sent_events):
+    wrapper = wrapper_factory(dedup=True, dedup_window=3600, dedup_cache_size=16)
+
+    @wrapper
+    def handler(event, context):
+        raise ValueError('downstream returned %d' % event['status'])
+
+    for status in range(500, 510):
+        with pytest.raises(ValueError):
+            handler({'status': status}, FakeContext())
+
+    assert len(sent_events) == 1
@@ -0,0 +1,160 @@
+"""
+.. module: raven_python_lambda.tests.test_forwarder
+    :platform: Unix
+    :copyright: (c) 2017 by Netflix Inc., see AUTHORS for more
+    :license: Apache, see LICENSE for more details.
+"""
+import json
+import time
+import zlib
+
+import pytest
+from raven.base import Client
+
+from raven_python_lambda import forwarder
+from raven_python_lambda.envelope import encode_v1, encode_v2
+from raven_python_lambda.forwarder import Forwarder
+from raven_python_lambda.http_transport import KeepAliveHTTPTransport
+from raven_python_lambda.tests.conftest import FakeContext
+from raven_python_lambda.tests.test_http_transport import stub_server  # noqa: F401
+
+HEADERS = {'X-Sentry-Auth': 'Sentry sentry_key=public', 'Content-Encoding': 'deflate'}
+
+
+def _enqueue(sqs, queue_url, url, count, encode=encode_v1):
+    data = Client().encode({'message': 'hello'})
+    for i in range(0, count, 10):
+        sqs.send_message_batch(QueueUrl=queue_url, Entries=[
+            dict(encode(url, data, HEADERS), Id=str(n)) for n in range(min(10, count - i))
+        ])
+
+
+def _visible(sqs, queue_url):
+    attributes = sqs.get_queue_attributes(QueueUrl=queue_url, AttributeNames=['All'])['Attributes']
+    return int(attributes['ApproximateNumberOfMessages'])
+
+
+def _forwarder(sqs, queue_url, **kwargs):
+    kwargs.setdefault('wait_time', 0)
+    kwargs.setdefault('backoff', 0.01)
+    return Forwarder(sqs, queue_url, transport=KeepAliveHTTPTransport(pool_size=4), **kwargs)
+
+
+def test_drains_the_queue(sqs, sqs_queue, stub_server):
+    _enqueue(sqs, sqs_queue, stub_server.url, 15)
+    _enqueue(sqs, sqs_queue, stub_server.url, 10, encode=encode_v2)
+    fwd = _forwarder(sqs, sqs_queue, concurrency=4)
+
+    fwd.run(until_empty=True)
+
+    assert fwd.stats['received'] == 25
+    assert fwd.stats['forwarded'] == 25
+    assert fwd.stats['deleted'] == 25
+    assert _visible(sqs, sqs_queue) == 0
+    assert len(stub_server.requests) == 25
+    # compact envelopes of tiny events travel inflated, legacy ones as sent
+    events = [json.loads(zlib.decompress(r) if r[:1] != b'{' else r) for r in stub_server.requests]
+    assert all(event['message'] == 'hello' for event in events)
+    # pooled connections, not one per event
+    assert stub_server.connections <= 4
+
+
+class StopForwarding(BaseException):
+    pass
+
+
+def test_messages_are_deleted_while_running(sqs, sqs_queue, stub_server):
+    _enqueue(sqs, sqs_queue, stub_server.url, 3)
+    fwd = _forwarder(sqs, sqs_queue)
+    receive = fwd.receive
+    deleted_while_running = []
+
+    def receive_until_deleted(wait_time):
+        deleted_while_running.append(fwd.stats['deleted'])
+        if fwd.stats['deleted'] == 3 or len(deleted_while_running) > 100:
+            raise StopForwarding()
+        time.sleep(.01)
+        return receive(wait_time)
+    fwd.receive = receive_until_deleted
+
+    # the long-running mode, which only returns on errors
+    with pytest.raises(StopForwarding):
+        fwd.run()
+    assert deleted_while_running[-1] == 3
+
+
+def test_backs_off_when_rate_limited(sqs, sqs_queue, stub_server):
+    _enqueue(sqs, sqs_queue, stub_server.url, 3)
+    stub_server.responses = [(429, {'Retry-After': '1'})]
+    fwd = _forwarder(sqs, sqs_queue, concurrency=1)
+
+    fwd.run(until_empty=True)
+
+    assert fwd.stats['rate_limited'] == 1
+    assert fwd.stats['forwarded'] == 3
+    assert fwd.stats['deleted'] == 3
+    assert fwd._paused_until > 0
+
+
+def test_rejected_events_are_deleted(sqs, sqs_queue, stub_server):
+    _enqueue(sqs, sqs_queue, stub_server.url, 1)
+    sqs.send_message(QueueUrl=sqs_queue, MessageBody='not an envelope')
+    stub_server.responses = [(400, {'X-Sentry-Error': 'invalid event'})]
+    fwd = _forwarder(sqs, sqs_queue)
+
+    fwd.run(until_empty=True)
+
+    assert fwd.stats['rejected'] == 2
+    assert fwd.stats['deleted'] == 2
+    assert _visible(sqs, sqs_queue) == 0
+
+
+def test_failed_events_stay_on_the_queue(sqs, sqs_queue, stub_server):
+    _enqueue(sqs, sqs_queue, stub_server.url, 1)
+    stub_server.responses = [(503, {})] * 3
+    fwd = _forwarder(sqs, sqs_queue, retries=2)
+
+    fwd.run(until_empty=True)
+
+    assert fwd.stats['retried'] == 2
+    assert fwd.stats['failed'] == 1
+    assert fwd.stats['deleted'] == 0
+    attributes = sqs.get_queue_attributes(QueueUrl=sqs_queue, AttributeNames=['All'])['Attributes']
+    assert int(attributes['ApproximateNumberOfMessagesNotVisible']) == 1
+
+
+def test_lambda_sqs_event(monkeypatch, sqs, stub_server):
+    data = Client().encode({'message': 'hello'})
+
+    def record(n):
+        message = encode_v2(stub_server.url, data, HEADERS)
+        return {
+            'messageId': str(n),
+            'body': message['MessageBody'],
+            'messageAttributes': dict((name, {'stringValue': a['StringValue'], 'dataType': a['DataType']})
+                                      for name, a in message['MessageAttributes'].items()),
+            'eventSource': 'aws:sqs',
+            'eventSourceARN': 'arn:aws:sqs:us-east-1:123456789012:sentry-queue',
+        }
+
+    stub_server.responses = [(200, {}), (503, {}), (503, {})]
+    monkeypatch.setattr(forwarder, '_forwarder', _forwarder(sqs, None, retries=1, concurrency=1))
+
+    response = forwarder.handler({'Records': [record(0), record(1)]}, FakeContext(30000))
+
+    assert response == {'batchItemFailures': [{'itemIdentifier': '1'}]}
+    assert len(stub_server.requests) == 3
+
+
+def test_scheduled_invocation_drains_the_queue(monkeypatch, sqs, sqs_queue, stub_server):
+    _enqueue(sqs, sqs_queue, stub_server.url, 12)
+    monkeypatch.setattr(forwarder, '_forwarder', _forwarder(sqs, sqs_queue))
+
+    stats = forwarder.handler({}, FakeContext(30000))
+
+    assert stats['forwarded'] == 12
+    assert _visible(sqs, sqs_queue) == 0
+
+
+def test_region_from_queue_url():
+    assert forwarder._region('https://sqs.eu-west-1.amazonaws.com/123456789012/sentry-queue') == 'eu-west-1'
@@ -0,0 +1,144 @@
+"""
+.. module: raven_python_lambda.tests.test_frames
+    :platform: Unix
+    :copyright: (c) 2017 by Netflix Inc., see AUTHORS for more
+    :license: Apache, see LICENSE for more details.
+"""
+import pytest
+from raven.base import Client
+
+from raven_python_lambda.frames import LocalsBudget, install_locals_budget
+from raven_python_lambda.tests.conftest import DSN, FakeContext, stub_send
+
+
+class Frame(object):
+    """Stands in for a dataframe, whose repr would be expensive."""
+    shape = (1000000, 20)
+
+    def __repr__(self):
+        raise AssertionError('skipped types must not be repr\'d')
+
+
+def _client(**options):
+    client = Client(dsn=DSN)
+    install_locals_budget(client, **options)
+    sent = []
+    stub_send(client, sent)
+    return client, sent
+
+
+def _frames(data, exception=-1):
+    return data['exception']['values'][exception]['stacktrace']['frames']
+
+
+def _vars(data, function, exception=-1):
+    return next(f.get('vars') for f in _frames(data, exception) if f['function'] == function)
+
+
+def outer(n):
+    padding = 'p' * 300  # noqa: F841
+    inner(n)
+
+
+def inner(n):
+    payload = b'x' * (n * 1024 * 1024)  # noqa: F841
+    rows = [{'id': i, 'body': 'y' * 100} for i in range(1000)]  # noqa: F841
+    raise ValueError('bad batch')
+
+
+def test_budget_is_spent_innermost_first():
+    client, sent = _client(max_bytes=500, max_var_bytes=250)
+    try:
+        outer(1)
+    except ValueError:
+        client.captureException()
+
+    inner_vars = _vars(sent[0], 'inner')
+    assert inner_vars['payload'].startswith("b'xxx") and inner_vars['payload'].endswith('<1048326 more>')
+    assert inner_vars['rows'].startswith("[{'body': ") or inner_vars['rows'].startswith("[{'id': ")
+    assert '...<' in inner_vars['rows']
+    outer_vars = _vars(sent[0], 'outer')
+    assert 'padding' not in outer_vars
+    assert outer_vars['...'].startswith('<2 locals over the budget')
+
+
+def test_total_size_is_bounded():
+    client, sent = _client(max_bytes=4096)
+    try:
+        outer(50)
+    except ValueError:
+        client.captureException()
+
+    total = sum(len(v) for f in _frames(sent[0]) for v in (f.get('vars') or {}).values())
+    assert total <= 4096 + 200
+
+
+def test_skipped_types_are_described():
+    client, sent = _client(skip_types=['raven_python_lambda.tests.test_frames.Frame'])
+    frame = Frame()  # noqa: F841
+    try:
+        raise ValueError('bad frame')
+    except ValueError:
+        client.captureException()
+
+    f_vars = _vars(sent[0], 'test_skipped_types_are_described')
+    assert f_vars['frame'] == '<raven_python_lambda.tests.test_frames.Frame of shape (1000000, 20), skipped>'
+
+
+def test_chained_exceptions():
+    client, sent = _client()
+    try:
+        try:
+            inner(0)
+        except ValueError:
+            raise RuntimeError('retry failed')
+    except RuntimeError:
+        client.captureException()
+
+    assert [v['type'] for v in sent[0]['exception']['values']] == ['ValueError', 'RuntimeError']
+    assert 'rows' in _vars(sent[0], 'inner', exception=0)
+
+
+@pytest.mark.parametrize('value,limit,expected', [
+    ('abc', 10, "'abc'"),
+    ('a' * 20, 5, "'aaaaa'...<15 more>"),
+    (list(range(100)), 20, '[0, 1, 2, 3, 4, 5, ...<94 more>]'),
+    ({'a': {'b': {'c': {'d': 1}}}}, 100, "{'a': {'b': {'c': {...1 items}}}}"),
+    (3.5, 10, '3.5'),
+])
+def test_repr(value, limit, expected):
+    assert LocalsBudget().repr(value, limit) == expected
+
+
+def test_dict_keys_are_sanitized():
+    client, sent = _client()
+    creds = {'password': 'hunter2', 'db': {'user': 'admin', 'api_key': 'abc123'}}  # noqa: F841
+    try:
+        raise ValueError('bad credentials')
+    except ValueError:
+        client.captureException()
+
+    rendered = _vars(sent[0], 'test_dict_keys_are_sanitized')['creds']
+    assert 'hunter2' not in rendered and 'abc123' not in rendered
+    assert "'password': '********'" in rendered
+    assert "'user': 'admin'" in rendered
+
+
+def test_disabled_by_default(monkeypatch, wrapper_factory):
+    monkeypatch.delenv('SENTRY_LOCALS_BUDGET', raising=False)
+    client = wrapper_factory().config['raven_client'].get_client()
+    assert 'raven.events.Exception' not in client.module_cache
+
+
+def test_wrapper_installs_the_budget(wrapper_factory, sent_events):
+    wrapper = wrapper_factory(locals_budget=True, locals_max_bytes=1024)
+
+    @wrapper
+    def handler(event, context):
+        blob = 'z' * 10 * 1024 * 1024  # noqa: F841
+        raise ValueError('oops')
+
+    with pytest.raises(ValueError):
+        handler({}, FakeContext())
+
+    assert _vars(sent_events[0], 'handler')['blob'].endswith('more>')
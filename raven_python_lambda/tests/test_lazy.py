@@ -0,0 +1,94 @@
+"""
+.. module: raven_python_lambda.tests.test_lazy
+    :platform: Unix
+    :copyright: (c) 2017 by Netflix Inc., see AUTHORS for more
+    :license: Apache, see LICENSE for more details.
+"""
+import os
+import subprocess
+import sys
+
+import pytest
+
+from raven_python_lambda import RavenLambdaWrapper
+from raven_python_lambda.lazy import LazyClient
+from raven_python_lambda.tests.conftest import FakeContext
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Cumulative time `python -X importtime` may report for the package. Raven alone
+# takes a couple of hundred milliseconds, so this catches it sneaking back in.
+IMPORT_BUDGET_US = int(os.environ.get("RAVEN_LAMBDA_IMPORT_BUDGET_MS", 100)) * 1000
+
+HEAVY_MODULES = ("raven", "boto3", "botocore", "psutil")
+
+
+def _python(code, *args):
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    return subprocess.run([sys.executable] + list(args) + ["-c", code], env=env, cwd=ROOT,
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True, check=True)
+
+
+@pytest.mark.skipif(sys.version_info < (3, 7), reason="-X importtime requires Python 3.7")
+def test_cold_import_stays_within_budget():
+    # take the best of a few runs to keep the check stable on busy machines
+    timings = []
+    for _ in range(3):
+        result = _python("import raven_python_lambda", "-X", "importtime")
+        for line in result.stderr.splitlines():
+            fields = [f.strip() for f in line.split("|")]
+            if fields[-1] == "raven_python_lambda":
+                timings.append(int(fields[1]))
+
+    assert min(timings) < IMPORT_BUDGET_US, "importing raven_python_lambda took %dus" % min(timings)
+
+
+@pytest.mark.skipif(sys.version_info < (3, 5), reason="subprocess.run requires Python 3.5")
+def test_import_does_not_load_heavy_dependencies():
+    code = "import sys, raven_python_lambda; " \
+           "print(','.join(sorted(m for m in sys.modules if m.split('.')[0] in %r)))" % (HEAVY_MODULES,)
+    assert _python(code).stdout.strip() == ""
+
+
+@pytest.mark.skipif(sys.version_info < (3, 5), reason="subprocess.run requires Python 3.5")
+def test_logging_is_configured_by_the_wrapper():
+    code = "import logging, raven_python_lambda; " \
+           "print(len(logging.getLogger().handlers)); " \
+           "raven_python_lambda.RavenLambdaWrapper({'logging': False}); " \
+           "print(type(logging.getLogger().handlers[0]).__name__)"
+    assert _python(code).stdout.split() == ["0", "StreamHandler"]
+
+
+def test_client_is_built_on_first_use():
+    wrapper = RavenLambdaWrapper()
+    client = wrapper.config["raven_client"]
+    assert isinstance(client, LazyClient)
+
+    @wrapper
+    def f(event, context):
+        pass
+
+    f({}, FakeContext())
+    assert not client.configured
+
+    # breadcrumbs recorded so far are replayed into the client
+    crumbs = client.context.breadcrumbs.get_buffer()
+    assert client.configured
+    assert crumbs[-1]["category"] == "lambda"
+
+
+def test_setups_run_once_the_client_is_built():
+    built = []
+    client = LazyClient(lambda: object())
+    client.when_built(built.append)
+    assert built == []
+
+    real = client.get_client()
+    client.when_built(built.append)
+    assert built == [real, real]
+
+    # and again for the client built after a reset
+    client.reset()
+    rebuilt = client.get_client()
+    assert rebuilt is not real
+    assert built[-2:] == [rebuilt, rebuilt]
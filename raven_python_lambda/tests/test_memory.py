@@ -0,0 +1,90 @@
+"""
+.. module: raven_python_lambda.tests.test_memory
+    :platform: Unix
+    :copyright: (c) 2017 by Netflix Inc., see AUTHORS for more
+    :license: Apache, see LICENSE for more details.
+"""
+import os
+import time
+
+import psutil
+
+from raven_python_lambda import RavenLambdaWrapper, memory
+from raven_python_lambda.memory import MB, MemoryTracker, next_interval, read_rss, MIN_INTERVAL, MAX_INTERVAL
+from raven_python_lambda.tests.conftest import FakeContext
+
+
+def test_read_rss_matches_psutil():
+    expected = psutil.Process(os.getpid()).memory_info().rss
+    assert abs(read_rss() - expected) < 10 * MB
+
+
+def test_interval_shrinks_towards_the_threshold():
+    intervals = [next_interval(p, 0.75) for p in (0.0, 0.25, 0.5, 0.7, 0.75, 0.9)]
+    assert intervals == sorted(intervals, reverse=True)
+    assert intervals[0] == MAX_INTERVAL
+    assert intervals[-1] == MIN_INTERVAL
+
+
+def test_tracker_flags_steady_growth_only():
+    limit = 512 * MB
+
+    steady = MemoryTracker(window=10)
+    for i in range(10):
+        steady.record(200 * MB + (i % 2) * MB)  # noise, no trend
+    assert not steady.leak_suspected(limit, horizon=100)
+
+    leaking = MemoryTracker(window=10)
+    for i in range(10):
+        leaking.record(200 * MB + i * 5 * MB)
+    assert abs(leaking.growth_per_invocation() - 5 * MB) < 1
+    assert leaking.leak_suspected(limit, horizon=100)
+    assert not leaking.leak_suspected(limit, horizon=10)
+
+
+def _capturing_wrapper(config):
+    wrapper = RavenLambdaWrapper(dict(logging=False, capture_timeout_warnings=False, **config))
+    client = wrapper.config['raven_client'].get_client()
+    messages = []
+    client.captureMessage = lambda message, **kwargs: messages.append((message, kwargs))
+    return wrapper, messages
+
+
+def test_leak_is_reported_once(monkeypatch):
+    rss = [60 * MB]
+
+    def growing():
+        rss[0] += MB
+        return rss[0]
+
+    monkeypatch.setattr(memory, '_reader', growing)
+    monkeypatch.setattr(memory, '_trackers', {})
+    wrapper, messages = _capturing_wrapper(dict(memory_leak_window=5, memory_leak_horizon=1000))
+
+    @wrapper
+    def handler(event, context):
+        pass
+
+    for _ in range(10):
+        handler({}, FakeContext(memory_limit_in_mb=128))
+
+    leaks = [kwargs['extra'] for message, kwargs in messages if message == 'Memory Leak Warning']
+    assert len(leaks) == 1
+    assert leaks[0]['MemoryGrowthPerInvocationInMB'] == 1.0
+    assert leaks[0]['MemoryPeakInMB'] > 60
+
+
+def test_memory_warning_reports_peak(monkeypatch):
+    monkeypatch.setattr(memory, '_reader', lambda: 120 * MB)
+    wrapper, messages = _capturing_wrapper({})
+
+    @wrapper
+    def handler(event, context):
+        time.sleep(0.7)
+
+    handler({}, FakeContext(memory_limit_in_mb=128))
+
+    warnings = [kwargs['extra'] for message, kwargs in messages if message == 'Memory Usage Warning']
+    assert len(warnings) == 1
+    assert warnings[0]['MemoryPeakInMB'] == 120
+    assert 'MemoryGrowthPerInvocationInMB' in warnings[0]
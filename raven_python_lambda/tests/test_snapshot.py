@@ -0,0 +1,94 @@
+"""
+.. module: raven_python_lambda.tests.test_snapshot
+    :platform: Unix
+    :copyright: (c) 2017 by Netflix Inc., see AUTHORS for more
+    :license: Apache, see LICENSE for more details.
+"""
+import json
+
+from raven_python_lambda.snapshot import Snapshot, ContextSnapshot, REDACTED
+from raven_python_lambda.tests.conftest import FakeContext
+
+
+class CountingRepr(object):
+    calls = 0
+
+    def __repr__(self):
+        CountingRepr.calls += 1
+        return 'CountingRepr()'
+
+
+def test_nothing_is_serialized_until_captured():
+    CountingRepr.calls = 0
+    snapshot = Snapshot({'value': CountingRepr()})
+    assert CountingRepr.calls == 0
+
+    assert snapshot.__sentry__() == {'value': 'CountingRepr()'}
+    snapshot.__sentry__()
+    assert CountingRepr.calls == 1
+
+
+def test_budgets_truncate_with_markers():
+    snapshot = Snapshot({
+        'list': list(range(10)),
+        'deep': {'a': {'b': {'c': 1}}},
+        'long': 'x' * 100,
+    }, max_bytes=100, max_depth=2, max_list_length=3)
+
+    result = snapshot.__sentry__()
+    assert result['list'] == [0, 1, 2, '<truncated 7 items>']
+    assert result['deep'] == {'a': '<dict of 1 keys>'}
+    assert result['long'].endswith('chars>')
+    assert len(json.dumps(result)) < 200
+
+
+def test_byte_budget_stops_walking_large_batches():
+    records = [{'id': i, 'data': 'x' * 1000} for i in range(1000)]
+    result = Snapshot({'Records': records}, max_bytes=4096, max_list_length=10000).__sentry__()
+
+    assert len(result['Records']) < 10
+    assert result['Records'][-1].startswith('<truncated')
+
+
+def test_redacts_configured_keys():
+    event = {'headers': {'Authorization': 'Bearer abc', 'Host': 'example.com'}, 'password': 'hunter2'}
+    result = Snapshot(event, redact_keys=['authorization', 'password']).__sentry__()
+
+    assert result == {'headers': {'Authorization': REDACTED, 'Host': 'example.com'}, 'password': REDACTED}
+
+
+def _context():
+    return FakeContext(function_name='my-function', aws_request_id='abc-123', memory_limit_in_mb=128)
+
+
+def test_context_snapshot():
+    snapshot = ContextSnapshot(_context()).__sentry__()
+    assert 299000 < snapshot.pop('remaining_time_in_millis') <= 300000
+    assert snapshot == {
+        'function_name': 'my-function',
+        'aws_request_id': 'abc-123',
+        'memory_limit_in_mb': 128,
+    }
+
+
+def test_wrapper_attaches_snapshot_to_captured_exceptions(wrapper_factory, sent_events):
+    wrapper = wrapper_factory()
+
+    @wrapper
+    def handler(event, context):
+        raise ValueError('boom')
+
+    try:
+        handler({'token': 'abc', 'body': 'hello'}, _context())
+    except ValueError:
+        pass
+
+    # raven reprs the strings it is handed
+    extra = sent_events[0]['extra']
+    assert extra['event'] == {"'token'": repr(REDACTED), "'body'": "'hello'"}
+    assert extra['context']["'aws_request_id'"] == "'abc-123'"
+
+
+def test_binary_data_is_summarized():
+    result = Snapshot({'text': 'hello', 'data': bytearray(b'\x00\xff' * 8)}).__sentry__()
+    assert result == {'text': 'hello', 'data': '<16 bytes>'}
@@ -0,0 +1,151 @@
+"""
+.. module: raven_python_lambda.tests.test_sources
+    :platform: Unix
+    :copyright: (c) 2017 by Netflix Inc., see AUTHORS for more
+    :license: Apache, see LICENSE for more details.
+"""
+import pytest
+
+from raven_python_lambda import sources
+from raven_python_lambda.tests.conftest import FakeContext
+
+API_GATEWAY_V1 = {
+    'path': '/users',
+    'httpMethod': 'GET',
+    'headers': {'Host': 'api.example.com'},
+    'requestContext': {
+        'apiId': 'abc123',
+        'stage': 'prod',
+        'httpMethod': 'GET',
+        'identity': {'sourceIp': '10.0.0.1', 'userAgent': 'curl', 'cognitoIdentityId': 'identity'},
+    },
+}
+
+API_GATEWAY_V2 = {
+    'version': '2.0',
+    'routeKey': 'GET /users',
+    'rawPath': '/users',
+    'headers': {'host': 'api.example.com'},
+    'requestContext': {
+        'apiId': 'abc123',
+        'stage': '$default',
+        'domainName': 'api.example.com',
+        'routeKey': 'GET /users',
+        'http': {'method': 'GET', 'path': '/users', 'sourceIp': '10.0.0.1', 'userAgent': 'curl'},
+        'authorizer': {'jwt': {'claims': {'sub': 'user-1'}}},
+    },
+}
+
+ALB = {
+    'httpMethod': 'POST',
+    'path': '/hook',
+    'headers': {'host': 'alb.example.com', 'x-forwarded-for': '10.0.0.1, 10.0.0.2'},
+    'requestContext': {
+        'elb': {'targetGroupArn': 'arn:aws:elasticloadbalancing:us-east-1:123456789012:targetgroup/my-targets/73e2'},
+    },
+}
+
+CLOUDWATCH = {
+    'detail-type': 'AWS API Call via CloudTrail',
+    'source': 'aws.s3',
+    'region': 'us-east-1',
+    'detail': {'userIdentity': {'principalId': 'principal'}},
+}
+
+
+def _records(source, **record):
+    record['eventSource'] = source
+    return {'Records': [record]}
+
+
+SQS = _records('aws:sqs', messageId='m-1', eventSourceARN='arn:aws:sqs:us-east-1:123456789012:my-queue')
+SNS = {'Records': [{'EventSource': 'aws:sns', 'Sns': {
+    'TopicArn': 'arn:aws:sns:us-east-1:123456789012:my-topic', 'MessageId': 'm-1', 'Subject': None}}]}
+S3 = _records('aws:s3', eventName='ObjectCreated:Put', s3={'bucket': {'name': 'my-bucket'}, 'object': {'key': 'a.txt'}})
+KINESIS = _records('aws:kinesis', eventID='shardId-000000000001:1',
+                   eventSourceARN='arn:aws:kinesis:us-east-1:123456789012:stream/my-stream',
+                   kinesis={'sequenceNumber': '1'})
+DYNAMODB = _records('aws:dynamodb',
+                    eventSourceARN='arn:aws:dynamodb:us-east-1:123456789012:table/my-table/stream/2017-01-01',
+                    dynamodb={'SequenceNumber': '1'})
+
+
+@pytest.mark.parametrize('event,source,tags', [
+    (API_GATEWAY_V1, 'apigateway.v1', {'api_id': 'abc123', 'api_stage': 'prod', 'http_method': 'GET'}),
+    (API_GATEWAY_V2, 'apigateway.v2', {'api_id': 'abc123', 'http_method': 'GET', 'route_key': 'GET /users'}),
+    (ALB, 'alb', {'alb_target_group': 'my-targets', 'http_method': 'POST'}),
+    (CLOUDWATCH, 'cloudwatch', {'cloudwatch_principal_id': 'principal', 'cloudwatch_region': 'us-east-1'}),
+    (SQS, 'aws:sqs', {'sqs_queue': 'my-queue'}),
+    (SNS, 'aws:sns', {'sns_topic': 'my-topic'}),
+    (S3, 'aws:s3', {'s3_bucket': 'my-bucket', 's3_event_name': 'ObjectCreated:Put'}),
+    (KINESIS, 'aws:kinesis', {'kinesis_stream': 'my-stream', 'kinesis_shard': 'shardId-000000000001'}),
+    (DYNAMODB, 'aws:dynamodb', {'dynamodb_table': 'my-table'}),
+])
+def test_extract(event, source, tags):
+    found, data = sources.extract(event)
+    assert found == source
+    for key, value in tags.items():
+        assert data['tags'][key] == value
+
+
+@pytest.mark.parametrize('event', [None, [], 'text', {}, {'key': 'value'}, {'Records': []}])
+def test_unknown_events(event):
+    assert sources.extract(event) == (sources.classify(event), {})
+
+
+def test_arn_names():
+    assert sources.arn_name('arn:aws:sqs:us-east-1:123456789012:my-queue') == 'my-queue'
+    assert sources.arn_name(None) is None
+    assert sources.stream_table_name(
+        'arn:aws:dynamodb:us-east-1:123456789012:table/my-table/stream/2017-01-01T00:00:00.000') == 'my-table'
+    assert sources.stream_table_name('') is None
+
+
+def test_users():
+    assert sources.extract(API_GATEWAY_V1)[1]['user']['ip_address'] == '10.0.0.1'
+    assert sources.extract(API_GATEWAY_V2)[1]['user'] == {'ip_address': '10.0.0.1', 'user_agent': 'curl', 'id': 'user-1'}
+    assert sources.extract(ALB)[1]['user'] == {'ip_address': '10.0.0.1'}
+
+
+def test_register(monkeypatch):
+    monkeypatch.setattr(sources, 'EXTRACTORS', dict(sources.EXTRACTORS))
+    sources.register('aws:ses', lambda event: {'tags': {'ses_source': event['Records'][0]['ses']['mail']['source']}})
+    sources.register('My Event', lambda event: {'tags': {'mine': event['detail']['id']}})
+
+    event = _records('aws:ses', ses={'mail': {'source': 'me@example.com'}})
+    assert sources.extract(event) == ('aws:ses', {'tags': {'ses_source': 'me@example.com'}})
+    assert sources.extract({'detail-type': 'My Event', 'detail': {'id': 1}}) == ('My Event', {'tags': {'mine': 1}})
+    # other detail types still get the CloudWatch tags
+    assert sources.classify({'detail-type': 'Scheduled Event', 'detail': {}}) == 'cloudwatch'
+
+
+def test_failing_extractor(monkeypatch):
+    monkeypatch.setattr(sources, 'EXTRACTORS', dict(sources.EXTRACTORS))
+    assert sources.extract({'requestContext': {'elb': {}}, 'headers': None}) == ('alb', {
+        'tags': {'alb_target_group': None, 'http_method': None},
+        'breadcrumb': {'http_method': None, 'host': None, 'path': None},
+    })
+    sources.register('alb', lambda event: event['missing'])
+    assert sources.extract(ALB) == ('alb', {})
+
+
+@pytest.mark.parametrize('event', [API_GATEWAY_V2, CLOUDWATCH])
+def test_wrapper_context(event, wrapper_factory, sent_events):
+    wrapper = wrapper_factory()
+
+    @wrapper
+    def handler(event, context):
+        raise ValueError('oops')
+
+    with pytest.raises(ValueError):
+        handler(event, FakeContext())
+
+    data = sent_events[0]
+    # the event is kept next to the source's tags
+    assert 'event' in data['extra']
+    if event is API_GATEWAY_V2:
+        assert data['tags']['http_method'] == 'GET'
+        assert data['user']['id'] == 'user-1'
+        assert data['breadcrumbs']['values'][0]['data']['path'] == '/users'
+    else:
+        assert data['tags']['cloudwatch_principal_id'] == 'principal'
@@ -0,0 +1,97 @@
+"""
+.. module: raven_python_lambda.tests.test_timeouts
+    :platform: Unix
+    :copyright: (c) 2017 by Netflix Inc., see AUTHORS for more
+    :license: Apache, see LICENSE for more details.
+"""
+import threading
+import time
+
+from raven.transport.base import Transport
+
+from raven_python_lambda import timeout_lead
+from raven_python_lambda.compat import monotonic
+from raven_python_lambda.tests.conftest import FakeContext
+from raven_python_lambda.transports import LatencyEstimator, LatencyTransport, find_transport, get_transport
+
+
+class SlowTransport(Transport):
+    def __init__(self, delay):
+        self.delay = delay
+
+    def send(self, url, data, headers):
+        time.sleep(self.delay)
+
+
+def test_latency_estimator():
+    estimator = LatencyEstimator()
+    assert estimator.estimate == 0
+
+    for _ in range(50):
+        estimator.record(0.1)
+    assert abs(estimator.estimate - 0.1) < 0.01
+
+    # one slow send moves the estimate well past it
+    estimator.record(1.0)
+    assert estimator.estimate > 0.5
+
+
+def test_latency_transport_records_sends():
+    transport = LatencyTransport(SlowTransport(0.05))
+    transport.send('http://localhost', b'', {})
+    transport.flush()
+
+    assert transport.send_latency.samples == 1
+    assert transport.flush_latency.samples == 0
+    assert transport.expected_delivery() >= 0.05
+
+
+def test_timeout_lead(wrapper_factory):
+    wrapper = wrapper_factory(capture_memory_warnings=False)
+    # nothing was sent yet
+    assert timeout_lead(wrapper.config, 10) == 0.5
+
+    client = wrapper.config['raven_client'].get_client()
+    measured = find_transport(get_transport(client), LatencyTransport)
+    for _ in range(50):
+        measured.send_latency.record(2.0)
+
+    # the estimate plus the 300ms flush safety margin
+    assert 2.3 <= timeout_lead(wrapper.config, 10) < 2.35
+    assert timeout_lead(wrapper.config, 3) == 1.5
+
+
+def test_timeout_is_captured_with_the_handler_stack(wrapper_factory):
+    wrapper = wrapper_factory(send=True, capture_memory_warnings=False, capture_timeout_warnings=True,
+                              timeout_warning_threshold=0.99)
+    client = wrapper.config['raven_client'].get_client()
+    measured = find_transport(get_transport(client), LatencyTransport)
+    # sends were observed to take ~400ms, so the timeout is captured ~700ms before the end
+    for _ in range(10):
+        measured.send_latency.record(0.4)
+
+    captured = []
+    client.is_enabled = lambda: True
+    client.send = lambda **data: captured.append((monotonic(), data))
+    released = threading.Event()
+
+    @wrapper
+    def stuck_handler(event, context):
+        released.wait(5)
+
+    context = FakeContext(1500)
+    thread = threading.Thread(target=stuck_handler, args=({}, context))
+    thread.start()
+    while not captured and monotonic() < context.deadline:
+        time.sleep(0.01)
+    released.set()
+    thread.join()
+
+    timeouts = [(at, data) for at, data in captured if data['message'] == 'Function Timed Out']
+    assert len(timeouts) == 1
+    at, data = timeouts[0]
+    assert context.deadline - at > 0.6
+
+    functions = [frame['function'] for frame in data['stacktrace']['frames']]
+    assert functions[-1] == 'wait'
+    assert 'stuck_handler' in functions
@@ -0,0 +1,58 @@
+"""
+.. module: raven_python_lambda.tests.test_watchdog
+    :platform: Unix
+    :copyright: (c) 2017 by Netflix Inc., see AUTHORS for more
+    :license: Apache, see LICENSE for more details.
+"""
+import random
+import threading
+
+from raven_python_lambda.watchdog import Watchdog, TimerGroup
+
+
+def test_heap_stays_ordered_after_cancellations():
+    watchdog = Watchdog()
+    deadlines = [watchdog.schedule(random.uniform(60, 120), lambda: None) for _ in range(200)]
+
+    for d in random.sample(deadlines, 150):
+        watchdog.cancel(d)
+
+    assert len(watchdog) == 50
+    heap = watchdog._heap
+    for i, d in enumerate(heap):
+        assert d.index == i
+        if i:
+            assert not d < heap[(i - 1) // 2]
+
+
+def test_deadlines_fire_in_order():
+    watchdog = Watchdog()
+    fired = []
+    done = threading.Event()
+
+    watchdog.schedule(0.06, lambda: (fired.append(3), done.set()))
+    watchdog.schedule(0.02, fired.append, (1,))
+    watchdog.schedule(0.04, fired.append, (2,))
+
+    assert done.wait(2)
+    assert fired == [1, 2, 3]
+    assert len(watchdog) == 0
+
+
+def test_cancelled_group_cannot_rearm():
+    watchdog = Watchdog()
+    group = TimerGroup(watchdog)
+    fired = threading.Event()
+
+    group.schedule(0.05, fired.set)
+    group.cancel()
+
+    assert group.schedule(0.01, fired.set) is None
+    assert not fired.wait(0.2)
+    assert len(watchdog) == 0
+
+
+def test_group_keeps_an_empty_watchdog():
+    # a Watchdog with nothing scheduled is falsy, it must not be swapped for the global one
+    watchdog = Watchdog()
+    assert TimerGroup(watchdog).watchdog is watchdog
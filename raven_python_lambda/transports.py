@@ -0,0 +1,215 @@
+"""
+.. module: raven_python_lambda.transports
+    :platform: Unix
+    :copyright: (c) 2017 by Netflix Inc., see AUTHORS for more
+    :license: Apache, see LICENSE for more details.
+
+Helpers for layering behaviour on top of the transport a raven client picked
+for its DSN.
+"""
+import logging
+import threading
+
+from raven.transport.base import Transport
+
+from raven_python_lambda import metrics, registry, telemetry
+from raven_python_lambda.compat import monotonic
+
+logger = logging.getLogger(__name__)
+
+
+class TransportWrapper(Transport):
+    """
+    Base class for transports that delegate to another transport instance.
+
+    Attributes that are not defined on the wrapper (`sqs_client`, `queue_url`,
+    ...) are looked up on the wrapped transport.
+    """
+    def __init__(self, transport):
+        self.transport = transport
+        self.scheme = transport.scheme
+
+    def __getattr__(self, name):
+        if name == 'transport':
+            raise AttributeError(name)
+        return getattr(self.transport, name)
+
+    def send(self, url, data, headers):
+        self.transport.send(url, data, headers)
+
+    def flush(self, timeout=None):
+        flush = getattr(self.transport, 'flush', None)
+        if flush:
+            flush(timeout=timeout)
+
+
+class LatencyEstimator(object):
+    """
+    Exponentially weighted mean and mean deviation of observed latencies, as TCP
+    estimates round trip times. `estimate` is the mean plus four deviations, so a
+    few slow sends (a cold TLS handshake, a throttled SQS call) push it up quickly.
+    """
+    def __init__(self, alpha=0.125, beta=0.25):
+        self.alpha = alpha
+        self.beta = beta
+        self.mean = None
+        self.deviation = 0.0
+        self.samples = 0
+        self._lock = threading.Lock()
+
+    def record(self, elapsed):
+        with self._lock:
+            self.samples += 1
+            if self.mean is None:
+                self.mean = elapsed
+                self.deviation = elapsed / 2.0
+            else:
+                self.deviation += self.beta * (abs(elapsed - self.mean) - self.deviation)
+                self.mean += self.alpha * (elapsed - self.mean)
+
+    @property
+    def estimate(self):
+        """Seconds, or 0 before anything was observed."""
+        with self._lock:
+            return 0.0 if self.mean is None else self.mean + 4 * self.deviation
+
+
+class LatencyTransport(TransportWrapper):
+    """
+    Times sends and flushes of the wrapped transport. The estimates are kept per
+    transport instance, so they carry over across warm invocations and are shared
+    by every client using that transport. The time is also added to the running
+    invocation's telemetry and metrics.
+    """
+    # flushes quicker than this had nothing to send and aren't observations
+    MIN_FLUSH_SAMPLE = 0.001
+
+    def __init__(self, transport):
+        super(LatencyTransport, self).__init__(transport)
+        self.send_latency, self.flush_latency = registry.latencies.get(
+            transport, lambda: (LatencyEstimator(), LatencyEstimator()))
+
+    def send(self, url, data, headers):
+        started = monotonic()
+        try:
+            self.transport.send(url, data, headers)
+        except Exception:
+            metrics.increment('SendErrors')
+            raise
+        else:
+            metrics.increment('EventsSent')
+        finally:
+            elapsed = monotonic() - started
+            self.send_latency.record(elapsed)
+            telemetry.record_transport_time(elapsed)
+            metrics.record('SendTime', elapsed)
+
+    def flush(self, timeout=None):
+        started = monotonic()
+        try:
+            super(LatencyTransport, self).flush(timeout=timeout)
+        finally:
+            elapsed = monotonic() - started
+            if elapsed >= self.MIN_FLUSH_SAMPLE:
+                self.flush_latency.record(elapsed)
+                telemetry.record_transport_time(elapsed)
+                metrics.record('FlushTime', elapsed)
+
+    def expected_delivery(self):
+        """Seconds one event is expected to take to be sent and flushed."""
+        return self.send_latency.estimate + self.flush_latency.estimate
+
+
+class SpoolTransport(TransportWrapper):
+    """
+    Spools events the wrapped transport fails on, and events sent past the spool's
+    deadline, to disk instead of retrying them; see `raven_python_lambda.spool`.
+    """
+    def __init__(self, transport, spool):
+        super(SpoolTransport, self).__init__(transport)
+        self.spool = spool
+        self._drainer = None
+
+    def send(self, url, data, headers):
+        deadline = self.spool.deadline
+        if deadline is not None and monotonic() >= deadline:
+            self.spool.append(url, data, headers)
+            metrics.increment('EventsSpooled')
+            return
+
+        try:
+            self.transport.send(url, data, headers)
+        except Exception:
+            logger.warning('Unable to send Sentry event, spooling it', exc_info=True)
+            self.spool.append(url, data, headers)
+            metrics.increment('EventsSpooled')
+
+    def start_drain(self, budget):
+        """Sends spooled events on a background thread, for at most `budget` seconds."""
+        if self._drainer is not None and self._drainer.is_alive():
+            return
+        self._drainer = threading.Thread(target=self._drain, args=(budget,), name='raven_python_lambda.SpoolDrain')
+        self._drainer.daemon = True
+        self._drainer.start()
+
+    def _drain(self, budget):
+        try:
+            if self.spool.drain(self.transport.send, budget):
+                super(SpoolTransport, self).flush()
+        except Exception:
+            logger.exception('Unable to drain the Sentry spool')
+
+    def flush(self, timeout=None):
+        deadline = None if timeout is None else monotonic() + timeout
+        if self._drainer is not None:
+            self._drainer.join(timeout)
+        super(SpoolTransport, self).flush(timeout=None if deadline is None else max(deadline - monotonic(), 0))
+
+
+def innermost_transport(transport):
+    """The transport at the bottom of a chain of `TransportWrapper`s, the one that actually sends."""
+    while isinstance(transport, TransportWrapper):
+        transport = transport.transport
+    return transport
+
+
+def find_transport(transport, cls):
+    """Returns the first transport of type `cls` in a chain of `TransportWrapper`s."""
+    while transport is not None:
+        if isinstance(transport, cls):
+            return transport
+        transport = getattr(transport, 'transport', None)
+    return None
+
+
+def get_transport(client):
+    """Returns the transport instance the client sends through, or None without a DSN."""
+    return client.remote.get_transport()
+
+
+def warm_transport(client):
+    """
+    Builds the client's transport and lets it resolve whatever it would otherwise
+    look up on the first event (e.g. the SQS queue url).
+    """
+    transport = get_transport(client)
+    warm = getattr(transport, 'warm', None)
+    if warm is not None:
+        warm()
+    return transport
+
+
+def install_transport_wrapper(client, wrapper_cls, *args, **kwargs):
+    """
+    Wraps the client's current transport in `wrapper_cls`.
+
+    raven caches the transport instance on the client's `RemoteConfig`, so this
+    swaps the cached instance for the wrapped one.
+    """
+    transport = get_transport(client)
+    if transport is None:
+        return None
+
+    wrapper = wrapper_cls(transport, *args, **kwargs)
+    client.remote._transport = wrapper
+    return wrapper
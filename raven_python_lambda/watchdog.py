@@ -0,0 +1,188 @@
+"""
+.. module: raven_python_lambda.watchdog
+    :platform: Unix
+    :copyright: (c) 2017 by Netflix Inc., see AUTHORS for more
+    :license: Apache, see LICENSE for more details.
+
+A single, long-lived watchdog thread that runs deadline callbacks for every
+invocation handled by the process. Deadlines live in an indexed binary heap so
+that both registering and cancelling one is O(log n).
+"""
+import os
+import logging
+import threading
+
+from raven_python_lambda.compat import monotonic
+
+logger = logging.getLogger(__name__)
+
+
+class Deadline(object):
+    """A scheduled callback. Returned by `Watchdog.schedule`."""
+    __slots__ = ('when', 'seq', 'fn', 'args', 'index')
+
+    def __init__(self, when, seq, fn, args):
+        self.when = when
+        self.seq = seq
+        self.fn = fn
+        self.args = args
+        self.index = -1
+
+    def __lt__(self, other):
+        return (self.when, self.seq) < (other.when, other.seq)
+
+    @property
+    def active(self):
+        return self.index >= 0
+
+
+class Watchdog(object):
+    """
+    Runs callbacks at their deadlines on one daemon thread.
+
+    The thread is started lazily on the first `schedule` call and is restarted
+    after a fork, so there is never more than one per process.
+    """
+    def __init__(self):
+        self._heap = []
+        self._seq = 0
+        self._cond = threading.Condition(threading.Lock())
+        self._thread = None
+        self._pid = None
+
+    def __len__(self):
+        return len(self._heap)
+
+    def schedule(self, delay, fn, args=()):
+        """Runs `fn(*args)` in `delay` seconds. Returns a `Deadline` handle."""
+        with self._cond:
+            self._ensure_thread()
+            self._seq += 1
+            deadline = Deadline(monotonic() + max(delay, 0), self._seq, fn, tuple(args))
+            self._push(deadline)
+            if deadline.index == 0:
+                self._cond.notify()
+            return deadline
+
+    def cancel(self, deadline):
+        """Removes a pending deadline. Cancelling a fired deadline is a no-op."""
+        with self._cond:
+            if deadline.active:
+                self._remove(deadline.index)
+
+    def _ensure_thread(self):
+        if self._pid == os.getpid() and self._thread and self._thread.is_alive():
+            return
+        if self._pid != os.getpid():
+            # deadlines inherited through fork belong to the parent's invocation
+            for d in self._heap:
+                d.index = -1
+            self._heap = []
+        self._thread = threading.Thread(target=self._run, name='raven_python_lambda.Watchdog')
+        self._thread.daemon = True
+        self._thread.start()
+        self._pid = os.getpid()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._heap or self._heap[0].when > monotonic():
+                    self._cond.wait(self._heap[0].when - monotonic() if self._heap else None)
+                deadline = self._heap[0]
+                self._remove(0)
+            try:
+                deadline.fn(*deadline.args)
+            except Exception:
+                logger.exception('Watchdog callback %r failed', deadline.fn)
+
+    # indexed heap primitives; callers must hold the lock
+
+    def _push(self, deadline):
+        deadline.index = len(self._heap)
+        self._heap.append(deadline)
+        self._sift_up(deadline.index)
+
+    def _remove(self, i):
+        heap = self._heap
+        removed = heap[i]
+        last = heap.pop()
+        if i < len(heap):
+            heap[i] = last
+            last.index = i
+            self._sift_up(i)
+            self._sift_down(last.index)
+        removed.index = -1
+        return removed
+
+    def _swap(self, i, j):
+        heap = self._heap
+        heap[i], heap[j] = heap[j], heap[i]
+        heap[i].index = i
+        heap[j].index = j
+
+    def _sift_up(self, i):
+        heap = self._heap
+        while i > 0:
+            parent = (i - 1) // 2
+            if not heap[i] < heap[parent]:
+                break
+            self._swap(i, parent)
+            i = parent
+
+    def _sift_down(self, i):
+        heap = self._heap
+        size = len(heap)
+        while True:
+            smallest = i
+            for child in (2 * i + 1, 2 * i + 2):
+                if child < size and heap[child] < heap[smallest]:
+                    smallest = child
+            if smallest == i:
+                break
+            self._swap(i, smallest)
+            i = smallest
+
+
+class TimerGroup(object):
+    """
+    The deadlines belonging to one invocation.
+
+    Callbacks may re-arm themselves through the group; once the group is
+    cancelled nothing else can be scheduled on it, so no work carries over into
+    the next invocation.
+    """
+    def __init__(self, watchdog=None):
+        self.watchdog = watchdog if watchdog is not None else get_watchdog()
+        self.deadlines = set()
+        self.cancelled = False
+        self._lock = threading.Lock()
+
+    def schedule(self, delay, fn, args=()):
+        with self._lock:
+            if self.cancelled:
+                return None
+            deadline = self.watchdog.schedule(delay, self._fire, (fn, args))
+            self.deadlines.add(deadline)
+            return deadline
+
+    def _fire(self, fn, args):
+        with self._lock:
+            if self.cancelled:
+                return
+            self.deadlines = set(d for d in self.deadlines if d.active)
+        fn(*args)
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+            deadlines, self.deadlines = self.deadlines, set()
+        for d in deadlines:
+            self.watchdog.cancel(d)
+
+
+_watchdog = Watchdog()
+
+
+def get_watchdog():
+    """Returns the process-wide watchdog."""
+    return _watchdog
@@ -0,0 +1,110 @@
+"""
+.. module: raven_python_lambda.workers
+    :platform: Unix
+    :copyright: (c) 2017 by Netflix Inc., see AUTHORS for more
+    :license: Apache, see LICENSE for more details.
+
+Exceptions raised in `multiprocessing` and `concurrent.futures` pool workers.
+
+A pool re-raises a worker's exception in the parent without the worker's
+traceback. Functions wrapped with `RavenLambdaWrapper.worker` build the Sentry
+event where the exception happened and attach it, encoded, to the exception
+itself, so it travels back over the pool's result pipe with it. When the
+wrapped handler captures an exception carrying worker events, the parent adds
+the invocation's context to them and sends them, instead of its own, through
+its transport once the invocation ends. Workers never send anything.
+
+Forked workers would otherwise inherit the parent's clients half-way through
+whatever they were doing: locks held by other threads, pooled connections,
+buffered SQS batches. After a fork (Python 3.7+), the child starts over with
+clients and transports of its own.
+"""
+import os
+import logging
+import threading
+
+from raven_python_lambda import metrics, registry, telemetry
+from raven_python_lambda.lazy import LazyClient, LazySentryHandler
+
+logger = logging.getLogger(__name__)
+
+# where the encoded events are attached; exceptions pickle their __dict__
+EVENTS_ATTR = '_raven_worker_events'
+
+
+def capture_in_worker(client, exc_info):
+    """Builds the event for `exc_info` in the worker and attaches it, encoded, to the exception."""
+    exc = exc_info[1]
+    if getattr(exc, EVENTS_ATTR, None):
+        # already captured by a worker further down
+        return
+    try:
+        client = client.get_client() if isinstance(client, LazyClient) else client
+        if not client.is_enabled() or not client.should_capture(exc_info):
+            return
+        data = client.build_msg('raven.events.Exception', exc_info=exc_info, extra={
+            'worker_pid': os.getpid(),
+            'worker_thread': threading.current_thread().name,
+        })
+        setattr(exc, EVENTS_ATTR, [client.encode(data)])
+    except Exception:
+        logger.exception('Unable to capture the exception raised in a worker')
+
+
+def worker_events(exc):
+    """The encoded events attached to `exc`, or to the exceptions it was raised from."""
+    seen = set()
+    while exc is not None and id(exc) not in seen:
+        seen.add(id(exc))
+        events = getattr(exc, EVENTS_ATTR, None)
+        if events:
+            return list(events)
+        exc = getattr(exc, '__cause__', None) or getattr(exc, '__context__', None)
+    return []
+
+
+def send_worker_event(client, encoded, raven_context=None):
+    """Sends an event built by a worker, with the invocation's tags, user, extra and breadcrumbs added."""
+    client = client.get_client() if isinstance(client, LazyClient) else client
+    if not client.is_enabled():
+        return
+    data = client.decode(encoded)
+    raven_context = raven_context or {}
+    tags = data.setdefault('tags', {})
+    for key, value in (raven_context.get('tags') or {}).items():
+        tags.setdefault(key, value)
+    extra = data.setdefault('extra', {})
+    for key, value in (raven_context.get('extra') or {}).items():
+        if key not in extra:
+            extra[key] = client.transform(value)
+    if raven_context.get('user'):
+        data.setdefault('user', raven_context['user'])
+    crumbs = raven_context.get('breadcrumbs') or {'values': client.context.breadcrumbs.get_buffer()}
+    if crumbs['values']:
+        data.setdefault('breadcrumbs', crumbs)
+    client.send(**data)
+
+
+def reset_after_fork():
+    """Drops the state a forked child inherited from the parent's clients and invocation."""
+    registry.reset_after_fork()
+    telemetry.reset_after_fork()
+    metrics.reset_after_fork()
+    for handler in logging.getLogger().handlers:
+        if isinstance(handler, LazySentryHandler):
+            handler.reset()
+
+
+_fork_hook_installed = False
+
+
+def install_fork_hook():
+    """Resets forked children with `reset_after_fork`, once per process. Returns False before Python 3.7."""
+    global _fork_hook_installed
+    register_at_fork = getattr(os, 'register_at_fork', None)
+    if register_at_fork is None:
+        return False
+    if not _fork_hook_installed:
+        register_at_fork(after_in_child=reset_after_fork)
+        _fork_hook_installed = True
+    return True
@@ -20,7 +20,8 @@ with open(os.path.join(ROOT, "raven_python_lambda", "__about__.py")) as f:
 install_requires = [
     'boto3',  # typically already on lambda but required for sqs
     'raven>=6.1.0',
-    'psutil>=5.2.2'
+    'psutil>=5.2.2',
+    'futures; python_version < "3.0"',  # concurrent.futures, for concurrent batch processing
 ]
 
 tests_require = [